@@ -70,13 +70,13 @@ echo "$COLOUR_VER" | grep -q -e "^0.4.*$" || \
 export PYTHONPATH="$PWD/utils:$PYTHONPATH"
 export PYTHONPATH="$PWD/tests:$PYTHONPATH"
 
-for M in sensor_fusion_utils capture_request_utils opencv_processing_utils image_processing_utils its_session_utils image_fov_utils zoom_capture_utils imu_processing_utils
+for M in sensor_fusion_utils capture_request_utils opencv_processing_utils image_processing_utils its_session_utils image_fov_utils zoom_capture_utils imu_processing_utils session_broker_utils noise_model_utils video_processing_utils lazy_import_utils
 do
     python "utils/${M}_tests.py" 2>&1 | grep -q "OK" || \
         echo ">> Unit test for $M failed" >&2
 done
 
-for M in run_all_unit_tests
+for M in run_all_unit_tests run_all_testbeds_tests warm_test_executor_tests
 do
     python "tools/$M.py" 2>&1 | grep -q "OK" || \
         echo ">> Unit test for $M failed" >&2
@@ -13,8 +13,11 @@
 # limitations under the License.
 """Verify feature combinations for stabilization, 10-bit, and frame rate."""
 
+import collections
+import concurrent.futures
 import logging
 import os
+import time
 
 from mobly import test_runner
 
@@ -32,10 +35,112 @@ _FPS_SELECTION_ATOL = 0.01
 _FPS_ATOL_CODEC = 1.2
 _FPS_ATOL_METADATA = 0.8
 
+# Recordings are analyzed on 1 worker while the next one is recorded, as the
+# stabilization check plots with pyplot, which is not thread-safe.
+_ANALYSIS_NUM_WORKERS = 1
 _NAME = os.path.splitext(os.path.basename(__file__))[0]
 _SEC_TO_NSEC = 1_000_000_000
 
 
+def _analyze_recording(recording_obj, gyro_events, combination_name,
+                       fps_range, hlg10, facing, log_path):
+  """Checks frame rate, stabilization and color space of a recording.
+
+  Args:
+    recording_obj: Camcorder recording object, pulled to log_path.
+    gyro_events: Gyroscope events collected while recording. None if the
+      recording is not stabilized.
+    combination_name: str; name of the feature combination for messages.
+    fps_range: list; target fps range.
+    hlg10: boolean; whether HLG 10-bit HDR is ON.
+    facing: Facing of the camera device.
+    log_path: Path for the log files.
+
+  Returns:
+    (list of failure messages, dict of seconds taken per stage)
+  """
+  failures = []
+  timings = {}
+  preview_file_name = recording_obj['recordedOutputPath'].split('/')[-1]
+  preview_file_name_with_path = os.path.join(log_path, preview_file_name)
+
+  # Verify FPS by inspecting the video clip
+  stage_start_time = time.time()
+  average_frame_rate_codec = video_processing_utils.get_average_frame_rate(
+      preview_file_name_with_path)
+  logging.debug('Average codec frame rate for %s is %f', combination_name,
+                average_frame_rate_codec)
+  if (average_frame_rate_codec > fps_range[1] + _FPS_ATOL_CODEC or
+      average_frame_rate_codec < fps_range[0] - _FPS_ATOL_CODEC):
+    failures.append(
+        f'{combination_name}: Average video clip frame rate '
+        f'{average_frame_rate_codec} exceeding the allowed range of '
+        f'({fps_range[0]}-{_FPS_ATOL_CODEC}, '
+        f'{fps_range[1]}+{_FPS_ATOL_CODEC})')
+
+  # Verify FPS by inspecting the result metadata
+  capture_results = recording_obj['captureMetadata']
+  assert len(capture_results) > 1
+  last_t = capture_results[-1]['android.sensor.timestamp']
+  first_t = capture_results[0]['android.sensor.timestamp']
+  average_frame_duration = (last_t - first_t) / (len(capture_results) - 1)
+  average_frame_rate_metadata = _SEC_TO_NSEC / average_frame_duration
+  logging.debug('Average metadata frame rate for %s is %f', combination_name,
+                average_frame_rate_metadata)
+  if (average_frame_rate_metadata > fps_range[1] + _FPS_ATOL_METADATA or
+      average_frame_rate_metadata < fps_range[0] - _FPS_ATOL_METADATA):
+    failures.append(
+        f'{combination_name}: Average frame rate '
+        f'{average_frame_rate_metadata} exceeding the allowed range of '
+        f'({fps_range[0]}-{_FPS_ATOL_METADATA}, '
+        f'{fps_range[1]}+{_FPS_ATOL_METADATA})')
+  timings['frame_rate'] = time.time() - stage_start_time
+
+  # Verify video stabilization
+  if gyro_events is not None:
+    stage_start_time = time.time()
+    stabilization_result = (
+        preview_processing_utils.verify_preview_stabilization(
+            recording_obj, gyro_events, _NAME, log_path, facing))
+    if stabilization_result['failure'] is not None:
+      failures.append(
+          combination_name + ': ' + stabilization_result['failure'])
+    timings['stabilization'] = time.time() - stage_start_time
+
+  # Verify color space
+  stage_start_time = time.time()
+  color_space = video_processing_utils.get_video_colorspace(
+      log_path, preview_file_name_with_path)
+  if hlg10 and video_processing_utils.COLORSPACE_HDR not in color_space:
+    failures.append(
+        f'{combination_name}: video color space {color_space} '
+        'is missing COLORSPACE_HDR')
+  timings['color_space'] = time.time() - stage_start_time
+
+  logging.debug('Analysis timings for %s: %s', combination_name, ', '.join(
+      f'{stage} {t:.3f}s' for stage, t in timings.items()))
+  return failures, timings
+
+
+def _collect_analyses(analyses, test_failures, stage_times, wait=False):
+  """Adds results of finished analyses to test_failures and stage_times.
+
+  Results are taken in recording order, so failures are listed as if the
+  recordings were analyzed one after the other.
+
+  Args:
+    analyses: deque of futures of _analyze_recording(), oldest first.
+    test_failures: list of failure messages to extend.
+    stage_times: dict of total seconds per stage to add to.
+    wait: boolean; whether to wait for all analyses to finish.
+  """
+  while analyses and (wait or analyses[0].done()):
+    failures, timings = analyses.popleft().result()
+    test_failures.extend(failures)
+    for stage, t in timings.items():
+      stage_times[stage] += t
+
+
 class FeatureCombinationTest(its_base_test.ItsBaseTest):
   """Tests camera feature combinations.
 
@@ -120,169 +225,133 @@ class FeatureCombinationTest(its_base_test.ItsBaseTest):
       fps_ranges = camera_properties_utils.get_ae_target_fps_ranges(props)
 
       test_failures = []
-      for stream_combination in combinations:
-        streams_name = stream_combination['name']
-        min_frame_duration = 0
-        configured_streams = []
-        skip = False
-        if (stream_combination['combination'][0]['format'] !=
-            its_session_utils.PRIVATE_FORMAT):
-          raise AssertionError(
-              f'First stream for {streams_name} must be PRIV')
-        preview_size = stream_combination['combination'][0]['size']
-        for stream in stream_combination['combination']:
-          fmt = None
-          size = [int(e) for e in stream['size'].split('x')]
-          if stream['format'] == its_session_utils.PRIVATE_FORMAT:
-            fmt = capture_request_utils.FMT_CODE_PRIV
-          elif stream['format'] == 'jpeg':
-            fmt = capture_request_utils.FMT_CODE_JPEG
-          elif stream['format'] == its_session_utils.JPEG_R_FMT_STR:
-            fmt = capture_request_utils.FMT_CODE_JPEG_R
-          config = [x for x in configs if
-                    x['format'] == fmt and
-                    x['width'] == size[0] and
-                    x['height'] == size[1]]
-          if not config:
+      stage_times = collections.defaultdict(float)
+      analyses = collections.deque()
+      with concurrent.futures.ThreadPoolExecutor(
+          max_workers=_ANALYSIS_NUM_WORKERS) as executor:
+        for stream_combination in combinations:
+          streams_name = stream_combination['name']
+          min_frame_duration = 0
+          configured_streams = []
+          skip = False
+          if (stream_combination['combination'][0]['format'] !=
+              its_session_utils.PRIVATE_FORMAT):
+            raise AssertionError(
+                f'First stream for {streams_name} must be PRIV')
+          preview_size = stream_combination['combination'][0]['size']
+          for stream in stream_combination['combination']:
+            fmt = None
+            size = [int(e) for e in stream['size'].split('x')]
+            if stream['format'] == its_session_utils.PRIVATE_FORMAT:
+              fmt = capture_request_utils.FMT_CODE_PRIV
+            elif stream['format'] == 'jpeg':
+              fmt = capture_request_utils.FMT_CODE_JPEG
+            elif stream['format'] == its_session_utils.JPEG_R_FMT_STR:
+              fmt = capture_request_utils.FMT_CODE_JPEG_R
+            config = [x for x in configs if
+                      x['format'] == fmt and
+                      x['width'] == size[0] and
+                      x['height'] == size[1]]
+            if not config:
+              logging.debug(
+                  'stream combination %s not supported. Skip', streams_name)
+              skip = True
+              break
+
+            min_frame_duration = max(
+                config[0]['minFrameDuration'], min_frame_duration)
             logging.debug(
-                'stream combination %s not supported. Skip', streams_name)
-            skip = True
-            break
-
-          min_frame_duration = max(
-              config[0]['minFrameDuration'], min_frame_duration)
-          logging.debug(
-              'format is %s, min_frame_duration is %d}',
-              stream['format'], config[0]['minFrameDuration'])
-          configured_streams.append(
-              {'format': stream['format'], 'width': size[0], 'height': size[1]})
-
-        if skip:
-          continue
-
-        # Fps ranges
-        max_achievable_fps = _SEC_TO_NSEC / min_frame_duration
-        fps_params = [fps for fps in fps_ranges if (
-            fps[1] in _FPS_30_60 and
-            max_achievable_fps >= fps[1] - _FPS_SELECTION_ATOL)]
-
-        for fps_range in fps_params:
-          # HLG10. Make sure to test ON first.
-          hlg10_params = []
-          if cam.is_hlg10_recording_supported_for_size_and_fps(
-              preview_size, fps_range[1]):
-            hlg10_params.append(True)
-          hlg10_params.append(False)
-
-          features_tested = []  # feature combinations already tested
-          for hlg10 in hlg10_params:
-            # Construct output surfaces
-            output_surfaces = []
-            for configured_stream in configured_streams:
-              hlg10_stream = (configured_stream['format'] ==
-                              its_session_utils.PRIVATE_FORMAT and hlg10)
-              output_surfaces.append({'format': configured_stream['format'],
-                                      'width': configured_stream['width'],
-                                      'height': configured_stream['height'],
-                                      'hlg10': hlg10_stream})
-
-            for stabilize in stabilization_params:
-              settings = {
-                  'android.control.videoStabilizationMode': stabilize,
-                  'android.control.aeTargetFpsRange': fps_range,
-              }
-              combination_name = (f'(streams: {streams_name}, hlg10: {hlg10}, '
-                                  f'stabilization: {stabilize}, fps_range: '
-                                  f'[{fps_range[0]}, {fps_range[1]}])')
-              logging.debug('combination name: %s', combination_name)
-
-              # Is the feature combination supported?
-              supported = cam.is_stream_combination_supported(
-                  output_surfaces, settings)
-              if not supported:
-                logging.debug('%s not supported', combination_name)
-                break
-
-              is_stabilized = False
-              if (stabilize ==
-                  camera_properties_utils.STABILIZATION_MODE_PREVIEW):
-                is_stabilized = True
-
-              # If a superset of features are already tested, skip.
-              skip_test = its_session_utils.check_and_update_features_tested(
-                  features_tested, hlg10, is_stabilized)
-              if skip_test:
-                continue
-
-              recording_obj = (
-                  preview_processing_utils.collect_data_with_surfaces(
-                      cam, self.tablet_device, output_surfaces, is_stabilized,
-                      rot_rig=rot_rig, fps_range=fps_range))
-
-              if is_stabilized:
-                # Get gyro events
-                logging.debug('Reading out inertial sensor events')
-                gyro_events = cam.get_sensor_events()['gyro']
-                logging.debug('Number of gyro samples %d', len(gyro_events))
-
-              # Grab the video from the file location on DUT
-              self.dut.adb.pull([recording_obj['recordedOutputPath'], log_path])
-
-              # Verify FPS by inspecting the video clip
-              preview_file_name = (
-                  recording_obj['recordedOutputPath'].split('/')[-1])
-              preview_file_name_with_path = os.path.join(
-                  self.log_path, preview_file_name)
-              average_frame_rate_codec = (
-                  video_processing_utils.get_average_frame_rate(
-                      preview_file_name_with_path))
-              logging.debug('Average codec frame rate for %s is %f', combination_name,
-                            average_frame_rate_codec)
-              if (average_frame_rate_codec > fps_range[1] + _FPS_ATOL_CODEC or
-                  average_frame_rate_codec < fps_range[0] - _FPS_ATOL_CODEC):
-                failure_msg = (
-                    f'{combination_name}: Average video clip frame rate '
-                    f'{average_frame_rate_codec} exceeding the allowed range of '
-                    f'({fps_range[0]}-{_FPS_ATOL_CODEC}, '
-                    f'{fps_range[1]}+{_FPS_ATOL_CODEC})')
-                test_failures.append(failure_msg)
-
-              # Verify FPS by inspecting the result metadata
-              capture_results = recording_obj['captureMetadata'];
-              assert len(capture_results) > 1
-              last_t = capture_results[-1]['android.sensor.timestamp'];
-              first_t = capture_results[0]['android.sensor.timestamp'];
-              average_frame_duration = (last_t - first_t) / (len(capture_results) - 1)
-              average_frame_rate_metadata = _SEC_TO_NSEC / average_frame_duration
-              logging.debug('Average metadata frame rate for %s is %f', combination_name,
-                            average_frame_rate_metadata)
-              if (average_frame_rate_metadata > fps_range[1] + _FPS_ATOL_METADATA or
-                  average_frame_rate_metadata < fps_range[0] - _FPS_ATOL_METADATA):
-                failure_msg = (
-                    f'{combination_name}: Average frame rate '
-                    f'{average_frame_rate_metadata} exceeding the allowed range of '
-                    f'({fps_range[0]}-{_FPS_ATOL_METADATA}, {fps_range[1]}+{_FPS_ATOL_METADATA})')
-                test_failures.append(failure_msg)
-
-              # Verify video stabilization
-              if is_stabilized:
-                stabilization_result = (
-                    preview_processing_utils.verify_preview_stabilization(
-                        recording_obj, gyro_events, _NAME, log_path, facing))
-                if stabilization_result['failure'] is not None:
-                  failure_msg = (combination_name + ': ' +
-                                 stabilization_result['failure'])
-                  test_failures.append(failure_msg)
-
-              # Verify color space
-              color_space = video_processing_utils.get_video_colorspace(
-                  self.log_path, preview_file_name_with_path)
-              if (hlg10 and
-                  video_processing_utils.COLORSPACE_HDR not in color_space):
-                failure_msg = (
-                    f'{combination_name}: video color space {color_space} '
-                    'is missing COLORSPACE_HDR')
-                test_failures.append(failure_msg)
+                'format is %s, min_frame_duration is %d}',
+                stream['format'], config[0]['minFrameDuration'])
+            configured_streams.append(
+                {'format': stream['format'], 'width': size[0],
+                 'height': size[1]})
+
+          if skip:
+            continue
+
+          # Fps ranges
+          max_achievable_fps = _SEC_TO_NSEC / min_frame_duration
+          fps_params = [fps for fps in fps_ranges if (
+              fps[1] in _FPS_30_60 and
+              max_achievable_fps >= fps[1] - _FPS_SELECTION_ATOL)]
+
+          for fps_range in fps_params:
+            # HLG10. Make sure to test ON first.
+            hlg10_params = []
+            if cam.is_hlg10_recording_supported_for_size_and_fps(
+                preview_size, fps_range[1]):
+              hlg10_params.append(True)
+            hlg10_params.append(False)
+
+            features_tested = []  # feature combinations already tested
+            for hlg10 in hlg10_params:
+              # Construct output surfaces
+              output_surfaces = []
+              for configured_stream in configured_streams:
+                hlg10_stream = (configured_stream['format'] ==
+                                its_session_utils.PRIVATE_FORMAT and hlg10)
+                output_surfaces.append({'format': configured_stream['format'],
+                                        'width': configured_stream['width'],
+                                        'height': configured_stream['height'],
+                                        'hlg10': hlg10_stream})
+
+              for stabilize in stabilization_params:
+                settings = {
+                    'android.control.videoStabilizationMode': stabilize,
+                    'android.control.aeTargetFpsRange': fps_range,
+                }
+                combination_name = (
+                    f'(streams: {streams_name}, hlg10: {hlg10}, '
+                    f'stabilization: {stabilize}, fps_range: '
+                    f'[{fps_range[0]}, {fps_range[1]}])')
+                logging.debug('combination name: %s', combination_name)
+
+                # Is the feature combination supported?
+                supported = cam.is_stream_combination_supported(
+                    output_surfaces, settings)
+                if not supported:
+                  logging.debug('%s not supported', combination_name)
+                  break
+
+                is_stabilized = False
+                if (stabilize ==
+                    camera_properties_utils.STABILIZATION_MODE_PREVIEW):
+                  is_stabilized = True
+
+                # If a superset of features are already tested, skip.
+                skip_test = its_session_utils.check_and_update_features_tested(
+                    features_tested, hlg10, is_stabilized)
+                if skip_test:
+                  continue
+
+                stage_start_time = time.time()
+                recording_obj = (
+                    preview_processing_utils.collect_data_with_surfaces(
+                        cam, self.tablet_device, output_surfaces, is_stabilized,
+                        rot_rig=rot_rig, fps_range=fps_range))
+
+                gyro_events = None
+                if is_stabilized:
+                  # Get gyro events
+                  logging.debug('Reading out inertial sensor events')
+                  gyro_events = cam.get_sensor_events()['gyro']
+                  logging.debug('Number of gyro samples %d', len(gyro_events))
+                stage_times['record'] += time.time() - stage_start_time
+
+                # Grab the video from the file location on DUT before the next
+                # recording, then analyze it while the device records on.
+                stage_start_time = time.time()
+                self.dut.adb.pull(
+                    [recording_obj['recordedOutputPath'], log_path])
+                stage_times['pull'] += time.time() - stage_start_time
+                analyses.append(executor.submit(
+                    _analyze_recording, recording_obj, gyro_events,
+                    combination_name, fps_range, hlg10, facing, log_path))
+                _collect_analyses(analyses, test_failures, stage_times)
+        _collect_analyses(analyses, test_failures, stage_times, wait=True)
+      logging.debug('Stage timings: %s', ', '.join(
+          f'{stage} {t:.3f}s' for stage, t in stage_times.items()))
 
       # Assert PASS/FAIL criteria
       if test_failures:
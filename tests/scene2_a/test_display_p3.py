@@ -91,7 +91,11 @@ class DisplayP3Test(its_base_test.ItsBaseTest):
         if not _check_icc(p3_jpeg_img, 'DISPLAY_P3', fmt_str, p3_img_icc):
           raise AssertionError('Failure: P3 JPEG does not contain correct '
                                'icc profile')
-        if not image_processing_utils.p3_img_has_wide_gamut(p3_jpeg_img):
+        wide_gamut_mask = image_processing_utils.p3_img_wide_gamut_mask(
+            p3_jpeg_img)
+        logging.debug('Wide gamut pixels: %.4f%%',
+                      wide_gamut_mask.mean() * 100)
+        if not wide_gamut_mask.any():
           raise AssertionError('Failure: P3 JPEG does not contain wide gamut '
                                'pixels outside the SRGB color space.')
 
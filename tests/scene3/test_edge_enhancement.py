@@ -129,7 +129,8 @@ class EdgeEnhancementTest(its_base_test.ItsBaseTest):
 
       # Initialize chart class and locate chart in scene
       chart = opencv_processing_utils.Chart(
-          cam, props, self.log_path, distance=self.chart_distance)
+          cam, props, self.log_path, distance=self.chart_distance,
+          scene=self.scene)
 
       # Define format
       fmt = 'yuv'
@@ -150,7 +150,8 @@ class FlipMirrorTest(its_base_test.ItsBaseTest):
 
       # initialize chart class and locate chart in scene
       chart = opencv_processing_utils.Chart(
-          cam, props, self.log_path, distance=self.chart_distance)
+          cam, props, self.log_path, distance=self.chart_distance,
+          scene=self.scene)
       fmt = {'format': 'yuv', 'width': _VGA_W, 'height': _VGA_H}
 
       # test that image is not flipped, mirrored, or rotated
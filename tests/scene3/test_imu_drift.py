@@ -190,18 +190,18 @@ def convert_events_to_arrays(events, t_factor, xyz_factor):
   """Convert data from get_sensor_events() into x, y, z, t.
 
   Args:
-    events: dict from cam.get_sensor_events()
+    events: SensorTrace or list of events from cam.get_sensor_events()
     t_factor: time multiplication factor ie. NSEC_TO_SEC
     xyz_factor: xyz multiplicaiton factor ie. RAD_TO_DEG
 
   Returns:
     x, y, z, t numpy arrays
   """
-  t = np.array([(e['time'] - events[0]['time'])*t_factor
-                for e in events])
-  x = np.array([e['x']*xyz_factor for e in events])
-  y = np.array([e['y']*xyz_factor for e in events])
-  z = np.array([e['z']*xyz_factor for e in events])
+  trace = imu_processing_utils.get_sensor_trace(events)
+  t = (trace['time'] - trace['time'][0])*t_factor
+  x = trace['x'].astype(float)*xyz_factor
+  y = trace['y'].astype(float)*xyz_factor
+  z = trace['z'].astype(float)*xyz_factor
 
   return x, y, z, t
 
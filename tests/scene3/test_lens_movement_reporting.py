@@ -128,7 +128,8 @@ class LensMovementReportingTest(its_base_test.ItsBaseTest):
 
       # Initialize chart class and locate chart in scene
       chart = opencv_processing_utils.Chart(
-          cam, props, self.log_path, distance=self.chart_distance)
+          cam, props, self.log_path, distance=self.chart_distance,
+          scene=self.scene)
 
       # Get proper sensitivity, exposure time, and focus distance with 3A.
       mono_camera = camera_properties_utils.mono_camera(props)
@@ -156,7 +156,8 @@ class ReprocessEdgeEnhancementTest(its_base_test.ItsBaseTest):
 
       # Initialize chart class and locate chart in scene
       chart = opencv_processing_utils.Chart(
-          cam, props, self.log_path, distance=self.chart_distance)
+          cam, props, self.log_path, distance=self.chart_distance,
+          scene=self.scene)
 
       # If reprocessing is supported, ZSL edge mode must be available
       if not camera_properties_utils.edge_mode(props, _EDGE_MODES['ZSL']):
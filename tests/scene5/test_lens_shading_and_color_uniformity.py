@@ -176,11 +176,11 @@ class LensShadingAndColorUniformityTest(its_base_test.ItsBaseTest):
         cap = cam.do_capture(req, out_surface)
       logging.debug('Captured YUV %dx%d', w, h)
       # Get Y channel
-      img_y = image_processing_utils.convert_capture_to_planes(cap)[0]
+      img_y = cap.y()
       image_processing_utils.write_image(
           img_y, f'{name_with_log_path}_y_plane.png', True)
       # Convert RGB image & calculate R/G, R/B ratioed images
-      img_rgb = image_processing_utils.convert_capture_to_rgb_image(cap)
+      img_rgb = cap.rgb()
       img_r_g, img_b_g = _calc_color_plane_ratios(img_rgb)
 
       # Make copies for images with legends and set legend parameters.
@@ -109,9 +109,10 @@ class PreviewZoomTest(its_base_test.ItsBaseTest):
           z_max >= z_min * zoom_capture_utils.ZOOM_MIN_THRESH)
 
       # recording preview
-      capture_results, file_list = (
+      capture_results, frames = (
           preview_processing_utils.preview_over_zoom_range(
-              self.dut, cam, preview_size, z_min, z_max, z_step_size, log_path)
+              self.dut, cam, preview_size, z_min, z_max, z_step_size, log_path,
+              stream_frames=True)
       )
 
       test_data = []
@@ -123,19 +124,34 @@ class PreviewZoomTest(its_base_test.ItsBaseTest):
       out = cv2.VideoWriter(uncompressed_video, fourcc, _FPS,
                             (size[0], size[1]))
 
-      for capture_result, img_name in zip(capture_results, file_list):
-        z = float(capture_result['android.control.zoomRatio'])
+      def zoom_frames():
+        for capture_result, (img_name, img_rgb) in zip(capture_results, frames):
+          z = float(capture_result['android.control.zoomRatio'])
+
+          # convert decoded frame for cv2
+          img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+
+          # add path to image name
+          img_path = f'{os.path.join(self.log_path, img_name)}'
+
+          # Scale circlish RTOL for low zoom ratios
+          if z < 1:
+            circlish_rtol = _CIRCLISH_RTOL / z
+          else:
+            circlish_rtol = _CIRCLISH_RTOL
+          yield img_bgr, img_path, z, circlish_rtol
+
+      # Find the center circle in each frame and check if it's cropped
+      circles = zoom_capture_utils.iter_center_circles(
+          zoom_frames(), size, z_min, debug=debug, draw_color=_CV2_RED,
+          write_img=False)
+      for capture_result, ((img_bgr, img_path, z, _), circle) in zip(
+          capture_results, circles):
         if camera_properties_utils.logical_multi_camera(props):
           phy_id = capture_result['android.logicalMultiCamera.activePhysicalId']
         else:
           phy_id = None
 
-        # read image
-        img_bgr = cv2.imread(os.path.join(log_path, img_name))
-
-        # add path to image name
-        img_path = f'{os.path.join(self.log_path, img_name)}'
-
         # determine radius tolerance of capture
         cap_fl = capture_result['android.lens.focalLength']
         radius_tol, offset_tol = test_tols.get(
@@ -143,25 +159,12 @@ class PreviewZoomTest(its_base_test.ItsBaseTest):
             (zoom_capture_utils.RADIUS_RTOL, zoom_capture_utils.OFFSET_RTOL)
         )
 
-        # Scale circlish RTOL for low zoom ratios
-        if z < 1:
-          circlish_rtol = _CIRCLISH_RTOL / z
-        else:
-          circlish_rtol = _CIRCLISH_RTOL
-
-        # Find the center circle in img and check if it's cropped
-        circle = zoom_capture_utils.find_center_circle(
-            img_bgr, img_path, size, z, z_min, circlish_rtol=circlish_rtol,
-            debug=debug, draw_color=_CV2_RED, write_img=False)
-
         # Zoom is too large to find center circle
         if circle is None:
           logging.error('Unable to detect circle in %s', img_path)
           break
 
         out.write(img_bgr)
-        # Remove png file
-        its_session_utils.remove_file(img_path)
 
         test_data.append(
             zoom_capture_utils.ZoomTestData(
@@ -103,65 +103,71 @@ class ZoomTest(its_base_test.ItsBaseTest):
       img_name_stem = f'{os.path.join(self.log_path, _NAME)}'
       req = capture_request_utils.auto_capture_request()
       test_failed = False
-      for fmt in test_formats:
-        logging.debug('testing %s format', fmt)
-        test_data = []
-        for z in z_list:
-          req['android.control.zoomRatio'] = z
-          logging.debug('zoom ratio: %.3f', z)
-          cam.do_3a(
-              zoom_ratio=z,
-              out_surfaces={
-                  'format': fmt,
-                  'width': size[0],
-                  'height': size[1]
-              },
-              repeat_request=None,
-          )
-          cap = cam.do_capture(
-              req, {'format': fmt, 'width': size[0], 'height': size[1]},
-              reuse_session=True)
-
-          img = image_processing_utils.convert_capture_to_rgb_image(
-              cap, props=props)
-          img_name = (f'{img_name_stem}_{fmt}_{round(z, 2)}.'
-                      f'{zoom_capture_utils.JPEG_STR}')
-          image_processing_utils.write_image(img, img_name)
-
-          # determine radius tolerance of capture
-          cap_fl = cap['metadata']['android.lens.focalLength']
-          radius_tol, offset_tol = test_tols.get(
-              cap_fl,
-              (zoom_capture_utils.RADIUS_RTOL, zoom_capture_utils.OFFSET_RTOL)
-          )
-
-          # Scale circlish RTOL for low zoom ratios
-          if z < 1:
-            circlish_rtol = _CIRCLISH_RTOL / z
-          else:
-            circlish_rtol = _CIRCLISH_RTOL
-
-          # Find the center circle in img and check if it's cropped
-          circle = zoom_capture_utils.find_center_circle(
-              img, img_name, size, z, z_list[0], circlish_rtol=circlish_rtol,
-              debug=debug)
-
-          # Zoom is too large to find center circle
-          if circle is None:
-            break
-          test_data.append(
-              zoom_capture_utils.ZoomTestData(
-                  result_zoom=z,
-                  circle=circle,
-                  radius_tol=radius_tol,
-                  offset_tol=offset_tol,
-                  focal_length=cap_fl
-              )
-          )
-
-        if not zoom_capture_utils.verify_zoom_results(
-            test_data, size, z_max, z_min):
-          test_failed = True
+      with image_processing_utils.BackgroundImageWriter() as image_writer:
+        for fmt in test_formats:
+          logging.debug('testing %s format', fmt)
+          test_data = []
+          for z in z_list:
+            req['android.control.zoomRatio'] = z
+            logging.debug('zoom ratio: %.3f', z)
+            cam.do_3a(
+                zoom_ratio=z,
+                out_surfaces={
+                    'format': fmt,
+                    'width': size[0],
+                    'height': size[1]
+                },
+                repeat_request=None,
+            )
+            cap = cam.do_capture(
+                req, {'format': fmt, 'width': size[0], 'height': size[1]},
+                reuse_session=True)
+
+            img = image_processing_utils.convert_capture_to_rgb_image(
+                cap, props=props)
+            img_name = (f'{img_name_stem}_{fmt}_{round(z, 2)}.'
+                        f'{zoom_capture_utils.JPEG_STR}')
+            image_processing_utils.write_image(img, img_name)
+
+            # determine radius tolerance of capture
+            cap_fl = cap['metadata']['android.lens.focalLength']
+            radius_tol, offset_tol = test_tols.get(
+                cap_fl,
+                (zoom_capture_utils.RADIUS_RTOL, zoom_capture_utils.OFFSET_RTOL)
+            )
+
+            # Scale circlish RTOL for low zoom ratios
+            if z < 1:
+              circlish_rtol = _CIRCLISH_RTOL / z
+            else:
+              circlish_rtol = _CIRCLISH_RTOL
+
+            # Find the center circle in img and check if it's cropped
+            predicted_circle = None
+            if test_data:
+              predicted_circle = zoom_capture_utils.predict_circle(
+                  test_data[-1].circle, test_data[-1].result_zoom, z, size)
+            circle = zoom_capture_utils.find_center_circle(
+                img, img_name, size, z, z_list[0], circlish_rtol=circlish_rtol,
+                debug=debug, predicted_circle=predicted_circle,
+                image_writer=image_writer)
+
+            # Zoom is too large to find center circle
+            if circle is None:
+              break
+            test_data.append(
+                zoom_capture_utils.ZoomTestData(
+                    result_zoom=z,
+                    circle=circle,
+                    radius_tol=radius_tol,
+                    offset_tol=offset_tol,
+                    focal_length=cap_fl
+                )
+            )
+
+          if not zoom_capture_utils.verify_zoom_results(
+              test_data, size, z_max, z_min):
+            test_failed = True
 
     if test_failed:
       raise AssertionError(f'{_NAME} failed! Check test_log.DEBUG for errors')
@@ -15,7 +15,6 @@
 
 
 import logging
-import math
 import os.path
 
 from matplotlib import pylab
@@ -29,100 +28,19 @@ import capture_request_utils
 import image_processing_utils
 import its_session_utils
 
-_JPEG_APPN_MARKERS = [[255, 224], [255, 225], [255, 226], [255, 227],
-                      [255, 228], [255, 229], [255, 230], [255, 231],
-                      [255, 232], [255, 235]]
-_JPEG_DHT_MARKER = [255, 196]  # JPEG Define Huffman Table
-_JPEG_DQT_MARKER = [255, 219]  # JPEG Define Quantization Table
 _JPEG_DQT_RTOL = 0.8  # -20% for each +20 in jpeg.quality (empirical number)
-_JPEG_EOI_MARKER = [255, 217]  # JPEG End of Image
-_JPEG_SOI_MARKER = [255, 216]  # JPEG Start of Image
-_JPEG_SOS_MARKER = [255, 218]  # JPEG Start of Scan
+_JPEG_DQT_SIZE = 8  # DQT matrices are 8x8
 _NAME = os.path.splitext(os.path.basename(__file__))[0]
 _QUALITIES = [25, 45, 65, 85]
 _SYMBOLS = ['o', 's', 'v', '^', '<', '>']
 
 
-def is_square(integer):
-  root = math.sqrt(integer)
-  return integer == int(root + 0.5)**2
-
-
-def strip_soi_marker(jpeg):
-  """Strip off start of image marker.
-
-  SOI is of form [xFF xD8] and JPEG needs to start with marker.
-
-  Args:
-   jpeg: 1-D numpy int [0:255] array; values from JPEG capture
-
-  Returns:
-    jpeg with SOI marker stripped off.
-  """
-
-  soi = jpeg[0:2]
-  if list(soi) != _JPEG_SOI_MARKER:
-    raise AssertionError('JPEG has no Start Of Image marker')
-  return jpeg[2:]
-
-
-def strip_appn_data(jpeg):
-  """Strip off application specific data at beginning of JPEG.
-
-  APPN markers are of form [xFF, xE*, size_msb, size_lsb] and should follow
-  SOI marker.
-
-  Args:
-   jpeg: 1-D numpy int [0:255] array; values from JPEG capture
-
-  Returns:
-    jpeg with APPN marker(s) and data stripped off.
-  """
-
-  length = 0
-  i = 0
-  # find APPN markers and strip off payloads at beginning of jpeg
-  while i < len(jpeg) - 1:
-    if [jpeg[i], jpeg[i + 1]] in _JPEG_APPN_MARKERS:
-      length = jpeg[i + 2] * 256 + jpeg[i + 3] + 2
-      logging.debug('stripped APPN length:%d', length)
-      jpeg = np.concatenate((jpeg[0:i], jpeg[length:]), axis=None)
-    elif ([jpeg[i], jpeg[i + 1]] == _JPEG_DQT_MARKER or
-          [jpeg[i], jpeg[i + 1]] == _JPEG_DHT_MARKER):
-      break
-    else:
-      i += 1
-
-  return jpeg
-
-
-def find_dqt_markers(marker, jpeg):
-  """Find location(s) of marker list in jpeg.
-
-  DQT marker is of form [xFF, xDB].
-
-  Args:
-    marker: list; marker values
-    jpeg: 1-D numpy int [0:255] array; JPEG capture w/ SOI & APPN stripped
-
-  Returns:
-    locs: list; marker locations in jpeg
-  """
-  locs = []
-  marker_len = len(marker)
-  for i in range(len(jpeg) - marker_len + 1):
-    if list(jpeg[i:i + marker_len]) == marker:
-      locs.append(i)
-  return locs
-
-
 def extract_dqts(jpeg, debug=False):
   """Find and extract the DQT info in the JPEG.
 
-  SOI marker and APPN markers plus data are stripped off front of JPEG.
-  DQT marker is of form [xFF, xDB] followed by [size_msb, size_lsb].
-  Size includes the size values, but not the marker values.
-  Luma DQT is prefixed by 0, Chroma DQT by 1.
+  The JPEG segments are indexed from the start of image marker, so DQTs in
+  APPN data such as an EXIF thumbnail are skipped.
+  Luma DQT has table id 0, Chroma DQT table id 1.
   DQTs can have both luma & chroma or each individually.
   There can be more than one DQT table for luma and chroma.
 
@@ -134,48 +52,25 @@ def extract_dqts(jpeg, debug=False):
     lumas,chromas: lists of numpy means of luma & chroma DQT matrices.
     Higher values represent higher compression.
   """
-
-  dqt_markers = find_dqt_markers(_JPEG_DQT_MARKER, jpeg)
-  logging.debug('DQT header loc(s):%s', dqt_markers)
   lumas = []
   chromas = []
-  for i, dqt in enumerate(dqt_markers):
-    if debug:
-      logging.debug('DQT %d start: %d, marker: %s, length: %s', i, dqt,
-                    jpeg[dqt:dqt + 2], jpeg[dqt + 2:dqt + 4])
-    dqt_size = jpeg[dqt + 2] * 256 + jpeg[dqt + 3] - 2  # strip off size marker
-    if dqt_size % 2 == 0:  # even payload means luma & chroma
-      logging.debug(' both luma & chroma DQT matrices in marker')
-      dqt_size = (dqt_size - 2) // 2  # subtact off luma/chroma markers
-      if not is_square(dqt_size):
-        raise AssertionError(f'DQT size: {dqt_size}')
-      luma_start = dqt + 5  # skip header, length, & matrix id
-      chroma_start = luma_start + dqt_size + 1  # skip lumen &  matrix_id
-      luma = np.array(jpeg[luma_start: luma_start + dqt_size])
-      chroma = np.array(jpeg[chroma_start: chroma_start + dqt_size])
-      lumas.append(np.mean(luma))
-      chromas.append(np.mean(chroma))
-      if debug:
-        h = int(math.sqrt(dqt_size))
-        logging.debug(' luma:%s', luma.reshape(h, h))
-        logging.debug(' chroma:%s', chroma.reshape(h, h))
-    else:  # odd payload means only 1 matrix
-      logging.debug(' single DQT matrix in marker')
-      dqt_size = dqt_size - 1  # subtract off luma/chroma marker
-      if not is_square(dqt_size):
-        raise AssertionError(f'DQT size: {dqt_size}')
-      start = dqt + 5
-      matrix = np.array(jpeg[start:start + dqt_size])
-      if jpeg[dqt + 4]:  # chroma == 1
+  for segment in image_processing_utils.index_jpeg_segments(jpeg):
+    if segment.marker != image_processing_utils.JPEG_DQT_MARKER:
+      continue
+    logging.debug('DQT header loc: %d, length: %d', segment.offset,
+                  len(segment.payload) + 2)
+    for table_id, matrix in image_processing_utils.parse_jpeg_dqt(
+        segment.payload):
+      if table_id:  # chroma == 1
         chromas.append(np.mean(matrix))
         if debug:
-          h = int(math.sqrt(dqt_size))
-          logging.debug(' chroma:%s', matrix.reshape(h, h))
+          logging.debug(' chroma:%s',
+                        matrix.reshape(_JPEG_DQT_SIZE, _JPEG_DQT_SIZE))
       else:  # luma == 0
         lumas.append(np.mean(matrix))
         if debug:
-          h = int(math.sqrt(dqt_size))
-          logging.debug(' luma:%s', matrix.reshape(h, h))
+          logging.debug(' luma:%s',
+                        matrix.reshape(_JPEG_DQT_SIZE, _JPEG_DQT_SIZE))
 
   return lumas, chromas
 
@@ -244,13 +139,6 @@ class JpegQualityTest(its_base_test.ItsBaseTest):
         cap = cam.do_capture(req, cam.CAP_JPEG)
         jpeg = cap['data']
 
-        # strip off start of image
-        jpeg = strip_soi_marker(jpeg)
-
-        # strip off application specific data
-        jpeg = strip_appn_data(jpeg)
-        logging.debug('remaining JPEG header:%s', jpeg[0:4])
-
         # find and extract DQTs
         lumas_i, chromas_i = extract_dqts(jpeg, debug)
         lumas.append(lumas_i)
@@ -64,10 +64,13 @@ _GYRO_INIT_WAIT_TIME = 0.5  # Seconds to wait for gyro to stabilize.
 _GYRO_POST_WAIT_TIME = 0.2  # Seconds to wait to capture some extra gyro data.
 _IMG_SIZE_MAX = 640 * 480  # Maximum image size.
 _NUM_FRAMES_MAX = 300  # fps*test_length should be < this for smooth captures.
+_CAPTURE_METADATA_KEYS = ('android.sensor.timestamp',
+                          'android.sensor.exposureTime',
+                          'android.sensor.rollingShutterSkew')
 
 
 def _collect_data(cam, fps, w, h, test_length, rot_rig, chart_dist,
-                  name_with_log_path):
+                  name_with_log_path, image_writer):
   """Capture a new set of data from the device.
 
   Captures camera frames while the user is moving the device in the proscribed
@@ -83,9 +86,10 @@ def _collect_data(cam, fps, w, h, test_length, rot_rig, chart_dist,
     rot_rig: dict with 'cntl' and 'ch' defined.
     chart_dist: float value of distance to chart in meters.
     name_with_log_path: file name with location to save data.
+    image_writer: image_processing_utils.BackgroundImageWriter for frames.
 
   Returns:
-    frames: list of RGB images as numpy arrays.
+    frames: (N, h, w, 3) numpy array of RGB images.
   """
   logging.debug('Starting sensor event collection')
   props = cam.get_camera_properties()
@@ -152,7 +156,8 @@ def _collect_data(cam, fps, w, h, test_length, rot_rig, chart_dist,
   req['android.sensor.frameDuration'] = int(1 / _NSEC_TO_SEC / fps)
   logging.debug('Capturing %dx%d with ISO %d, exp %.3fms at %dfps',
                 w, h, s, e/_MSEC_TO_NSEC, fps)
-  caps = cam.do_capture([req] * int(fps * test_length), fmt)
+  caps = cam.do_capture([req] * int(fps * test_length), fmt,
+                        metadata_keys=_CAPTURE_METADATA_KEYS)
 
   # Capture a bit more gyro samples for use in get_best_alignment_offset
   time.sleep(_GYRO_POST_WAIT_TIME)
@@ -171,16 +176,13 @@ def _collect_data(cam, fps, w, h, test_length, rot_rig, chart_dist,
   events = {'gyro': gyro, 'cam': list(zip(starts, exptimes, readouts)),
             'facing': facing}
   with open(f'{name_with_log_path}_events.txt', 'w') as f:
-    f.write(json.dumps(events))
+    f.write(json.dumps({**events, 'gyro': gyro.to_list()}))
 
   # Convert frames to RGB.
   logging.debug('Dumping frames')
-  frames = []
-  for i, cap in enumerate(caps):
-    img = image_processing_utils.convert_capture_to_rgb_image(cap)
-    frames.append(img)
-    image_processing_utils.write_image(
-        img, f'{name_with_log_path}_frame{i:03d}.png')
+  frames = image_processing_utils.convert_captures_to_rgb_images(caps)
+  for i, img in enumerate(frames):
+    image_writer.write_image(img, f'{name_with_log_path}_frame{i:03d}.png')
   return events, frames
 
 
@@ -356,68 +358,70 @@ class SensorFusionTest(its_base_test.ItsBaseTest):
           ' to run smoothly.  If you run into problems, consider'
           " smaller values of 'w', 'h', 'fps', or 'test_length'.")
 
-    if replay:
-      events, frames, _, _ = load_data()
-    else:
-      with its_session_utils.ItsSession(
-          device_id=self.dut.serial,
-          camera_id=self.camera_id,
-          hidden_physical_id=self.hidden_physical_id) as cam:
-
-        rot_rig['cntl'] = self.rotator_cntl
-        rot_rig['ch'] = self.rotator_ch
-        events, frames = _collect_data(
-            cam, fps, img_w, img_h, test_length, rot_rig, chart_distance,
-            name_with_log_path)
-    logging.debug('Start frame: %d', _START_FRAME)
-
-    sensor_fusion_utils.plot_gyro_events(events['gyro'], _NAME, self.log_path)
-
-    # Validity check on gyro/camera timestamps
-    cam_times = _get_cam_times(
-        events['cam'][_START_FRAME:], fps)
-    gyro_times = [e['time'] for e in events['gyro']]
-    self._assert_gyro_encompasses_camera(cam_times, gyro_times)
-
-    # Compute cam rotation displacement(rads) between pairs of adjacent frames.
-    cam_rots = sensor_fusion_utils.get_cam_rotations(
-        frames[_START_FRAME:], events['facing'], img_h,
-        name_with_log_path, _START_FRAME)
-    logging.debug('cam_rots: %s', str(cam_rots))
-    gyro_rots = sensor_fusion_utils.get_gyro_rotations(
-        events['gyro'], cam_times)
-    _plot_rotations(cam_rots, gyro_rots, name_with_log_path)
-
-    # Find the best offset. Starting with Android 14, use 3rd order polynomial
-    first_api_level = its_session_utils.get_first_api_level(self.dut.serial)
-    polyfit_degrees = list(_POLYFIT_DEGREES)
-    if first_api_level <= its_session_utils.ANDROID13_API_LEVEL:
-      polyfit_degrees = list(_POLYFIT_DEGREES_LEGACY)
-    logging.debug('Attempting to fit data to polynomials of degrees: %s',
-                  polyfit_degrees)
-    for degree in polyfit_degrees:
-      output = sensor_fusion_utils.get_best_alignment_offset(
-          cam_times, cam_rots, events['gyro'], degree=degree
-      )
-      if not output:
-        logging.debug('Degree %d was not a good fit.', degree)
-        continue
-      logging.debug('Degree %d was a good fit.', degree)
-      offset_ms, coeffs, candidates, distances = output
-      _plot_best_shift(
-          offset_ms, coeffs, candidates, distances, name_with_log_path, degree)
-      break
-    else:
-      raise AssertionError(
-          f'No degree in {polyfit_degrees} was a good fit for the data!'
-      )
-
-    # Calculate correlation distance with best offset.
-    corr_dist = scipy.spatial.distance.correlation(cam_rots, gyro_rots)
-    logging.debug('Best correlation of %f at shift of %.3fms',
-                  corr_dist, offset_ms)
-    print(f'test_sensor_fusion_corr_dist: {corr_dist}')
-    print(f'test_sensor_fusion_offset_ms: {offset_ms:.3f}')
+    # Frames are written while rotations are measured
+    with image_processing_utils.BackgroundImageWriter() as image_writer:
+      if replay:
+        events, frames, _, _ = load_data()
+      else:
+        with its_session_utils.ItsSession(
+            device_id=self.dut.serial,
+            camera_id=self.camera_id,
+            hidden_physical_id=self.hidden_physical_id) as cam:
+
+          rot_rig['cntl'] = self.rotator_cntl
+          rot_rig['ch'] = self.rotator_ch
+          events, frames = _collect_data(
+              cam, fps, img_w, img_h, test_length, rot_rig, chart_distance,
+              name_with_log_path, image_writer)
+      logging.debug('Start frame: %d', _START_FRAME)
+
+      sensor_fusion_utils.plot_gyro_events(events['gyro'], _NAME, self.log_path)
+
+      # Validity check on gyro/camera timestamps
+      cam_times = _get_cam_times(
+          events['cam'][_START_FRAME:], fps)
+      gyro_times = [e['time'] for e in events['gyro']]
+      self._assert_gyro_encompasses_camera(cam_times, gyro_times)
+
+      # Compute cam rotation displacement(rads) between adjacent frames.
+      cam_rots = sensor_fusion_utils.get_cam_rotations(
+          frames[_START_FRAME:], events['facing'], img_h,
+          name_with_log_path, _START_FRAME)
+      logging.debug('cam_rots: %s', str(cam_rots))
+      gyro_rots = sensor_fusion_utils.get_gyro_rotations(
+          events['gyro'], cam_times)
+      _plot_rotations(cam_rots, gyro_rots, name_with_log_path)
+
+      # Find the best offset. Starting with Android 14, use 3rd order polynomial
+      first_api_level = its_session_utils.get_first_api_level(self.dut.serial)
+      polyfit_degrees = list(_POLYFIT_DEGREES)
+      if first_api_level <= its_session_utils.ANDROID13_API_LEVEL:
+        polyfit_degrees = list(_POLYFIT_DEGREES_LEGACY)
+      logging.debug('Attempting to fit data to polynomials of degrees: %s',
+                    polyfit_degrees)
+      for degree in polyfit_degrees:
+        output = sensor_fusion_utils.get_best_alignment_offset(
+            cam_times, cam_rots, events['gyro'], degree=degree
+        )
+        if not output:
+          logging.debug('Degree %d was not a good fit.', degree)
+          continue
+        logging.debug('Degree %d was a good fit.', degree)
+        offset_ms, coeffs, candidates, distances = output
+        _plot_best_shift(offset_ms, coeffs, candidates, distances,
+                         name_with_log_path, degree)
+        break
+      else:
+        raise AssertionError(
+            f'No degree in {polyfit_degrees} was a good fit for the data!'
+        )
+
+      # Calculate correlation distance with best offset.
+      corr_dist = scipy.spatial.distance.correlation(cam_rots, gyro_rots)
+      logging.debug('Best correlation of %f at shift of %.3fms',
+                    corr_dist, offset_ms)
+      print(f'test_sensor_fusion_corr_dist: {corr_dist}')
+      print(f'test_sensor_fusion_offset_ms: {offset_ms:.3f}')
 
     # Assert PASS/FAIL criteria.
     if corr_dist > _CORR_DIST_THRESH_MAX:
@@ -13,6 +13,7 @@
 # limitations under the License.
 """Verify video is stable during phone movement."""
 
+import itertools
 import logging
 import os
 import threading
@@ -22,13 +23,11 @@ from mobly import test_runner
 
 import its_base_test
 import camera_properties_utils
-import image_processing_utils
 import its_session_utils
 import sensor_fusion_utils
 import video_processing_utils
 
 _ASPECT_RATIO_16_9 = 16/9  # determine if video fmt > 16:9
-_IMG_FORMAT = 'png'
 _MIN_PHONE_MOVEMENT_ANGLE = 5  # degrees
 _NAME = os.path.splitext(os.path.basename(__file__))[0]
 _NUM_ROTATIONS = 24
@@ -113,7 +112,7 @@ class VideoStabilizationTest(its_base_test.ItsBaseTest):
   Video is captured after rotation rig starts moving, and the
   gyroscope data is dumped.
 
-  Video is processed to dump all of the frames to PNG files.
+  Video is decoded frame by frame.
   Camera movement is extracted from frames by determining max
   angle of deflection in video movement vs max angle of deflection
   in gyroscope movement. Test is a PASS if rotation is reduced in video.
@@ -189,22 +188,19 @@ class VideoStabilizationTest(its_base_test.ItsBaseTest):
         gyro_events = cam.get_sensor_events()['gyro']
         logging.debug('Number of gyro samples %d', len(gyro_events))
 
-        # Extract all frames from video
-        file_list = video_processing_utils.extract_all_frames_from_video(
-            log_path, file_name, _IMG_FORMAT)
-        frames = []
-        logging.debug('Number of frames %d', len(file_list))
-        for file in file_list:
-          img = image_processing_utils.convert_image_to_numpy_array(
-              os.path.join(log_path, file))
-          frames.append(img/255)
-        frame_shape = frames[0].shape
+        # Stream frames from video
+        frame_w, frame_h = video_processing_utils.get_video_frame_size(
+            os.path.join(log_path, file_name))
+        frame_shape = (frame_h, frame_w, 3)
         logging.debug('Frame size %d x %d', frame_shape[1], frame_shape[0])
+        frames = itertools.islice(
+            video_processing_utils.iter_video_frames(log_path, file_name),
+            _START_FRAME, None)
 
         # Extract camera rotations
         file_name_stem = f'{os.path.join(log_path, _NAME)}_{video_quality}'
         cam_rots = sensor_fusion_utils.get_cam_rotations(
-            frames[_START_FRAME:], facing, frame_shape[0],
+            frames, facing, frame_shape[0],
             file_name_stem, _START_FRAME, stabilized_video=True)
         sensor_fusion_utils.plot_camera_rotations(
             cam_rots, _START_FRAME, video_quality, file_name_stem)
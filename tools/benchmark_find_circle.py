@@ -0,0 +1,171 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks find_circle contour screening against the previous version.
+
+Usage:
+  python tools/benchmark_find_circle.py [scenes=scene4] [reps=5]
+Each PNG of the scenes in tests/ is searched for a black circle with the
+global threshold pass of the previous and current implementations.
+"""
+
+
+import glob
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy
+
+import image_fov_utils
+import image_processing_utils
+import opencv_processing_utils
+
+_DEFAULT_SCENES = ('scene4',)
+_DEFAULT_REPS = 5
+
+
+def _component_shape_loop(contour):
+  """Previous component_shape, looping over contour points."""
+  shape = {'left': numpy.inf, 'right': 0, 'top': numpy.inf, 'bottom': 0}
+  for pt in contour:
+    shape['left'] = min(shape['left'], pt[0][0])
+    shape['right'] = max(shape['right'], pt[0][0])
+    shape['top'] = min(shape['top'], pt[0][1])
+    shape['bottom'] = max(shape['bottom'], pt[0][1])
+  shape['width'] = shape['right'] - shape['left'] + 1
+  shape['height'] = shape['bottom'] - shape['top'] + 1
+  shape['ctx'] = (shape['left'] + shape['right']) // 2
+  shape['cty'] = (shape['top'] + shape['bottom']) // 2
+  return shape
+
+
+def _fill_metric_loop(shape, img_bw, color):
+  """Previous find_circle_fill_metric, looping over axis pixels."""
+  matching = 0
+  total = 0
+  for y in range(shape['top'], shape['bottom']):
+    total += 1
+    matching += 1 if img_bw[y][shape['ctx']] == color else 0
+  for x in range(shape['left'], shape['right']):
+    total += 1
+    matching += 1 if img_bw[shape['cty']][x] == color else 0
+  return matching / total
+
+
+def _find_circles_loop(img, min_area, color):
+  """Previous global threshold pass of find_circle, without logging.
+
+  Returns:
+    List of (x, y, r, radius spread) of the circles found.
+  """
+  img_size = img.shape
+  if img_size[0]*img_size[1] >= opencv_processing_utils.LOW_RES_IMG_THRESH:
+    circlish_atol = opencv_processing_utils.CIRCLISH_ATOL
+  else:
+    circlish_atol = opencv_processing_utils.CIRCLISH_LOW_RES_ATOL
+  img_gray = image_processing_utils.convert_rgb_to_grayscale(img)
+  img_bw = opencv_processing_utils.binarize_image(img_gray)
+  contours = opencv_processing_utils.find_all_contours(255-img_bw)
+  min_circle_area = min_area * img_size[0] * img_size[1]
+  circles = []
+  for contour in contours:
+    area = cv2.contourArea(contour)
+    num_pts = len(contour)
+    if (area > min_circle_area and
+        num_pts >= opencv_processing_utils.CIRCLE_MIN_PTS):
+      shape = _component_shape_loop(contour)
+      radius = (shape['width'] + shape['height']) / 4
+      if (img_bw[shape['cty']][shape['ctx']] == color and
+          math.isclose(1.0, (math.pi * radius**2) / area,
+                       abs_tol=circlish_atol) and
+          math.isclose(1.0, shape['width'] / shape['height'],
+                       abs_tol=opencv_processing_utils.CIRCLE_AR_ATOL) and
+          num_pts/radius >=
+          opencv_processing_utils.CIRCLE_RADIUS_NUMPTS_THRESH and
+          math.isclose(1.0, _fill_metric_loop(shape, img_bw, color),
+                       abs_tol=opencv_processing_utils.CIRCLE_COLOR_ATOL)):
+        radii = [
+            image_processing_utils.distance(
+                (shape['ctx'], shape['cty']), numpy.squeeze(point))
+            for point in contour
+        ]
+        circles.append((shape['ctx'], shape['cty'], radius,
+                        max(radii) - min(radii)))
+        if len(circles) == 2:
+          break
+  return circles
+
+
+def _find_circles(img, min_area, color):
+  """Current global threshold pass of find_circle."""
+  img_size = img.shape
+  if img_size[0]*img_size[1] >= opencv_processing_utils.LOW_RES_IMG_THRESH:
+    circlish_atol = opencv_processing_utils.CIRCLISH_ATOL
+  else:
+    circlish_atol = opencv_processing_utils.CIRCLISH_LOW_RES_ATOL
+  img_gray = image_processing_utils.convert_rgb_to_grayscale(img)
+  img_bw = opencv_processing_utils.binarize_image(img_gray)
+  return opencv_processing_utils._find_circles_in_binarized_image(
+      img_bw, img_size, min_area, color, circlish_atol)
+
+
+def _best_time(func, reps):
+  """Returns the best seconds of func() over reps runs."""
+  best = float('inf')
+  for _ in range(reps):
+    start = time.perf_counter()
+    func()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def main():
+  """Prints time of old vs new circle search per scene image."""
+  scenes = _DEFAULT_SCENES
+  reps = _DEFAULT_REPS
+  for s in sys.argv[1:]:
+    if s.startswith('scenes='):
+      scenes = s.split('=')[1].split(',')
+    elif s.startswith('reps='):
+      reps = int(s.split('=')[1])
+    else:
+      raise ValueError(f'Unknown argument {s}')
+
+  min_area = image_fov_utils.CIRCLE_MIN_AREA
+  color = image_fov_utils.CIRCLE_COLOR
+  print(f'{"image":36}{"size":>11}{"found":>7}{"old ms":>9}{"new ms":>9}'
+        f'{"speedup":>9}')
+  for scene in scenes:
+    scene_path = os.path.join(os.environ['CAMERA_ITS_TOP'], 'tests', scene)
+    for img_file in sorted(glob.glob(os.path.join(scene_path, '*.png'))):
+      img = cv2.cvtColor(cv2.imread(img_file), cv2.COLOR_BGR2RGB).astype(float)
+      old_circles = _find_circles_loop(img, min_area, color)
+      _, new_contours = _find_circles(img, min_area, color)
+      if len(old_circles) != len(new_contours):
+        raise AssertionError(f'{img_file}: {len(old_circles)} circles before, '
+                             f'{len(new_contours)} now')
+      # pylint: disable=cell-var-from-loop
+      old_time = _best_time(
+          lambda: _find_circles_loop(img, min_area, color), reps)
+      new_time = _best_time(lambda: _find_circles(img, min_area, color), reps)
+      h, w = img.shape[:2]
+      print(f'{os.path.basename(img_file):36}{f"{w}x{h}":>11}'
+            f'{len(new_contours):7d}{old_time*1000:9.1f}{new_time*1000:9.1f}'
+            f'{old_time / new_time:8.1f}x')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,105 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the import time of ITS utils modules.
+
+Usage:
+  python tools/benchmark_import_time.py [modules=its_session_utils,...]
+      [reps=5] [top=10] [max_ms=N]
+Each module is imported in a new interpreter with -X importtime, as
+run_all_tests does per test. The best cumulative time over reps runs and
+the slowest modules it imported are printed. With max_ms, exits with an
+error if any module takes longer, so regressions can be caught.
+"""
+
+
+import os
+import re
+import subprocess
+import sys
+
+_DEFAULT_MODULES = ('image_processing_utils', 'its_session_utils',
+                    'opencv_processing_utils')
+_DEFAULT_REPS = 5
+_DEFAULT_TOP = 10
+# import time: self [us] | cumulative | imported package
+_IMPORT_TIME_RE = re.compile(
+    r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$')
+_USEC_TO_MSEC = 1E-3
+
+
+def _import_times(module):
+  """Imports module in a new interpreter.
+
+  Args:
+    module: str; name of the module to import.
+
+  Returns:
+    Dict of {module name: (self ms, cumulative ms)} of each top level and
+    nested import.
+  """
+  env = dict(os.environ)
+  utils_path = os.path.join(os.environ['CAMERA_ITS_TOP'], 'utils')
+  env['PYTHONPATH'] = os.pathsep.join(
+      p for p in (utils_path, env.get('PYTHONPATH')) if p)
+  result = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+      env=env, capture_output=True, text=True, check=True)
+  times = {}
+  for line in result.stderr.splitlines():
+    match = _IMPORT_TIME_RE.match(line)
+    if match:
+      times[match.group(4)] = (int(match.group(1)) * _USEC_TO_MSEC,
+                               int(match.group(2)) * _USEC_TO_MSEC)
+  return times
+
+
+def main():
+  """Prints import times and checks them against max_ms."""
+  modules = _DEFAULT_MODULES
+  reps = _DEFAULT_REPS
+  top = _DEFAULT_TOP
+  max_ms = None
+  for s in sys.argv[1:]:
+    if s.startswith('modules='):
+      modules = s.split('=')[1].split(',')
+    elif s.startswith('reps='):
+      reps = int(s.split('=')[1])
+    elif s.startswith('top='):
+      top = int(s.split('=')[1])
+    elif s.startswith('max_ms='):
+      max_ms = float(s.split('=')[1])
+    else:
+      raise ValueError(f'Unknown argument {s}')
+
+  slow_modules = []
+  for module in modules:
+    best = None
+    for _ in range(reps):
+      times = _import_times(module)
+      if best is None or times[module][1] < best[module][1]:
+        best = times
+    total_ms = best[module][1]
+    print(f'{module}: {total_ms:.1f} ms, {len(best)} modules imported')
+    slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (self_ms, cumulative_ms) in slowest[:top]:
+      print(f'  {name:40}{self_ms:9.1f} ms self{cumulative_ms:9.1f} ms total')
+    if max_ms is not None and total_ms > max_ms:
+      slow_modules.append(module)
+
+  if slow_modules:
+    sys.exit(f'Import time over {max_ms} ms: {", ".join(slow_modules)}')
+
+
+if __name__ == '__main__':
+  main()
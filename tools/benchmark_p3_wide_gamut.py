@@ -0,0 +1,106 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks the DISPLAY_P3 wide gamut check against the previous version.
+
+Usage:
+  python tools/benchmark_p3_wide_gamut.py [size=4000x3000] [reps=3]
+The image is a low saturation gradient with noise, which has no wide gamut
+pixels, so the previous per pixel loop visits every pixel. It is timed once.
+"""
+
+
+import sys
+import time
+
+import colour
+import numpy
+
+import image_processing_utils
+
+_DEFAULT_SIZE = (4000, 3000)  # 12MP
+_DEFAULT_REPS = 3
+_NOISE_STDEV = 8
+_SEED = 0
+
+
+def _has_wide_gamut_loop(wide_arr):
+  """Previous p3_img_has_wide_gamut, checking pixels one at a time."""
+  h, w = wide_arr.shape[:2]
+  display_p3 = colour.models.rgb.datasets.display_p3.RGB_COLOURSPACE_DISPLAY_P3
+  img_arr = colour.RGB_to_XYZ(
+      wide_arr / 255.0, display_p3.whitepoint, display_p3.whitepoint,
+      display_p3.matrix_RGB_to_XYZ, 'Bradford',
+      lambda x: colour.eotf(x, 'sRGB'))
+  xy_arr = colour.XYZ_to_xy(img_arr)
+  srgb_primaries = colour.models.RGB_COLOURSPACE_sRGB.primaries
+  for y in range(h):
+    for x in range(w):
+      if not image_processing_utils.point_in_triangle(
+          *srgb_primaries.reshape(6), xy_arr[y][x][0], xy_arr[y][x][1],
+          image_processing_utils.COLORSPACE_TRIANGLE_AREA_TOL):
+        return True
+  return False
+
+
+def _make_image(w, h):
+  """Returns an 8-bit RGB image of low saturation colors."""
+  rng = numpy.random.default_rng(_SEED)
+  ramp = numpy.linspace(48, 208, w)
+  img = numpy.empty((h, w, 3))
+  img[..., 0] = ramp
+  img[..., 1] = numpy.linspace(64, 192, h)[:, numpy.newaxis]
+  img[..., 2] = ramp[::-1]
+  img += rng.normal(0, _NOISE_STDEV, img.shape)
+  return numpy.clip(img, 0, 255).astype(numpy.uint8)
+
+
+def _best_time(func, reps):
+  """Returns the best seconds of func() over reps runs."""
+  best = float('inf')
+  for _ in range(reps):
+    start = time.perf_counter()
+    func()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def main():
+  """Prints time of old vs new wide gamut check."""
+  w, h = _DEFAULT_SIZE
+  reps = _DEFAULT_REPS
+  for s in sys.argv[1:]:
+    if s.startswith('size='):
+      w, h = (int(v) for v in s.split('=')[1].split('x'))
+    elif s.startswith('reps='):
+      reps = int(s.split('=')[1])
+    else:
+      raise ValueError(f'Unknown argument {s}')
+
+  img = _make_image(w, h)
+  mask = image_processing_utils.p3_img_wide_gamut_mask(img)
+  new_time = _best_time(
+      lambda: image_processing_utils.p3_img_wide_gamut_mask(img), reps)
+  start = time.perf_counter()
+  old_result = _has_wide_gamut_loop(img)
+  old_time = time.perf_counter() - start
+  if old_result != mask.any():
+    raise AssertionError(f'Wide gamut was {old_result} before, '
+                         f'{mask.any()} now')
+  print(f'{w}x{h}: wide gamut {mask.mean() * 100:.4f}%, '
+        f'old {old_time:.2f}s, new {new_time:.3f}s, '
+        f'speedup {old_time / new_time:.0f}x')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,124 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks RAW10/RAW12 unpacking against the previous implementation.
+
+Usage:
+  python tools/benchmark_raw_unpack.py [sizes=12,50,200] [reps=3]
+sizes are sensor megapixels, with 4:3 frames rounded to quad Bayer sizes.
+"""
+
+
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+import image_processing_utils
+
+_DEFAULT_SIZES_MP = (12, 50, 200)
+_DEFAULT_REPS = 3
+_MP = 1000 * 1000
+
+
+def _unpack_raw10_image_numpy_delete(img):
+  """Previous RAW10 unpacker, using numpy.delete and unpackbits/packbits."""
+  w = img.shape[1] * 4 // 5
+  h = img.shape[0]
+  msbs = numpy.delete(img, numpy.s_[4::5], 1)
+  msbs = msbs.astype(numpy.uint16)
+  msbs = numpy.left_shift(msbs, 2)
+  msbs = msbs.reshape(h, w)
+  lsbs = img[::, 4::5].reshape(h, w // 4)
+  lsbs = numpy.right_shift(
+      numpy.packbits(numpy.unpackbits(lsbs).reshape((h, w // 4, 4, 2)), 3), 6)
+  lsbs = lsbs.reshape(h, w // 4, 4)[:, :, ::-1]
+  lsbs = lsbs.reshape(h, w)
+  return numpy.bitwise_or(msbs, lsbs).reshape(h, w)
+
+
+def _unpack_raw12_image_numpy_delete(img):
+  """Previous RAW12 unpacker, using numpy.delete and unpackbits/packbits."""
+  w = img.shape[1] * 2 // 3
+  h = img.shape[0]
+  msbs = numpy.delete(img, numpy.s_[2::3], 1)
+  msbs = msbs.astype(numpy.uint16)
+  msbs = numpy.left_shift(msbs, 4)
+  msbs = msbs.reshape(h, w)
+  lsbs = img[::, 2::3].reshape(h, w // 2)
+  lsbs = numpy.right_shift(
+      numpy.packbits(numpy.unpackbits(lsbs).reshape((h, w // 2, 2, 4)), 3), 4)
+  lsbs = lsbs.reshape(h, w // 2, 2)[:, :, ::-1]
+  lsbs = lsbs.reshape(h, w)
+  return numpy.bitwise_or(msbs, lsbs).reshape(h, w)
+
+
+def _frame_size(megapixels):
+  """Returns (w, h) of a 4:3 frame of megapixels, multiples of 4."""
+  h = int(numpy.sqrt(megapixels * _MP * 3 / 4)) // 4 * 4
+  w = h * 4 // 3 // 4 * 4
+  return w, h
+
+
+def _measure(func, reps):
+  """Returns (best seconds, peak traced bytes) of func() over reps runs."""
+  best = float('inf')
+  for _ in range(reps):
+    start = time.perf_counter()
+    func()
+    best = min(best, time.perf_counter() - start)
+  tracemalloc.start()
+  func()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return best, peak
+
+
+def main():
+  """Prints time and peak memory of old vs new unpackers per frame size."""
+  sizes = _DEFAULT_SIZES_MP
+  reps = _DEFAULT_REPS
+  for s in sys.argv[1:]:
+    if s.startswith('sizes='):
+      sizes = [float(x) for x in s.split('=')[1].split(',')]
+    elif s.startswith('reps='):
+      reps = int(s.split('=')[1])
+    else:
+      raise ValueError(f'Unknown argument {s}')
+
+  rng = numpy.random.default_rng(0)
+  print(f'{"format":8}{"MP":>6}{"size":>13}{"old s":>9}{"new s":>9}'
+        f'{"speedup":>9}{"old MB":>9}{"new MB":>9}')
+  for megapixels in sizes:
+    w, h = _frame_size(megapixels)
+    out = numpy.empty((h, w), dtype=numpy.uint16)
+    for fmt, bytes_per_row, old_func, new_func in (
+        ('raw10', w * 5 // 4, _unpack_raw10_image_numpy_delete,
+         image_processing_utils.unpack_raw10_image),
+        ('raw12', w * 3 // 2, _unpack_raw12_image_numpy_delete,
+         image_processing_utils.unpack_raw12_image)):
+      packed = rng.integers(0, 256, (h, bytes_per_row), dtype=numpy.uint8)
+      new_img = new_func(packed, out)
+      if not numpy.array_equal(new_img, old_func(packed)):
+        raise AssertionError(f'{fmt} {w}x{h} unpack mismatch')
+      old_time, old_peak = _measure(lambda: old_func(packed), reps)
+      # pylint: disable=cell-var-from-loop
+      new_time, new_peak = _measure(lambda: new_func(packed, out), reps)
+      print(f'{fmt:8}{megapixels:6g}{f"{w}x{h}":>13}{old_time:9.3f}'
+            f'{new_time:9.3f}{old_time / new_time:8.1f}x'
+            f'{old_peak / _MP:9.1f}{new_peak / _MP:9.1f}')
+
+
+if __name__ == '__main__':
+  main()
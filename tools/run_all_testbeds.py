@@ -0,0 +1,205 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs ITS scenes concurrently across all tablet testbeds in config.yml.
+
+Each tablet TestBed (a DUT and tablet pair) runs tools/run_all_tests.py on a
+shard of the scenes. Scenes are assigned longest first to the testbed with
+the least scheduled time, using scene durations recorded by previous runs in
+SCENE_DURATIONS_FILE. When all testbeds finish, their results are merged per
+camera and reported to the DUT of the first testbed, as run_all_tests.py does.
+
+Usage:
+  python tools/run_all_testbeds.py [camera=0,1] [scenes=0,1_1,2] [extra args]
+Extra args, e.g. executor=warm or session_broker=true, are passed through to
+run_all_tests.py.
+"""
+
+
+import glob
+import json
+import logging
+import os
+import os.path
+import subprocess
+import sys
+
+import numpy as np
+import run_all_tests
+
+
+SCENE_DURATIONS_FILE = os.path.join(
+    run_all_tests.YAML_FILE_DIR, 'scene_durations.json')
+_DEFAULT_SCENE_DURATION_SEC = 300
+_MSEC_TO_SEC = 1 / 1000
+
+
+def load_scene_durations(file_name=SCENE_DURATIONS_FILE):
+  """Returns dict of scene name to duration in seconds from previous runs."""
+  if not os.path.isfile(file_name):
+    return {}
+  with open(file_name, 'r') as f:
+    return json.load(f)
+
+
+def update_scene_durations(results_by_camera, file_name=SCENE_DURATIONS_FILE):
+  """Records the total duration of each scene in this run for scheduling.
+
+  Durations of a scene on all cameras are summed, replacing the value of
+  earlier runs.
+
+  Args:
+    results_by_camera: dict of camera_id to results dict of run_all_tests.
+    file_name: str; JSON file with scene durations.
+  """
+  durations = load_scene_durations(file_name)
+  run_durations = {}
+  for results in results_by_camera.values():
+    for scene, result in results.items():
+      if run_all_tests.TIME_KEY_START in result:
+        duration = (result[run_all_tests.TIME_KEY_END] -
+                    result[run_all_tests.TIME_KEY_START]) * _MSEC_TO_SEC
+        run_durations[scene] = run_durations.get(scene, 0) + duration
+  durations.update(run_durations)
+  with open(file_name, 'w') as f:
+    json.dump(durations, f, indent=2, sort_keys=True)
+
+
+def shard_scenes(scenes, num_shards, durations):
+  """Splits scenes into num_shards lists with balanced total duration.
+
+  Scenes are assigned longest first to the shard with the least total
+  duration. Scenes without a recorded duration use the mean of the known
+  durations. Each shard keeps the original scene order.
+
+  Args:
+    scenes: list of scene names.
+    num_shards: int; number of shards.
+    durations: dict of scene name to duration in seconds.
+
+  Returns:
+    List of num_shards lists of scene names, some possibly empty.
+  """
+  known = [durations[s] for s in scenes if s in durations]
+  default = np.mean(known) if known else _DEFAULT_SCENE_DURATION_SEC
+  scene_durations = [durations.get(s, default) for s in scenes]
+  shard_durations = np.zeros(num_shards)
+  assignment = [0] * len(scenes)
+  for i in np.argsort(scene_durations, kind='stable')[::-1]:
+    shard = int(np.argmin(shard_durations))
+    assignment[i] = shard
+    shard_durations[shard] += scene_durations[i]
+  logging.debug('Scheduled shard durations: %s', shard_durations)
+  return [[s for s, a in zip(scenes, assignment) if a == shard]
+          for shard in range(num_shards)]
+
+
+def merge_results(results_list):
+  """Merges per-scene results of several testbeds for one camera.
+
+  Args:
+    results_list: list of run_all_tests results dicts for the same camera.
+
+  Returns:
+    Results dict with each scene taken from the testbed that executed it.
+  """
+  merged = {}
+  for results in results_list:
+    for scene, result in results.items():
+      if (scene not in merged or
+          result[run_all_tests.RESULT_KEY] !=
+          run_all_tests.RESULT_NOT_EXECUTED):
+        merged[scene] = result
+  return merged
+
+
+def get_tablet_testbed_indices(config_file_contents):
+  """Returns indices of TestBeds with 'tablet' in their name."""
+  return [i for i, testbed in enumerate(config_file_contents['TestBeds'])
+          if run_all_tests.TEST_KEY_TABLET in testbed['Name'].lower()]
+
+
+def main():
+  """Shards scenes over tablet testbeds, runs them, and reports results."""
+  logging.basicConfig(level=logging.INFO)
+  scenes = []
+  camera_arg = None
+  extra_args = []
+  for s in sys.argv[1:]:
+    if 'scenes=' in s:
+      scenes = s.split('=')[1].split(',')
+    elif 'camera=' in s:
+      camera_arg = s
+    elif 'testbed_index=' in s or 'num_testbeds=' in s or 'report=' in s:
+      raise ValueError(f'{s} is set by the scheduler')
+    else:
+      extra_args.append(s)
+
+  config_file_contents = run_all_tests.get_config_file_contents()
+  testbed_indices = get_tablet_testbed_indices(config_file_contents)
+  if not testbed_indices:
+    raise ValueError('No tablet TestBeds found in config file.')
+  if not scenes:
+    scenes = str(run_all_tests.get_test_params(
+        config_file_contents)['scene']).split(',')
+  run_all_tests.normalize_scene_names(scenes)
+  if '<scene-name>' in scenes:
+    scenes = run_all_tests.get_tablet_scenes()
+  scenes = run_all_tests.expand_grouped_scenes(scenes)
+
+  shards = shard_scenes(scenes, len(testbed_indices), load_scene_durations())
+  for temp_file in glob.glob('testbed_*.tmp'):
+    os.remove(temp_file)
+  procs = []
+  for testbed_index, shard in zip(testbed_indices, shards):
+    if not shard:
+      continue
+    cmd = [sys.executable, os.path.join(os.path.dirname(__file__),
+                                        'run_all_tests.py'),
+           f'testbed_index={testbed_index}',
+           f'num_testbeds={len(config_file_contents["TestBeds"])}',
+           'report=false', f'scenes={",".join(shard)}'] + extra_args
+    if camera_arg:
+      cmd.append(camera_arg)
+    logging.info('Testbed %d scenes: %s', testbed_index, shard)
+    procs.append((testbed_index, subprocess.Popen(cmd)))
+  completed_testbeds = []
+  for testbed_index, proc in procs:
+    if proc.wait() != 0:
+      logging.error('Testbed %d exited with code %d',
+                    testbed_index, proc.returncode)
+    completed_testbeds.append(testbed_index)
+
+  main_device_id = run_all_tests.get_device_serial_number(
+      'dut', {'TestBeds': [
+          config_file_contents['TestBeds'][testbed_indices[0]]]})
+  results_by_camera = {}
+  for device_id, camera_id, results in run_all_tests.parse_testbeds(
+      completed_testbeds):
+    if not run_all_tests.are_devices_similar(main_device_id, device_id):
+      logging.error('Device %s and device %s are not the same '
+                    'model/type/build/revision.', main_device_id, device_id)
+      return
+    results_by_camera.setdefault(camera_id, []).append(results)
+  results_by_camera = {camera_id: merge_results(results_list)
+                       for camera_id, results_list in results_by_camera.items()}
+  for camera_id, results in results_by_camera.items():
+    logging.info('Reporting camera %s ITS results to CtsVerifier', camera_id)
+    run_all_tests.report_result(main_device_id, camera_id, results)
+  update_scene_durations(results_by_camera)
+  for temp_file in glob.glob('testbed_*.tmp'):
+    os.remove(temp_file)
+
+
+if __name__ == '__main__':
+  main()
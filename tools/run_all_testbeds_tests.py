@@ -0,0 +1,64 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for run_all_testbeds script."""
+
+import os
+import tempfile
+import unittest
+
+import run_all_testbeds
+import run_all_tests
+
+
+class RunAllTestbedsTests(unittest.TestCase):
+  """Unit tests to verify run_all_testbeds scheduling and merging."""
+
+  def test_shard_scenes_balances_durations(self):
+    durations = {'scene0': 100, 'scene1_1': 600, 'scene2_a': 300,
+                 'scene3': 250, 'scene4': 50}
+    shards = run_all_testbeds.shard_scenes(
+        list(durations), 2, durations)
+    self.assertEqual(shards, [['scene1_1', 'scene4'],
+                              ['scene0', 'scene2_a', 'scene3']])
+
+  def test_shard_scenes_unknown_duration_uses_mean(self):
+    shards = run_all_testbeds.shard_scenes(
+        ['scene0', 'scene3', 'scene9'], 3, {'scene0': 10, 'scene3': 30})
+    self.assertCountEqual(shards, [['scene0'], ['scene3'], ['scene9']])
+
+  def test_merge_results_prefers_executed(self):
+    not_executed = {run_all_tests.RESULT_KEY: run_all_tests.RESULT_NOT_EXECUTED}
+    passed = {run_all_tests.RESULT_KEY: run_all_tests.RESULT_PASS}
+    failed = {run_all_tests.RESULT_KEY: run_all_tests.RESULT_FAIL}
+    merged = run_all_testbeds.merge_results([
+        {'scene0': passed, 'scene3': not_executed, 'scene4': not_executed},
+        {'scene0': not_executed, 'scene3': failed, 'scene4': not_executed},
+    ])
+    self.assertEqual(merged, {'scene0': passed, 'scene3': failed,
+                              'scene4': not_executed})
+
+  def test_update_scene_durations(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      file_name = os.path.join(tmp_dir, 'durations.json')
+      result = {run_all_tests.RESULT_KEY: run_all_tests.RESULT_PASS,
+                run_all_tests.TIME_KEY_START: 1000,
+                run_all_tests.TIME_KEY_END: 61000}
+      run_all_testbeds.update_scene_durations(
+          {'0': {'scene0': result}, '1': {'scene0': result}}, file_name)
+      self.assertEqual(run_all_testbeds.load_scene_durations(file_name),
+                       {'scene0': 120})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -31,6 +31,8 @@ import its_device_utils
 import its_session_utils
 import lighting_control_utils
 import numpy as np
+import session_broker_utils
+import warm_test_executor
 import yaml
 
 
@@ -209,6 +211,8 @@ _EXTENSION_NAMES = (
 _DST_SCENE_DIR = '/sdcard/Download/'
 _SUB_CAMERA_LEVELS = 2
 MOBLY_TEST_SUMMARY_TXT_FILE = 'test_mobly_summary.txt'
+TEST_TIMING_REPORT_FILE = 'test_timing_report.txt'
+_EXECUTORS = ('subprocess', 'warm')
 
 
 def report_result(device_id, camera_id, results):
@@ -534,6 +538,43 @@ def augment_sub_camera_tests(first_api_level):
     SUB_CAMERA_TESTS['scene6'] = ('test_in_sensor_zoom',)
 
 
+def normalize_scene_names(scenes):
+  """Prepends 'scene' and handles abbreviated scene names, in place.
+
+  Args:
+    scenes: list of scene names as given at the command line.
+  """
+  for i, s in enumerate(scenes):
+    if (not s.startswith('scene') and
+        not s.startswith(('checkerboard', 'sensor_fusion',
+                          'flash', 'feature_combination', '<scene-name>'))):
+      scenes[i] = f'scene{s}'
+    if s.startswith('flash') or s.startswith('extensions'):
+      scenes[i] = f'scene_{s}'
+    # Handle scene_extensions
+    if any(s.startswith(extension) for extension in _EXTENSION_NAMES):
+      scenes[i] = f'scene_extensions/scene_{s}'
+    if (any(s.startswith('scene_' + extension)
+            for extension in _EXTENSION_NAMES)):
+      scenes[i] = f'scene_extensions/{s}'
+
+
+def get_tablet_scenes():
+  """Returns the list of scenes displayed on the tablet."""
+  return list(_TABLET_SCENES)
+
+
+def expand_grouped_scenes(scenes):
+  """Returns scenes with grouped scenes expanded and duplicates removed.
+
+  Args:
+    scenes: list of scene names, as normalized by normalize_scene_names.
+  """
+  scenes = [_GROUPED_SCENES[s] if s in _GROUPED_SCENES else s for s in scenes]
+  scenes = np.hstack(scenes).tolist()
+  return sorted(set(scenes), key=scenes.index)
+
+
 def main():
   """Run all the Camera ITS automated tests.
 
@@ -546,6 +587,20 @@ def main():
                  multiple scenes. Ex: "scenes=scene0,scene1_1" or
                  "scenes=0,1_1,sensor_fusion" (sceneX can be abbreviated by X
                  where X is scene name minus 'scene')
+        session_broker: "session_broker=true" keeps one ItsService connection
+                 per camera and shares it across all tests instead of
+                 restarting ItsService for every test.
+        executor: "executor=warm" runs each test in a process forked from an
+                 interpreter with numpy/cv2/mobly/etc. already imported, and
+                 writes a cold vs warm startup timing report.
+                 Default is "executor=subprocess".
+        report: "report=false" writes results of testbed_index for merging
+                 by tools/run_all_testbeds.py instead of reporting them to
+                 CtsVerifier, and skips cameras with no valid scene.
+        props_cache: "props_cache=false" reads camera properties from the
+                 device in every test instead of from the cache of previous
+                 runs on the same build. "props_cache=clear" clears the
+                 cache of the device before running.
   """
   logging.basicConfig(level=logging.INFO)
   # Make output directories to hold the generated files.
@@ -559,6 +614,10 @@ def main():
   camera_id_combos = []
   testbed_index = None
   num_testbeds = None
+  use_session_broker = False
+  executor = _EXECUTORS[0]
+  report_results = True
+  props_cache = 'true'
   # Override camera, scenes and testbed with cmd line values if available
   for s in list(sys.argv[1:]):
     if 'scenes=' in s:
@@ -569,8 +628,22 @@ def main():
       testbed_index = int(s.split('=')[1])
     elif 'num_testbeds=' in s:
       num_testbeds = int(s.split('=')[1])
+    elif 'session_broker=' in s:
+      use_session_broker = s.split('=')[1].lower() == 'true'
+    elif 'executor=' in s:
+      executor = s.split('=')[1]
+      if executor not in _EXECUTORS:
+        raise ValueError(f'executor must be one of {_EXECUTORS}')
+    elif 'report=' in s:
+      report_results = s.split('=')[1].lower() != 'false'
+    elif 'props_cache=' in s:
+      props_cache = s.split('=')[1].lower()
+      if props_cache not in ('true', 'false', 'clear'):
+        raise ValueError('props_cache must be one of true, false, clear')
     else:
       raise ValueError(f'Unknown argument {s}')
+  if not report_results and testbed_index is None:
+    raise ValueError('testbed_index must be specified if report=false.')
   if testbed_index is None and num_testbeds is not None:
     raise ValueError(
         'testbed_index must be specified if num_testbeds is specified.')
@@ -579,20 +652,7 @@ def main():
     raise ValueError('testbed_index must be less than num_testbeds. '
                      'testbed_index starts at 0.')
 
-  # Prepend 'scene' if not specified at cmd line
-  for i, s in enumerate(scenes):
-    if (not s.startswith('scene') and
-        not s.startswith(('checkerboard', 'sensor_fusion',
-                          'flash', 'feature_combination', '<scene-name>'))):
-      scenes[i] = f'scene{s}'
-    if s.startswith('flash') or s.startswith('extensions'):
-      scenes[i] = f'scene_{s}'
-    # Handle scene_extensions
-    if any(s.startswith(extension) for extension in _EXTENSION_NAMES):
-      scenes[i] = f'scene_extensions/scene_{s}'
-    if (any(s.startswith('scene_' + extension)
-            for extension in _EXTENSION_NAMES)):
-      scenes[i] = f'scene_extensions/{s}'
+  normalize_scene_names(scenes)
 
   # Read config file and extract relevant TestBed
   config_file_contents = get_config_file_contents()
@@ -621,6 +681,10 @@ def main():
     scenes = [_INT_STR_DICT.get(n, n) for n in scenes]  # recover '1_1' & '1_2'
 
   device_id = get_device_serial_number('dut', config_file_contents)
+  if props_cache == 'false':
+    os.environ[its_session_utils.CAMERA_PROPS_CACHE_ENV] = 'false'
+  elif props_cache == 'clear':
+    its_session_utils.invalidate_camera_properties_cache(device_id)
   # Enable external storage on DUT to send summary report to CtsVerifier.apk
   enable_external_storage(device_id)
 
@@ -667,9 +731,7 @@ def main():
     testing_flash_with_controller = True
 
   # Expand GROUPED_SCENES and remove any duplicates
-  scenes = [_GROUPED_SCENES[s] if s in _GROUPED_SCENES else s for s in scenes]
-  scenes = np.hstack(scenes).tolist()
-  scenes = sorted(set(scenes), key=scenes.index)
+  scenes = expand_grouped_scenes(scenes)
   # List of scenes to be executed in folded state will have '_folded'
   # prefix. This will help distinguish the test results from folded vs
   # open device state for front camera_ids.
@@ -687,6 +749,10 @@ def main():
     auto_scene_switch = False
     logging.info('Manual, checkerboard scenes, or scene5 testing.')
 
+  test_executor = None
+  if executor == 'warm':
+    test_executor = warm_test_executor.WarmTestExecutor()
+
   folded_prompted = False
   opened_prompted = False
   for camera_id in camera_id_combos:
@@ -756,6 +822,10 @@ def main():
         if s in possible_scenes:
           per_camera_scenes.append(s)
       if not per_camera_scenes:
+        if not report_results:
+          logging.info('No scene of this testbed is valid for camera %s',
+                       camera_id)
+          continue
         raise ValueError('No valid scene specified for this camera.')
 
     # Folded state scenes will have 'folded' suffix only for
@@ -795,6 +865,10 @@ def main():
     )
     mobly_output_logs_path = os.path.join(topdir, f'cam_id_{camera_id_str}')
     os.mkdir(mobly_output_logs_path)
+    session_broker = None
+    if use_session_broker:
+      session_broker = session_broker_utils.ItsSessionBroker(device_id)
+      session_broker.start()
     tot_pass = 0
     for s in per_camera_scenes:
       results[s]['TEST_STATUS'] = []
@@ -886,7 +960,10 @@ def main():
           # pylint: disable=subprocess-run-check
           with open(
               os.path.join(topdir, MOBLY_TEST_SUMMARY_TXT_FILE), 'w') as fp:
-            output = subprocess.run(cmd, stdout=fp)
+            if test_executor:
+              output = test_executor.run(cmd[1], cmd[2:], fp)
+            else:
+              output = subprocess.run(cmd, stdout=fp)
           # pylint: enable=subprocess-run-check
 
           # Parse mobly logs to determine PASS/FAIL(*)/SKIP & socket FAILs
@@ -1013,8 +1090,13 @@ def main():
       new_yaml_file_path = os.path.join(YAML_FILE_DIR, new_yml_file_name)
       os.remove(new_yaml_file_path)
 
+    if session_broker:
+      session_broker.stop()
+
     # Log results per camera
-    if num_testbeds is None or testbed_index == _MAIN_TESTBED:
+    if not report_results:
+      write_result(testbed_index, device_id, camera_id, results)
+    elif num_testbeds is None or testbed_index == _MAIN_TESTBED:
       logging.info('Reporting camera %s ITS results to CtsVerifier', camera_id)
       logging.info('ITS results to CtsVerifier: %s', results)
       report_result(device_id, camera_id, results)
@@ -1038,7 +1120,18 @@ def main():
   lighting_control_utils.set_lighting_state(
       arduino_serial_port, lighting_ch, 'OFF')
 
-  if num_testbeds is not None:
+  # The timing report is diagnostic only, so it never fails the run.
+  if test_executor:
+    try:
+      test_executor.write_timing_report(
+          os.path.join(topdir, TEST_TIMING_REPORT_FILE))
+    except (OSError, subprocess.CalledProcessError) as e:
+      logging.info('Test timing report failed: %r', e)
+
+  if not report_results:
+    with open(f'testbed_{testbed_index}_completed.tmp', 'w') as _:
+      pass
+  elif num_testbeds is not None:
     if testbed_index == _MAIN_TESTBED:
       logging.info('Waiting for all testbeds to finish.')
       start = time.time()
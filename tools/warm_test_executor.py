@@ -0,0 +1,174 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs ITS test scripts in processes forked from a warm interpreter.
+
+run_all_tests.py normally starts 'python3 <test>.py -c <config>' for every
+test, so each test pays for importing numpy, scipy, cv2, matplotlib, mobly
+and the ITS utils. WarmTestExecutor imports those once in a multiprocessing
+fork server and forks a fresh child per test, which then runs the test
+script as __main__ exactly like the command line would. Every test still gets
+its own process, mobly log dir and stdout file, and its exit code is returned
+in a subprocess.CompletedProcess so results are parsed as before.
+"""
+
+
+import logging
+import multiprocessing
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+_MODULE_NAME = 'warm_test_executor'
+_PRELOAD_MODULES = (
+    'numpy',
+    'scipy.spatial',
+    'scipy.stats',
+    'cv2',
+    'matplotlib',
+    'matplotlib.pylab',
+    'PIL.Image',
+    'mobly.base_test',
+    'mobly.test_runner',
+    'mobly.controllers.android_device',
+    'camera_properties_utils',
+    'capture_request_utils',
+    'image_processing_utils',
+    'opencv_processing_utils',
+    'its_session_utils',
+    'its_base_test',
+    _MODULE_NAME,
+)
+_NUM_OVERHEAD_SAMPLES = 3
+
+
+def _run_test_file(test_path, args, stdout_path, environ):
+  """Runs test_path as __main__ with args, writing stdout to stdout_path.
+
+  Executed in the forked child process.
+
+  Args:
+    test_path: str; path of the test script.
+    args: list of command line arguments for the test script.
+    stdout_path: str; file to append the test's stdout to.
+    environ: dict; environment of the caller, which the fork server started
+      earlier may not share (e.g. a session broker port).
+  """
+  os.environ.clear()
+  os.environ.update(environ)
+  sys.stdout.flush()
+  with open(stdout_path, 'a') as f:
+    os.dup2(f.fileno(), sys.stdout.fileno())
+  sys.argv = [test_path] + list(args)
+  # Match 'python3 <test_path>', which puts the script dir first on sys.path
+  sys.path.insert(0, os.path.dirname(os.path.abspath(test_path)))
+  runpy.run_path(test_path, run_name='__main__')
+
+
+def _noop():
+  pass
+
+
+class WarmTestExecutor(object):
+  """Runs test scripts in children of a fork server with heavy imports done.
+
+  Attributes:
+    timings: list of (test_path, seconds) for every test run.
+  """
+
+  def __init__(self, preload_modules=_PRELOAD_MODULES):
+    self._preload_modules = list(preload_modules)
+    self._ctx = multiprocessing.get_context('forkserver')
+    self._ctx.set_forkserver_preload(self._preload_modules)
+    self.timings = []
+
+  def run(self, test_path, args, stdout):
+    """Runs a test script, as subprocess.run([python, test_path] + args).
+
+    Args:
+      test_path: str; path of the test script.
+      args: list of command line arguments for the test script.
+      stdout: open file object the test's stdout is written to.
+
+    Returns:
+      subprocess.CompletedProcess with the test's exit code.
+    """
+    stdout.flush()
+    start_time = time.time()
+    proc = self._ctx.Process(
+        target=_run_test_file,
+        args=(test_path, args, stdout.name, dict(os.environ)))
+    proc.start()
+    proc.join()
+    self.timings.append((test_path, time.time() - start_time))
+    return subprocess.CompletedProcess(
+        ['python3', test_path] + list(args), proc.exitcode)
+
+  def measure_startup_overhead(self, num_samples=_NUM_OVERHEAD_SAMPLES):
+    """Measures per-test startup cost of cold interpreters vs warm forks.
+
+    Cold startup is a new interpreter importing the preloaded modules, warm
+    startup is forking a no-op child from the fork server.
+
+    Args:
+      num_samples: int; number of runs averaged for each measurement.
+
+    Returns:
+      Tuple of average (cold, warm) startup seconds. cold is None if no
+      module besides this one is preloaded.
+    """
+    # A cold test never imports this module, which is only preloaded so the
+    # fork server can unpickle _run_test_file. It is not on PYTHONPATH either.
+    cold_modules = [m for m in self._preload_modules if m != _MODULE_NAME]
+    import_cmd = [sys.executable, '-c', 'import ' + ', '.join(cold_modules)]
+    cold_times = []
+    warm_times = []
+    for _ in range(num_samples):
+      if cold_modules:
+        start_time = time.time()
+        subprocess.run(import_cmd, stdout=subprocess.DEVNULL, check=True)
+        cold_times.append(time.time() - start_time)
+      start_time = time.time()
+      proc = self._ctx.Process(target=_noop)
+      proc.start()
+      proc.join()
+      warm_times.append(time.time() - start_time)
+    cold = sum(cold_times) / num_samples if cold_times else None
+    return (cold, sum(warm_times) / num_samples)
+
+  def write_timing_report(self, file_name):
+    """Writes startup overhead and per-test durations to file_name.
+
+    Args:
+      file_name: str; path of the report file.
+    """
+    cold, warm = self.measure_startup_overhead()
+    num_tests = len(self.timings)
+    if cold is None:
+      lines = [f'startup overhead per test: warm {warm:.3f}s', '']
+      logging.info('Test startup overhead: warm %.3fs', warm)
+    else:
+      lines = [
+          f'startup overhead per test: cold {cold:.3f}s, warm {warm:.3f}s',
+          f'estimated saving for {num_tests} tests: '
+          f'{(cold - warm) * num_tests:.1f}s',
+          '',
+      ]
+      logging.info('Test startup overhead: cold %.3fs, warm %.3fs, '
+                   'estimated saving %.1fs over %d tests',
+                   cold, warm, (cold - warm) * num_tests, num_tests)
+    lines += [f'{duration:8.2f}s  {test}' for test, duration in self.timings]
+    with open(file_name, 'w') as f:
+      f.write('\n'.join(lines) + '\n')
@@ -0,0 +1,66 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for warm_test_executor."""
+
+import os
+import tempfile
+import unittest
+
+import warm_test_executor
+
+_TEST_SCRIPT = """
+import sys
+print('argv:', sys.argv[1:])
+if __name__ == '__main__':
+  sys.exit(int(sys.argv[1]))
+"""
+
+
+class WarmTestExecutorTests(unittest.TestCase):
+  """Unit tests to verify tests run through WarmTestExecutor."""
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp_dir.cleanup)
+    self.test_path = os.path.join(self.tmp_dir.name, 'test_fake.py')
+    with open(self.test_path, 'w') as f:
+      f.write(_TEST_SCRIPT)
+    self.executor = warm_test_executor.WarmTestExecutor(
+        preload_modules=('warm_test_executor',))
+
+  def _run(self, exit_code):
+    stdout_path = os.path.join(self.tmp_dir.name, 'stdout.txt')
+    with open(stdout_path, 'w') as fp:
+      output = self.executor.run(self.test_path, [str(exit_code)], fp)
+    with open(stdout_path, 'r') as fp:
+      return output.returncode, fp.read()
+
+  def test_pass_and_fail_exit_codes(self):
+    self.assertEqual(self._run(0), (0, "argv: ['0']\n"))
+    self.assertEqual(self._run(1), (1, "argv: ['1']\n"))
+    self.assertEqual(len(self.executor.timings), 2)
+
+  def test_timing_report(self):
+    self._run(0)
+    report_path = os.path.join(self.tmp_dir.name, 'report.txt')
+    self.executor.write_timing_report(report_path)
+    with open(report_path, 'r') as fp:
+      content = fp.read()
+    self.assertIn('startup overhead per test', content)
+    self.assertIn(self.test_path, content)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,33 +14,63 @@
 """Image processing utility functions."""
 
 
+import collections
+import concurrent.futures
 import copy
+import functools
 import io
+import json
 import logging
 import math
-import matplotlib
-from matplotlib import pylab
-import matplotlib.pyplot
 import os
+import re
 import sys
 
 import capture_request_utils
-import colour
 import error_util
+import lazy_import_utils
 import noise_model_constants
 import numpy
 from PIL import Image
 from PIL import ImageCms
 
+# colour is slow to import and only used for DISPLAY_P3 gamut checks.
+colour = lazy_import_utils.lazy_import('colour')
 
 _CMAP_BLUE = ('black', 'blue', 'lightblue')
 _CMAP_GREEN = ('black', 'green', 'lightgreen')
 _CMAP_RED = ('black', 'red', 'lightcoral')
 _CMAP_SIZE = 6  # 6 inches
 _NUM_RAW_CHANNELS = 4  # R, Gr, Gb, B
+_UNPACK_TILE_ROWS = 64  # rows of packed RAW10/RAW12 unpacked per band
+_RAW_TO_RGB_TILE_ROWS = 128  # RGB rows converted per band of a Bayer image
+_FUSED_RAW_TO_RGB_FORMATS = ('raw', 'raw10', 'raw12')
+_LSC_WEIGHTS_CACHE_SIZE = 8  # (map shape, plane shape) pairs kept
+_YUV_BATCH_PIXELS = 1024 * 1024  # pixels of YUV frames converted at once
+_NUM_RGB888_COLORS = 1 << 24  # distinct 8-bit RGB colors
+_IMAGE_WRITER_NUM_WORKERS = 4
+# JSON strings, with a group for the ':' after object keys, and brackets.
+_JSON_TOKEN_RE = re.compile(rb'("(?:[^"\\]|\\.)*")(\s*:)?|[\[\]{}]')
 
 LENS_SHADING_MAP_ON = 1
 
+# JPEG marker codes, the byte following 0xFF
+JPEG_SOI_MARKER = 0xD8  # Start Of Image
+JPEG_EOI_MARKER = 0xD9  # End Of Image
+JPEG_SOS_MARKER = 0xDA  # Start Of Scan
+JPEG_DQT_MARKER = 0xDB  # Define Quantization Table
+JPEG_DHT_MARKER = 0xC4  # Define Huffman Table
+JPEG_SOF0_MARKER = 0xC0  # Start Of Frame, baseline
+JPEG_APP0_MARKER = 0xE0  # APPn markers are APP0 + n
+JPEG_APP1_MARKER = 0xE1  # EXIF and XMP
+JPEG_APP2_MARKER = 0xE2  # ICC profile and MPF
+_JPEG_MARKER_PREFIX = 0xFF
+_JPEG_STANDALONE_MARKERS = frozenset(range(0xD0, 0xD8)) | {0x01}  # RSTn, TEM
+_JPEG_DQT_NUM_VALUES = 64
+_JPEG_ICC_PROFILE_ID = b'ICC_PROFILE\0'
+_JPEG_ICC_CHUNK_HEADER_SIZE = len(_JPEG_ICC_PROFILE_ID) + 2  # seq, count
+_JPEG_XMP_GAIN_MAP_NAMESPACE = b'hdrgm'
+
 # The matrix is from JFIF spec
 DEFAULT_YUV_TO_RGB_CCM = numpy.matrix([[1.000, 0.000, 1.402],
                                        [1.000, -0.344, -0.714],
@@ -48,9 +78,6 @@ DEFAULT_YUV_TO_RGB_CCM = numpy.matrix([[1.000, 0.000, 1.402],
 
 DEFAULT_YUV_OFFSETS = numpy.array([0, 128, 128])
 MAX_LUT_SIZE = 65536
-DEFAULT_GAMMA_LUT = numpy.array([
-    math.floor((MAX_LUT_SIZE-1) * math.pow(i/(MAX_LUT_SIZE-1), 1/2.2) + 0.5)
-    for i in range(MAX_LUT_SIZE)])
 NUM_TRIES = 2
 NUM_FRAMES = 4
 RGB2GRAY_WEIGHTS = (0.299, 0.587, 0.114)
@@ -76,6 +103,20 @@ EXPECTED_BY_SRGB = 0.066
 COLORSPACE_TRIANGLE_AREA_TOL = 0.00028
 
 
+@functools.lru_cache(maxsize=None)
+def _get_default_gamma_lut():
+  """Returns the 1/2.2 gamma LUT, built on first use."""
+  x = numpy.arange(MAX_LUT_SIZE) / (MAX_LUT_SIZE-1)
+  return numpy.floor((MAX_LUT_SIZE-1) * numpy.power(x, 1/2.2) + 0.5).astype(int)
+
+
+def __getattr__(name):
+  """Builds DEFAULT_GAMMA_LUT when it is first used."""
+  if name == 'DEFAULT_GAMMA_LUT':
+    return _get_default_gamma_lut()
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 def plot_lsc_maps(lsc_maps, plot_name, test_name_with_log_path):
   """Plot the lens shading correction maps.
 
@@ -87,6 +128,10 @@ def plot_lsc_maps(lsc_maps, plot_name, test_name_with_log_path):
   Returns:
     None, but generates and saves plots.
   """
+  # matplotlib is slow to import and only used here.
+  from matplotlib import pylab  # pylint: disable=g-import-not-at-top
+  import matplotlib.pyplot  # pylint: disable=g-import-not-at-top
+
   aspect_ratio = lsc_maps[:, :, 0].shape[1] / lsc_maps[:, :, 0].shape[0]
   plot_w = 1 + aspect_ratio * _CMAP_SIZE  # add 1 for heatmap legend
   matplotlib.pyplot.figure(plot_name, figsize=(plot_w, _CMAP_SIZE))
@@ -168,43 +213,69 @@ def apply_lens_shading_map(color_plane, black_level, white_level, lsc_map):
   return color_plane
 
 
-def populate_lens_shading_map(img_shape, lsc_map):
-  """Helper function to create LSC coeifficients for RAW image.
+def _get_interpolation_weights(map_size, img_size):
+  """Returns (img_size, map_size) weights of a 1-D linear upsample.
+
+  Image pixel i maps to map location u = i * (map_size-1) / (img_size-1), and
+  its value is the mix of map[floor(u)] and map[floor(u)+1] by the fraction
+  of u, so both ends of the image land exactly on the ends of the map.
 
   Args:
-    img_shape: tuple; RAW image shape.
-    lsc_map: 2D low resolution array with lens shading map values.
+    map_size: int; number of map samples.
+    img_size: int; number of image pixels.
 
   Returns:
-    value for lens shading map at point (x, y) in the image.
+    float numpy array of weights, with at most 2 non-zeros per row.
   """
-  img_w, img_h = img_shape[1], img_shape[0]
-  map_w, map_h = lsc_map.shape[1], lsc_map.shape[0]
-
-  x, y = numpy.meshgrid(numpy.arange(img_w), numpy.arange(img_h))
-
-  # (u,v) is lsc map location, values [0, map_w-1], [0, map_h-1]
-  # Vectorized calculations
-  u = x * (map_w - 1) / (img_w - 1)
-  v = y * (map_h - 1) / (img_h - 1)
+  u = numpy.arange(img_size) * (map_size - 1) / (img_size - 1)
   u_min = numpy.floor(u).astype(int)
-  v_min = numpy.floor(v).astype(int)
   u_frac = u - u_min
-  v_frac = v - v_min
-  u_max = numpy.where(u_frac > 0, u_min + 1, u_min)
-  v_max = numpy.where(v_frac > 0, v_min + 1, v_min)
+  u_max = numpy.minimum(u_min + 1, map_size - 1)
+  rows = numpy.arange(img_size)
+  weights = numpy.zeros((img_size, map_size))
+  weights[rows, u_min] = 1 - u_frac
+  weights[rows, u_max] += u_frac
+  return weights
+
+
+@functools.lru_cache(maxsize=_LSC_WEIGHTS_CACHE_SIZE)
+def _get_lens_shading_map_weights(map_shape, img_shape):
+  """Returns cached (vertical, horizontal) LSC upsampling weights.
+
+  The LSC map and plane sizes are fixed for a camera and capture size, so the
+  weights are computed once and shared by every channel and capture.
+
+  Args:
+    map_shape: tuple; (height, width) of the LSC map.
+    img_shape: tuple; (height, width) of the color plane.
+
+  Returns:
+    Tuple of read-only weight arrays of shape (img_h, map_h), (map_w, img_w).
+  """
+  weights_v = _get_interpolation_weights(map_shape[0], img_shape[0])
+  weights_h = _get_interpolation_weights(map_shape[1], img_shape[1]).T.copy()
+  weights_v.flags.writeable = False
+  weights_h.flags.writeable = False
+  return weights_v, weights_h
+
 
-  # Gather LSC values, handling edge cases (optional)
-  lsc_tl = lsc_map[(v_min, u_min)]
-  lsc_tr = lsc_map[(v_min, u_max)]
-  lsc_bl = lsc_map[(v_max, u_min)]
-  lsc_br = lsc_map[(v_max, u_max)]
+def populate_lens_shading_map(img_shape, lsc_map):
+  """Helper function to create LSC coeifficients for RAW image.
+
+  Bilinear interpolation is separable, so the map is upsampled as
+  weights_v @ lsc_map @ weights_h, with weights cached per
+  (map shape, image shape) and no full size index arrays.
 
-  # Bilinear interpolation (vectorized)
-  lsc_t = lsc_tl * (1 - u_frac) + lsc_tr * u_frac
-  lsc_b = lsc_bl * (1 - u_frac) + lsc_br * u_frac
+  Args:
+    img_shape: tuple; RAW image shape.
+    lsc_map: 2D low resolution array with lens shading map values.
 
-  return lsc_t * (1 - v_frac) + lsc_b * v_frac
+  Returns:
+    value for lens shading map at point (x, y) in the image.
+  """
+  weights_v, weights_h = _get_lens_shading_map_weights(
+      tuple(lsc_map.shape[:2]), tuple(img_shape[:2]))
+  return numpy.dot(weights_v, lsc_map) @ weights_h
 
 
 def unpack_lsc_map_from_metadata(metadata):
@@ -216,6 +287,11 @@ def unpack_lsc_map_from_metadata(metadata):
   Returns:
     3D numpy array of lens shading maps.
   """
+  if isinstance(metadata, CaptureMetadata):
+    lsc_map = metadata.lens_shading_map()
+    logging.debug(
+        'lensShadingCorrectionMap (H, W): (%d, %d)', *lsc_map.shape[:2])
+    return lsc_map
   lsc_metadata = metadata['android.statistics.lensShadingCorrectionMap']
   lsc_map_w, lsc_map_h = lsc_metadata['width'], lsc_metadata['height']
   lsc_map = lsc_metadata['map']
@@ -288,28 +364,35 @@ def convert_raw_capture_to_rgb_image(cap_raw, props, raw_fmt,
 
 def convert_capture_to_rgb_image(cap,
                                  props=None,
-                                 apply_ccm_raw_to_rgb=True):
+                                 apply_ccm_raw_to_rgb=True,
+                                 use_float32=False):
   """Convert a captured image object to a RGB image.
 
+  Standard Bayer 'raw', 'raw10' and 'raw12' captures are converted in a single
+  tiled pass, which matches convert_capture_to_planes followed by
+  convert_raw_to_rgb_image within 1e-6 (float64) or 1e-5 (float32) per pixel.
+
   Args:
      cap: A capture object as returned by its_session_utils.do_capture.
      props: (Optional) camera properties object (of static values);
             required for processing raw images.
      apply_ccm_raw_to_rgb: (Optional) boolean to apply color correction matrix.
+     use_float32: (Optional) boolean to convert standard Bayer raw captures
+            with float32 math into a float32 image, halving its memory.
 
   Returns:
         RGB float-3 image array, with pixel values in [0.0, 1.0].
   """
   w = cap['width']
   h = cap['height']
-  if cap['format'] == 'raw10' or cap['format'] == 'raw10QuadBayer':
+  if cap['format'] in _FUSED_RAW_TO_RGB_FORMATS:
     assert_props_is_not_none(props)
-    is_quad_bayer = cap['format'] == 'raw10QuadBayer'
-    cap = unpack_raw10_capture(cap, is_quad_bayer)
+    return _convert_bayer_capture_to_rgb_image(
+        cap, props, apply_ccm_raw_to_rgb, use_float32)
 
-  if cap['format'] == 'raw12':
+  if cap['format'] == 'raw10QuadBayer':
     assert_props_is_not_none(props)
-    cap = unpack_raw12_capture(cap)
+    cap = unpack_raw10_capture(cap, is_quad_bayer=True)
 
   if cap['format'] == 'yuv':
     y = cap['data'][0: w * h]
@@ -331,35 +414,474 @@ def convert_capture_to_rgb_image(cap,
     raise error_util.CameraItsError(f"Invalid format {cap['format']}")
 
 
-def unpack_raw10_capture(cap, is_quad_bayer=False):
+def _convert_yuv420_planar_frames_to_rgb_images(frames, w, h, out):
+  """Convert stacked YUV420 8-bit planar frames to RGB images.
+
+  Chroma is upsampled by broadcasting instead of repeating, and each RGB
+  channel is summed in float32 in the order of the matrix product of
+  convert_yuv420_planar_to_rgb_image. Over all YUV values, the result only
+  differs for 0.02% of green values, by one 8-bit code value.
+
+  Args:
+    frames: numpy uint8 array of shape (n, w * h * 3 // 2); Y, U, V planes.
+    w: The width of the frames.
+    h: The height of the frames.
+    out: float32 numpy array of shape (n, h, w, 3) for the RGB images.
+  """
+  n = frames.shape[0]
+  # Pixels of a 2x2 block are on axes 1 and 2, so chroma broadcasts over them
+  planes = (frames[:, :w * h].reshape(n, h // 2, 2, w // 2, 2).transpose(
+                0, 2, 4, 1, 3),
+            frames[:, w * h:w * h * 5 // 4].reshape(n, 1, 1, h // 2, w // 2),
+            frames[:, w * h * 5 // 4:w * h * 3 // 2].reshape(
+                n, 1, 1, h // 2, w // 2))
+  yuv = [numpy.subtract(plane, offset, dtype=numpy.float32)
+         for plane, offset in zip(planes, DEFAULT_YUV_OFFSETS)]
+  ccm = numpy.asarray(DEFAULT_YUV_TO_RGB_CCM, dtype=numpy.float32)
+  out_blocks = out.reshape(n, h // 2, 2, w // 2, 2, 3).transpose(
+      0, 2, 4, 1, 3, 5)
+  chan = numpy.empty_like(yuv[0])
+  for c in range(3):
+    numpy.multiply(yuv[0], ccm[c, 0], out=chan)
+    chan += yuv[1] * ccm[c, 1]
+    chan += yuv[2] * ccm[c, 2]
+    numpy.clip(chan, 0, 255, out=chan)
+    # Truncate to 8 bits as convert_yuv420_planar_to_rgb_image does
+    out_blocks[..., c] = chan.astype(numpy.uint8)
+  numpy.divide(out, 255.0, out=out)
+
+
+def convert_captures_to_rgb_images(caps, props=None,
+                                   apply_ccm_raw_to_rgb=True,
+                                   use_float32=False):
+  """Convert a burst of captured image objects to a stack of RGB images.
+
+  YUV captures are converted several frames at a time with float32 math,
+  matching convert_capture_to_rgb_image within one 8-bit code value. Other
+  formats are converted one capture at a time into the stack.
+
+  Args:
+    caps: list of N capture objects of the same size, as returned by
+          its_session_utils.do_capture.
+    props: (Optional) camera properties object (of static values);
+           required for processing raw images.
+    apply_ccm_raw_to_rgb: (Optional) boolean to apply color correction matrix.
+    use_float32: (Optional) boolean to convert standard Bayer raw captures
+           with float32 math into a float32 image, halving its memory.
+
+  Returns:
+    numpy array of shape (N, h, w, 3), with pixel values in [0.0, 1.0].
+  """
+  if not caps:
+    raise error_util.CameraItsError('No captures to convert')
+  w = caps[0]['width']
+  h = caps[0]['height']
+  if any(cap['width'] != w or cap['height'] != h for cap in caps):
+    raise error_util.CameraItsError('Captures are not all the same size')
+
+  if all(cap['format'] == 'yuv' for cap in caps):
+    imgs = numpy.empty((len(caps), h, w, 3), dtype=numpy.float32)
+    batch_size = max(1, _YUV_BATCH_PIXELS // (w * h))
+    for i in range(0, len(caps), batch_size):
+      frames = numpy.stack(
+          [cap['data'][:w * h * 3 // 2] for cap in caps[i:i + batch_size]])
+      _convert_yuv420_planar_frames_to_rgb_images(
+          frames, w, h, imgs[i:i + len(frames)])
+    return imgs
+
+  img = convert_capture_to_rgb_image(
+      caps[0], props, apply_ccm_raw_to_rgb, use_float32)
+  imgs = numpy.empty((len(caps),) + img.shape, dtype=img.dtype)
+  imgs[0] = img
+  for i, cap in enumerate(caps[1:], 1):
+    imgs[i] = convert_capture_to_rgb_image(
+        cap, props, apply_ccm_raw_to_rgb, use_float32)
+  return imgs
+
+
+class Capture(dict):
+  """A capture object, as returned by its_session_utils.do_capture.
+
+  Behaves as the plain capture dict with 'width', 'height', 'format', 'data'
+  and 'metadata' keys, and decodes the image on first use of rgb(), planes(),
+  y() or unpacked_raw(). Decoded images are kept until release() is called or
+  they are asked for with other camera properties. They are read-only as they
+  are shared between callers; copy them before drawing on them. Burst tests
+  should release() each capture after use, so only one decoded copy is held at
+  a time.
+  """
+  __slots__ = ('_cache',)
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._cache = {}
+
+  def __copy__(self):
+    # Copies get their own cache, as their data may be replaced.
+    return Capture(self)
+
+  def __reduce__(self):
+    return Capture, (dict(self),)
+
+  def _get_cached(self, key, convert, props=None):
+    """Returns cached value of key, calling convert() on first use.
+
+    Values are decoded again if props differ from those of the cached value.
+    """
+    cached = self._cache.get(key)
+    if cached is None or (cached[0] is not props and cached[0] != props):
+      value = convert()
+      for img in value if isinstance(value, (list, tuple)) else [value]:
+        if isinstance(img, numpy.ndarray):
+          img.flags.writeable = False
+      cached = self._cache[key] = (props, value)
+    return cached[1]
+
+  def rgb(self, props=None, apply_ccm_raw_to_rgb=True):
+    """Returns the memoized convert_capture_to_rgb_image of this capture."""
+    return self._get_cached(
+        ('rgb', apply_ccm_raw_to_rgb),
+        lambda: convert_capture_to_rgb_image(self, props, apply_ccm_raw_to_rgb),
+        props)
+
+  def planes(self, props=None):
+    """Returns the memoized convert_capture_to_planes of this capture."""
+    return self._get_cached(
+        'planes', lambda: tuple(convert_capture_to_planes(self, props)), props)
+
+  def y(self, props=None):
+    """Returns the memoized Y channel as a (h, w, 1) array in [0.0, 1.0].
+
+    YUV captures return their Y plane, Y8 captures their data, and other
+    formats the grayscale of their RGB image.
+
+    Args:
+      props: (Optional) camera properties object; required for raw images.
+    """
+    def convert():
+      if self['format'] == 'yuv':
+        return self.planes(props)[0]
+      elif self['format'] == 'y8':
+        w, h = self['width'], self['height']
+        return (self['data'][0:w * h].astype(numpy.float32) / 255.0).reshape(
+            h, w, 1)
+      return convert_rgb_to_grayscale(self.rgb(props))[:, :, numpy.newaxis]
+    return self._get_cached('y', convert, props)
+
+  def unpacked_raw(self):
+    """Returns the memoized raw-16 capture of a raw10 or raw12 capture."""
+    def convert():
+      if self['format'] in ('raw10', 'raw10QuadBayer'):
+        return unpack_raw10_capture(
+            self, is_quad_bayer=self['format'] == 'raw10QuadBayer')
+      elif self['format'] == 'raw12':
+        return unpack_raw12_capture(self)
+      raise error_util.CameraItsError(f"Invalid format {self['format']}")
+    return self._get_cached('unpacked_raw', convert)
+
+  def release(self):
+    """Drops all decoded images of this capture."""
+    self._cache.clear()
+
+
+def find_json_container_end(raw, start):
+  """Returns the index after the JSON object or array starting at raw[start].
+
+  Only strings and brackets are scanned, so long arrays of numbers are
+  skipped by the regex engine.
+
+  Args:
+    raw: bytes of JSON text.
+    start: int; index of the opening '{' or '['.
+  """
+  depth = 0
+  for m in _JSON_TOKEN_RE.finditer(raw, start):
+    token = m.group()
+    if token in (b'{', b'['):
+      depth += 1
+    elif token in (b'}', b']'):
+      depth -= 1
+      if depth == 0:
+        return m.end()
+  raise error_util.CameraItsError('Unterminated JSON object')
+
+
+def _index_json_object(raw):
+  """Returns {key: (start, end)} of the values of the JSON object in raw."""
+  spans = {}
+  depth = 0
+  key = None
+  for m in _JSON_TOKEN_RE.finditer(raw):
+    token = m.group()
+    if depth == 1 and m.group(2) is not None:
+      if key is not None:
+        spans[key] = (value_start, m.start())
+      key = json.loads(m.group(1))
+      value_start = m.end()
+    elif token in (b'{', b'['):
+      depth += 1
+    elif token in (b'}', b']'):
+      depth -= 1
+      if depth == 0:
+        if key is not None:
+          spans[key] = (value_start, m.start())
+        break
+  return spans
+
+
+def _strip_json_value(value):
+  """Strips whitespace and the separating comma around a raw JSON value."""
+  return value.strip().rstrip(b',').rstrip()
+
+
+def _parse_json_number_array(value, dtype):
+  """Parses raw JSON of a flat array of numbers into a numpy array.
+
+  Returns:
+    numpy array, or None if value is not a flat array of numbers.
+  """
+  if not value.startswith(b'[') or not value.endswith(b']'):
+    return None
+  inner = value[1:-1]
+  if not inner.strip():
+    return numpy.empty(0, dtype=dtype)
+  if any(c in inner for c in (b'[', b'{', b'"')):
+    return None
+  return numpy.fromstring(inner.decode(), dtype=dtype, sep=',')
+
+
+class CaptureMetadata(dict):
+  """Capture result metadata kept as JSON bytes and decoded one key at a time.
+
+  Behaves as the capture result dict: indexing, 'in' and get() decode only
+  the keys used, and operations over all keys (iteration, items(), ==,
+  json.dumps) decode the rest first. Copies and pickles are plain dicts.
+  The C json encoder writes '{}' for a dict subclass without stored items
+  instead of calling items(), so one key is always kept decoded while any
+  are left undecoded.
+  array(), lens_shading_map() and tonemap_curve() parse numeric arrays
+  straight from the JSON bytes into numpy arrays.
+  """
+  __slots__ = ('_raw', '_spans', '_key_order')
+
+  def __init__(self, raw):
+    super().__init__()
+    self._raw = bytes(raw)
+    self._spans = _index_json_object(self._raw)
+    self._key_order = tuple(self._spans)
+    self._keep_decoded_key()
+
+  def _keep_decoded_key(self):
+    """Decodes the smallest undecoded key if no key is decoded."""
+    if not dict.__len__(self) and self._spans:
+      self.__missing__(min(self._spans,
+                           key=lambda k: self._spans[k][1] - self._spans[k][0]))
+
+  def _get_raw(self, key):
+    """Returns the raw JSON of an undecoded key, or None."""
+    span = self._spans.get(key)
+    if span is None:
+      return None
+    return _strip_json_value(self._raw[span[0]:span[1]])
+
+  def __missing__(self, key):
+    raw = self._get_raw(key)
+    if raw is None:
+      raise KeyError(key)
+    value = json.loads(raw)
+    dict.__setitem__(self, key, value)
+    del self._spans[key]
+    return value
+
+  def _decode_all(self):
+    """Decodes the remaining keys, keeping the order of the JSON object."""
+    if not self._spans:
+      return
+    values = dict(dict.items(self))
+    dict.clear(self)
+    for key in self._key_order:
+      if key in self._spans:
+        dict.__setitem__(self, key, json.loads(self._get_raw(key)))
+      elif key in values:
+        dict.__setitem__(self, key, values.pop(key))
+    for key, value in values.items():
+      dict.__setitem__(self, key, value)
+    self._spans.clear()
+
+  def __contains__(self, key):
+    return dict.__contains__(self, key) or key in self._spans
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
+
+  def __setitem__(self, key, value):
+    self._spans.pop(key, None)
+    dict.__setitem__(self, key, value)
+
+  def __delitem__(self, key):
+    if self._spans.pop(key, None) is None:
+      dict.__delitem__(self, key)
+      self._keep_decoded_key()
+
+  def setdefault(self, key, default=None):
+    if key not in self:
+      self[key] = default
+    return self[key]
+
+  def pop(self, key, *default):
+    if key in self:
+      value = self[key]
+      dict.__delitem__(self, key)
+      self._keep_decoded_key()
+      return value
+    return dict.pop(self, key, *default)
+
+  def update(self, *args, **kwargs):
+    for key, value in dict(*args, **kwargs).items():
+      self[key] = value
+
+  def __len__(self):
+    return dict.__len__(self) + len(self._spans)
+
+  def __iter__(self):
+    self._decode_all()
+    return dict.__iter__(self)
+
+  def keys(self):
+    self._decode_all()
+    return dict.keys(self)
+
+  def values(self):
+    self._decode_all()
+    return dict.values(self)
+
+  def items(self):
+    self._decode_all()
+    return dict.items(self)
+
+  def popitem(self):
+    self._decode_all()
+    return dict.popitem(self)
+
+  def clear(self):
+    self._spans.clear()
+    dict.clear(self)
+
+  def copy(self):
+    return dict(self.items())
+
+  def __eq__(self, other):
+    self._decode_all()
+    if isinstance(other, CaptureMetadata):
+      other._decode_all()  # pylint: disable=protected-access
+    return dict.__eq__(self, other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  __hash__ = None
+
+  def __repr__(self):
+    self._decode_all()
+    return dict.__repr__(self)
+
+  def __reduce__(self):
+    return dict, (self.copy(),)
+
+  def project(self, keys):
+    """Returns a CaptureMetadata of only keys, with its own compact bytes."""
+    values = []
+    for key in keys:
+      if key in self._spans:
+        values.append(json.dumps(key).encode() + b':' + self._get_raw(key))
+      elif dict.__contains__(self, key):
+        values.append(json.dumps({key: dict.__getitem__(self, key)})[1:-1]
+                      .encode())
+    return CaptureMetadata(b'{' + b','.join(values) + b'}')
+
+  def array(self, key, dtype=numpy.float64):
+    """Returns the flat array of numbers of key as a numpy array."""
+    raw = self._get_raw(key)
+    arr = None if raw is None else _parse_json_number_array(raw, dtype)
+    if arr is None:
+      arr = numpy.asarray(self[key], dtype=dtype)
+    return arr
+
+  def _object_arrays(self, key, dtype):
+    """Returns {field: value} of an object key, with arrays as numpy arrays."""
+    raw = self._get_raw(key)
+    if raw is None:
+      return {field: numpy.asarray(value, dtype=dtype)
+                     if isinstance(value, list) else value
+              for field, value in self[key].items()}
+    fields = {}
+    for field, (start, end) in _index_json_object(raw).items():
+      value = _strip_json_value(raw[start:end])
+      arr = _parse_json_number_array(value, dtype)
+      fields[field] = json.loads(value) if arr is None else arr
+    return fields
+
+  def lens_shading_map(self, dtype=numpy.float64):
+    """Returns the lens shading correction map as an (h, w, 4) array."""
+    lsc = self._object_arrays(
+        'android.statistics.lensShadingCorrectionMap', dtype)
+    return lsc['map'].reshape(lsc['height'], lsc['width'], _NUM_RAW_CHANNELS)
+
+  def tonemap_curve(self, dtype=numpy.float64):
+    """Returns {'red', 'green', 'blue'} tonemap curves as (n, 2) arrays."""
+    curves = self._object_arrays('android.tonemap.curve', dtype)
+    return {color: curve.reshape(-1, 2) for color, curve in curves.items()}
+
+
+def unpack_raw10_capture(cap, is_quad_bayer=False, out=None):
   """Unpack a raw-10 capture to a raw-16 capture.
 
   Args:
     cap: A raw-10 capture object.
     is_quad_bayer: Boolean flag for Bayer or Quad Bayer capture.
+    out: (Optional) uint16 numpy array of shape (h, w) to unpack into.
 
   Returns:
-    New capture object with raw-16 data.
+    New capture object with raw-16 data. Other fields, including metadata,
+    are shared with cap.
   """
   # Data is packed as 4x10b pixels in 5 bytes, with the first 4 bytes holding
   # the MSBs of the pixels, and the 5th byte holding 4x2b LSBs.
   w, h = cap['width'], cap['height']
   if w % 4 != 0:
     raise error_util.CameraItsError('Invalid raw-10 buffer width')
-  cap = copy.deepcopy(cap)
-  cap['data'] = unpack_raw10_image(cap['data'].reshape(h, w * 5 // 4))
+  cap = copy.copy(cap)
+  cap['data'] = unpack_raw10_image(cap['data'].reshape(h, w * 5 // 4), out)
   cap['format'] = 'rawQuadBayer' if is_quad_bayer else 'raw'
   return cap
 
 
-def unpack_raw10_image(img):
+def _get_unpack_output(out, h, w):
+  """Returns out, or a new array, checked to be a (h, w) uint16 array."""
+  if out is None:
+    return numpy.empty((h, w), dtype=numpy.uint16)
+  if out.shape != (h, w) or out.dtype != numpy.uint16:
+    raise error_util.CameraItsError(
+        f'Invalid output buffer {out.shape} {out.dtype}, expected '
+        f'({h}, {w}) uint16')
+  if not out.flags.c_contiguous:
+    raise error_util.CameraItsError('Output buffer must be contiguous')
+  return out
+
+
+def unpack_raw10_image(img, out=None):
   """Unpack a raw-10 image to a raw-16 image.
 
   Output image will have the 10 LSBs filled in each 16b word, and the 6 MSBs
   will be set to zero.
 
+  The packed bytes are read through strided views, and the output is computed
+  with shift/mask operations in bands of _UNPACK_TILE_ROWS rows, so the only
+  temporary is one band of LSB bytes.
+
   Args:
     img: A raw-10 image, as a uint8 numpy array.
+    out: (Optional) uint16 numpy array of shape (h, w) to unpack into.
 
   Returns:
     Image as a uint16 numpy array, with all row padding stripped.
@@ -368,44 +890,50 @@ def unpack_raw10_image(img):
     raise error_util.CameraItsError('Invalid raw-10 buffer width')
   w = img.shape[1] * 4 // 5
   h = img.shape[0]
-  # Cut out the 4x8b MSBs and shift to bits [9:2] in 16b words.
-  msbs = numpy.delete(img, numpy.s_[4::5], 1)
-  msbs = msbs.astype(numpy.uint16)
-  msbs = numpy.left_shift(msbs, 2)
-  msbs = msbs.reshape(h, w)
-  # Cut out the 4x2b LSBs and put each in bits [1:0] of their own 8b words.
-  lsbs = img[::, 4::5].reshape(h, w // 4)
-  lsbs = numpy.right_shift(
-      numpy.packbits(numpy.unpackbits(lsbs).reshape((h, w // 4, 4, 2)), 3), 6)
-  # Pair the LSB bits group to 0th pixel instead of 3rd pixel
-  lsbs = lsbs.reshape(h, w // 4, 4)[:, :, ::-1]
-  lsbs = lsbs.reshape(h, w)
-  # Fuse the MSBs and LSBs back together
-  img16 = numpy.bitwise_or(msbs, lsbs).reshape(h, w)
-  return img16
-
-
-def unpack_raw12_capture(cap):
+  out = _get_unpack_output(out, h, w)
+  # Group each row into 5 byte blocks: 4 MSB bytes, then 1 byte of 4x2b LSBs
+  # with pixel 0 in bits [1:0] and pixel 3 in bits [7:6].
+  packed = img.reshape(h, w // 4, 5)
+  unpacked = out.reshape(h, w // 4, 4)
+  lsbs = numpy.empty((min(h, _UNPACK_TILE_ROWS), w // 4), dtype=numpy.uint8)
+  for row in range(0, h, _UNPACK_TILE_ROWS):
+    rows = slice(row, min(row + _UNPACK_TILE_ROWS, h))
+    packed_band = packed[rows]
+    unpacked_band = unpacked[rows]
+    lsbs_band = lsbs[:packed_band.shape[0]]
+    for i in range(4):
+      numpy.left_shift(packed_band[:, :, i], 2, out=unpacked_band[:, :, i],
+                       dtype=numpy.uint16)
+      numpy.right_shift(packed_band[:, :, 4], 2 * i, out=lsbs_band)
+      numpy.bitwise_and(lsbs_band, 0x3, out=lsbs_band)
+      numpy.bitwise_or(unpacked_band[:, :, i], lsbs_band,
+                       out=unpacked_band[:, :, i])
+  return out
+
+
+def unpack_raw12_capture(cap, out=None):
   """Unpack a raw-12 capture to a raw-16 capture.
 
   Args:
     cap: A raw-12 capture object.
+    out: (Optional) uint16 numpy array of shape (h, w) to unpack into.
 
   Returns:
-     New capture object with raw-16 data.
+     New capture object with raw-16 data. Other fields, including metadata,
+     are shared with cap.
   """
-  # Data is packed as 4x10b pixels in 5 bytes, with the first 4 bytes holding
-  # the MSBs of the pixels, and the 5th byte holding 4x2b LSBs.
+  # Data is packed as 2x12b pixels in 3 bytes, with the first 2 bytes holding
+  # the MSBs of the pixels, and the 3rd byte holding 2x4b LSBs.
   w, h = cap['width'], cap['height']
   if w % 2 != 0:
     raise error_util.CameraItsError('Invalid raw-12 buffer width')
-  cap = copy.deepcopy(cap)
-  cap['data'] = unpack_raw12_image(cap['data'].reshape(h, w * 3 // 2))
+  cap = copy.copy(cap)
+  cap['data'] = unpack_raw12_image(cap['data'].reshape(h, w * 3 // 2), out)
   cap['format'] = 'raw'
   return cap
 
 
-def unpack_raw12_image(img):
+def unpack_raw12_image(img, out=None):
   """Unpack a raw-12 image to a raw-16 image.
 
   Output image will have the 12 LSBs filled in each 16b word, and the 4 MSBs
@@ -413,6 +941,7 @@ def unpack_raw12_image(img):
 
   Args:
    img: A raw-12 image, as a uint8 numpy array.
+   out: (Optional) uint16 numpy array of shape (h, w) to unpack into.
 
   Returns:
     Image as a uint16 numpy array, with all row padding stripped.
@@ -421,21 +950,25 @@ def unpack_raw12_image(img):
     raise error_util.CameraItsError('Invalid raw-12 buffer width')
   w = img.shape[1] * 2 // 3
   h = img.shape[0]
-  # Cut out the 2x8b MSBs and shift to bits [11:4] in 16b words.
-  msbs = numpy.delete(img, numpy.s_[2::3], 1)
-  msbs = msbs.astype(numpy.uint16)
-  msbs = numpy.left_shift(msbs, 4)
-  msbs = msbs.reshape(h, w)
-  # Cut out the 2x4b LSBs and put each in bits [3:0] of their own 8b words.
-  lsbs = img[::, 2::3].reshape(h, w // 2)
-  lsbs = numpy.right_shift(
-      numpy.packbits(numpy.unpackbits(lsbs).reshape((h, w // 2, 2, 4)), 3), 4)
-  # Pair the LSB bits group to pixel 0 instead of pixel 1
-  lsbs = lsbs.reshape(h, w // 2, 2)[:, :, ::-1]
-  lsbs = lsbs.reshape(h, w)
-  # Fuse the MSBs and LSBs back together
-  img16 = numpy.bitwise_or(msbs, lsbs).reshape(h, w)
-  return img16
+  out = _get_unpack_output(out, h, w)
+  # Group each row into 3 byte blocks: 2 MSB bytes, then 1 byte of 2x4b LSBs
+  # with pixel 0 in bits [3:0] and pixel 1 in bits [7:4].
+  packed = img.reshape(h, w // 2, 3)
+  unpacked = out.reshape(h, w // 2, 2)
+  lsbs = numpy.empty((min(h, _UNPACK_TILE_ROWS), w // 2), dtype=numpy.uint8)
+  for row in range(0, h, _UNPACK_TILE_ROWS):
+    rows = slice(row, min(row + _UNPACK_TILE_ROWS, h))
+    packed_band = packed[rows]
+    unpacked_band = unpacked[rows]
+    lsbs_band = lsbs[:packed_band.shape[0]]
+    for i in range(2):
+      numpy.left_shift(packed_band[:, :, i], 4, out=unpacked_band[:, :, i],
+                       dtype=numpy.uint16)
+      numpy.right_shift(packed_band[:, :, 2], 4 * i, out=lsbs_band)
+      numpy.bitwise_and(lsbs_band, 0xF, out=lsbs_band)
+      numpy.bitwise_or(unpacked_band[:, :, i], lsbs_band,
+                       out=unpacked_band[:, :, i])
+  return out
 
 
 def convert_yuv420_planar_to_rgb_image(y_plane, u_plane, v_plane,
@@ -589,6 +1122,60 @@ def subsample(image, num_channels=4):
   return channel_img
 
 
+def _get_raw_active_array_crop(props, w, h, is_quad_bayer=False):
+  """Returns the region of a w x h raw image to crop to the active array.
+
+  Args:
+    props: Camera properties object.
+    w: int; width of the raw image.
+    h: int; height of the raw image.
+    is_quad_bayer: Boolean flag for Bayer or Quad Bayer capture.
+
+  Returns:
+    Tuple of (x, y, w, h) of the active array region in the raw image, or
+    (0, 0, w, h) if the image is already cropped or the sizes are unknown.
+  """
+  if is_quad_bayer:
+    pixel_array_size = props.get(
+        'android.sensor.info.pixelArraySizeMaximumResolution'
+    )
+    active_array_size = props.get(
+        'android.sensor.info.preCorrectionActiveArraySizeMaximumResolution'
+    )
+  else:
+    pixel_array_size = props.get('android.sensor.info.pixelArraySize')
+    active_array_size = props.get(
+        'android.sensor.info.preCorrectionActiveArraySize'
+    )
+  if pixel_array_size and active_array_size:
+    # Note that the Rect class is defined such that the left,top values
+    # are "inside" while the right,bottom values are "outside"; that is,
+    # it's inclusive of the top,left sides only. So, the width is
+    # computed as right-left, rather than right-left+1, etc.
+    wfull = pixel_array_size['width']
+    hfull = pixel_array_size['height']
+    xcrop = active_array_size['left']
+    ycrop = active_array_size['top']
+    wcrop = active_array_size['right'] - xcrop
+    hcrop = active_array_size['bottom'] - ycrop
+    if not wfull >= wcrop >= 0:
+      raise AssertionError(f'wcrop: {wcrop} not in wfull: {wfull}')
+    if not hfull >= hcrop >= 0:
+      raise AssertionError(f'hcrop: {hcrop} not in hfull: {hfull}')
+    if not wfull - wcrop >= xcrop >= 0:
+      raise AssertionError(f'xcrop: {xcrop} not in wfull-crop: {wfull-wcrop}')
+    if not hfull - hcrop >= ycrop >= 0:
+      raise AssertionError(f'ycrop: {ycrop} not in hfull-crop: {hfull-hcrop}')
+    if w == wfull and h == hfull:
+      # Crop needed; extract the center region.
+      return xcrop, ycrop, wcrop, hcrop
+    elif w == wcrop and h == hcrop:
+      logging.debug('Image is already cropped. No cropping needed.')
+    else:
+      raise error_util.CameraItsError('Invalid image size metadata')
+  return 0, 0, w, h
+
+
 def convert_capture_to_planes(cap, props=None):
   """Convert a captured image object to separate image planes.
 
@@ -648,47 +1235,9 @@ def convert_capture_to_planes(cap, props=None):
     img = numpy.ndarray(
         shape=(h * w,), dtype='<u2', buffer=cap['data'][0:w * h * 2])
     img = img.astype(numpy.float32).reshape(h, w) / white_level
-    if is_quad_bayer:
-      pixel_array_size = props.get(
-          'android.sensor.info.pixelArraySizeMaximumResolution'
-      )
-      active_array_size = props.get(
-          'android.sensor.info.preCorrectionActiveArraySizeMaximumResolution'
-      )
-    else:
-      pixel_array_size = props.get('android.sensor.info.pixelArraySize')
-      active_array_size = props.get(
-          'android.sensor.info.preCorrectionActiveArraySize'
-      )
     # Crop the raw image to the active array region.
-    if pixel_array_size and active_array_size:
-      # Note that the Rect class is defined such that the left,top values
-      # are "inside" while the right,bottom values are "outside"; that is,
-      # it's inclusive of the top,left sides only. So, the width is
-      # computed as right-left, rather than right-left+1, etc.
-      wfull = pixel_array_size['width']
-      hfull = pixel_array_size['height']
-      xcrop = active_array_size['left']
-      ycrop = active_array_size['top']
-      wcrop = active_array_size['right'] - xcrop
-      hcrop = active_array_size['bottom'] - ycrop
-      if not wfull >= wcrop >= 0:
-        raise AssertionError(f'wcrop: {wcrop} not in wfull: {wfull}')
-      if not hfull >= hcrop >= 0:
-        raise AssertionError(f'hcrop: {hcrop} not in hfull: {hfull}')
-      if not wfull - wcrop >= xcrop >= 0:
-        raise AssertionError(f'xcrop: {xcrop} not in wfull-crop: {wfull-wcrop}')
-      if not hfull - hcrop >= ycrop >= 0:
-        raise AssertionError(f'ycrop: {ycrop} not in hfull-crop: {hfull-hcrop}')
-      if w == wfull and h == hfull:
-        # Crop needed; extract the center region.
-        img = img[ycrop:ycrop + hcrop, xcrop:xcrop + wcrop]
-        w = wcrop
-        h = hcrop
-      elif w == wcrop and h == hcrop:
-        logging.debug('Image is already cropped. No cropping needed.')
-      else:
-        raise error_util.CameraItsError('Invalid image size metadata')
+    xcrop, ycrop, w, h = _get_raw_active_array_crop(props, w, h, is_quad_bayer)
+    img = img[ycrop:ycrop + h, xcrop:xcrop + w]
 
     idxs = get_canonical_cfa_order(props, is_quad_bayer)
     if is_quad_bayer:
@@ -830,6 +1379,90 @@ def convert_raw_to_rgb_image(r_plane, gr_plane, gb_plane, b_plane, props,
   return img
 
 
+def _convert_bayer_capture_to_rgb_image(cap, props, apply_ccm_raw_to_rgb=True,
+                                        use_float32=False):
+  """Converts a standard Bayer raw capture to RGB in a single tiled pass.
+
+  Computes the same image as convert_capture_to_planes followed by
+  convert_raw_to_rgb_image, but goes from the uint16 or packed RAW10/RAW12
+  data to the RGB output one band of _RAW_TO_RGB_TILE_ROWS rows at a time.
+  Normalization, black level, scale and gains are folded into one multiply
+  and subtract per channel, so only the output image and one band of
+  temporaries are allocated.
+
+  Args:
+    cap: A 'raw', 'raw10' or 'raw12' capture object.
+    props: Camera properties object.
+    apply_ccm_raw_to_rgb: (Optional) boolean to apply color correction matrix.
+    use_float32: (Optional) boolean to compute and return float32 instead of
+      float64 values.
+
+  Returns:
+    RGB float-3 image array, with pixel values in [0.0, 1.0].
+  """
+  w = cap['width']
+  h = cap['height']
+  if cap['format'] == 'raw10':
+    if w % 4 != 0:
+      raise error_util.CameraItsError('Invalid raw-10 buffer width')
+    packed = cap['data'].reshape(h, w * 5 // 4)
+    unpack = unpack_raw10_image
+  elif cap['format'] == 'raw12':
+    if w % 2 != 0:
+      raise error_util.CameraItsError('Invalid raw-12 buffer width')
+    packed = cap['data'].reshape(h, w * 3 // 2)
+    unpack = unpack_raw12_image
+  else:
+    packed = numpy.ndarray(
+        shape=(h, w), dtype='<u2', buffer=cap['data'][0:w * h * 2])
+    unpack = None
+  xcrop, ycrop, wcrop, hcrop = _get_raw_active_array_crop(props, w, h)
+
+  # Fold ((x / white_level - black_level / white_level) * scale) * gain into
+  # x * a - b per R, G, B channel, as in convert_raw_to_rgb_image.
+  cap_res = cap['metadata']
+  white_level = get_white_level(props, cap_res)
+  black_levels = get_black_levels(props, cap_res, is_quad_bayer=False)
+  gains = get_gains_in_canonical_order(
+      props, cap_res['android.colorCorrection.gains'])
+  scale = white_level / (white_level - max(black_levels))
+  dtype = numpy.float32 if use_float32 else numpy.float64
+  a = [scale * gains[i] / white_level for i in [0, 1, 3]]
+  b = [black_levels[i] / white_level * scale * gains[i] for i in [0, 1, 3]]
+  a[1] /= 2  # G is the mean of Gr and Gb
+  ccm = numpy.array(capture_request_utils.rational_to_float(
+      cap_res['android.colorCorrection.transform'])).reshape(3, 3)
+  ccm_t = ccm.T.astype(dtype)
+
+  # Plane offsets in the cropped image, in R, Gr, Gb, B order.
+  offsets = [(i // 2, i % 2) for i in get_canonical_cfa_order(props)]
+  h2, w2 = hcrop // 2, wcrop // 2
+  img = numpy.empty((h2, w2, 3), dtype=dtype)
+  tile = numpy.empty((_RAW_TO_RGB_TILE_ROWS, w2, 3), dtype=dtype)
+  if unpack:
+    unpacked = numpy.empty((2 * _RAW_TO_RGB_TILE_ROWS, w), dtype=numpy.uint16)
+  for row in range(0, h2, _RAW_TO_RGB_TILE_ROWS):
+    n = min(_RAW_TO_RGB_TILE_ROWS, h2 - row)
+    bayer = packed[ycrop + 2 * row:ycrop + 2 * (row + n)]
+    if unpack:
+      bayer = unpack(bayer, unpacked[:2 * n])
+    bayer = bayer[:, xcrop:xcrop + 2 * w2]
+    r, gr, gb, b_plane = [bayer[y::2, x::2] for y, x in offsets]
+    band = tile[:n] if apply_ccm_raw_to_rgb else img[row:row + n]
+    numpy.multiply(r, a[0], out=band[:, :, 0], dtype=dtype)
+    numpy.add(gr, gb, out=band[:, :, 1], dtype=dtype)
+    band[:, :, 1] *= a[1]
+    numpy.multiply(b_plane, a[2], out=band[:, :, 2], dtype=dtype)
+    for i in range(3):
+      band[:, :, i] -= b[i]
+    numpy.clip(band, 0.0, 1.0, out=band)
+    if apply_ccm_raw_to_rgb:
+      out = img[row:row + n]
+      numpy.dot(band.reshape(n * w2, 3), ccm_t, out=out.reshape(n * w2, 3))
+      numpy.clip(out, 0.0, 1.0, out=out)
+  return img
+
+
 def convert_y8_to_rgb_image(y_plane, w, h):
   """Convert a Y 8-bit image to an RGB image.
 
@@ -881,7 +1514,7 @@ def write_image(img, fname, apply_gamma=False, is_yuv=False):
    is_yuv: Whether the image is in YUV format.
   """
   if apply_gamma:
-    img = apply_lut_to_image(img, DEFAULT_GAMMA_LUT)
+    img = apply_lut_to_image(img, _get_default_gamma_lut())
   (h, w, chans) = img.shape
   if chans == 3:
     if not is_yuv:
@@ -895,6 +1528,62 @@ def write_image(img, fname, apply_gamma=False, is_yuv=False):
     raise error_util.CameraItsError('Unsupported image type')
 
 
+class BackgroundImageWriter(object):
+  """Writes images with write_image on a pool of background threads.
+
+  PIL releases the GIL while encoding, so compressing debug images overlaps
+  with the analysis that follows. Images must not be modified after they are
+  queued. Leaving a with block waits for all queued images.
+
+  Attributes:
+    enabled: bool; if False, images are not written.
+  """
+
+  def __init__(self, num_workers=_IMAGE_WRITER_NUM_WORKERS, enabled=True):
+    self.enabled = enabled
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+        num_workers, thread_name_prefix='image_writer')
+    self._futures = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def write_image(self, img, fname, apply_gamma=False, is_yuv=False):
+    """Queues write_image(img, fname, apply_gamma, is_yuv)."""
+    if self.enabled:
+      self._futures.append(self._executor.submit(
+          write_image, img, fname, apply_gamma, is_yuv))
+
+  def write_rgb_uint8_image(self, img, file_name):
+    """Queues write_rgb_uint8_image(img, file_name)."""
+    if self.enabled:
+      self._futures.append(self._executor.submit(
+          write_rgb_uint8_image, img, file_name))
+
+  def flush(self):
+    """Waits for queued images, raising the first error writing them."""
+    futures, self._futures = self._futures, []
+    for future in futures:
+      future.result()
+
+  def cancel(self):
+    """Drops queued images and waits for those already being written."""
+    futures, self._futures = self._futures, []
+    for future in futures:
+      future.cancel()
+    concurrent.futures.wait(futures)
+
+  def close(self):
+    """Flushes queued images and stops the worker threads."""
+    try:
+      self.flush()
+    finally:
+      self._executor.shutdown()
+
+
 def read_image(fname):
   """Read image function to match write_image() above."""
   return Image.open(fname)
@@ -1338,16 +2027,173 @@ def get_img(buffer):
   return Image.open(io.BytesIO(buffer))
 
 
+JpegSegment = collections.namedtuple(
+    'JpegSegment', ['marker', 'offset', 'payload'])
+JpegSegment.__doc__ = """A JPEG marker segment.
+
+marker is the marker code, e.g. JPEG_DQT_MARKER. offset is the position of
+its 0xFF byte. payload is a memoryview of the data after the length bytes,
+so no bytes are copied. The entropy coded data after a SOS segment is not
+part of its payload.
+"""
+
+
+def _find_jpeg_scan_end(data, start):
+  """Returns the offset of the first marker after entropy coded data."""
+  is_prefix = numpy.flatnonzero(data[start:-1] == _JPEG_MARKER_PREFIX) + start
+  code = data[is_prefix + 1]
+  # 0xFF00 is a stuffed 0xFF byte, and RSTn markers are part of the scan.
+  is_marker = ((code != 0) & (code != _JPEG_MARKER_PREFIX) &
+               ((code < 0xD0) | (code > 0xD7)))
+  markers = is_prefix[is_marker]
+  if not markers.size:
+    raise error_util.CameraItsError('JPEG scan has no end marker')
+  return int(markers[0])
+
+
+def index_jpeg_segments(jpeg, start=0):
+  """Lists the marker segments of a JPEG image without decoding it.
+
+  Segment lengths are followed from marker to marker, and only the entropy
+  coded data of each scan is searched for its end.
+
+  Args:
+    jpeg: bytes-like JPEG data, e.g. the data field of a JPEG capture.
+    start: offset of the SOI marker. Used for images stored after the first
+      one, like the gain map of an UltraHDR JPEG.
+
+  Returns:
+    List of JpegSegment, from SOI to EOI.
+  """
+  data = numpy.frombuffer(jpeg, dtype=numpy.uint8)
+  view = memoryview(data)
+  size = len(data)
+  if (size < start + 2 or data[start] != _JPEG_MARKER_PREFIX or
+      data[start + 1] != JPEG_SOI_MARKER):
+    raise error_util.CameraItsError(f'No JPEG Start Of Image at {start}')
+  segments = [JpegSegment(JPEG_SOI_MARKER, start, view[start+2:start+2])]
+  pos = start + 2
+  while True:
+    if pos + 2 > size:
+      raise error_util.CameraItsError('JPEG has no End Of Image marker')
+    if data[pos] != _JPEG_MARKER_PREFIX:
+      raise error_util.CameraItsError(f'No JPEG marker at {pos}')
+    marker = int(data[pos + 1])
+    if marker == _JPEG_MARKER_PREFIX:  # fill byte
+      pos += 1
+      continue
+    if marker == JPEG_EOI_MARKER or marker in _JPEG_STANDALONE_MARKERS:
+      segments.append(JpegSegment(marker, pos, view[pos+2:pos+2]))
+      if marker == JPEG_EOI_MARKER:
+        return segments
+      pos += 2
+      continue
+    if pos + 4 > size:
+      raise error_util.CameraItsError(f'JPEG segment at {pos} is truncated')
+    end = pos + 2 + (int(data[pos + 2]) << 8 | int(data[pos + 3]))
+    if end < pos + 4 or end > size:
+      raise error_util.CameraItsError(f'JPEG segment at {pos} is truncated')
+    segments.append(JpegSegment(marker, pos, view[pos+4:end]))
+    pos = _find_jpeg_scan_end(data, end) if marker == JPEG_SOS_MARKER else end
+
+
+def index_jpeg_images(jpeg):
+  """Lists the segments of each JPEG image stored one after the other.
+
+  UltraHDR JPEGs store the gain map as a second JPEG after the primary one.
+
+  Args:
+    jpeg: bytes-like JPEG data.
+
+  Returns:
+    List of index_jpeg_segments() lists, one per image.
+  """
+  data = numpy.frombuffer(jpeg, dtype=numpy.uint8)
+  images = [index_jpeg_segments(data)]
+  pos = images[-1][-1].offset + 2
+  while (pos + 1 < len(data) and data[pos] == _JPEG_MARKER_PREFIX and
+         data[pos + 1] == JPEG_SOI_MARKER):
+    images.append(index_jpeg_segments(data, pos))
+    pos = images[-1][-1].offset + 2
+  return images
+
+
+def parse_jpeg_dqt(payload):
+  """Parses the quantization tables of a DQT segment.
+
+  Args:
+    payload: payload of a JPEG_DQT_MARKER JpegSegment.
+
+  Returns:
+    List of (table id, numpy array of the 64 values in zigzag order). Luma
+    is usually table 0 and chroma table 1.
+  """
+  data = numpy.frombuffer(payload, dtype=numpy.uint8)
+  tables = []
+  pos = 0
+  while pos < len(data):
+    precision, table_id = divmod(int(data[pos]), 16)
+    dtype = numpy.dtype('>u2') if precision else numpy.dtype(numpy.uint8)
+    end = pos + 1 + _JPEG_DQT_NUM_VALUES * dtype.itemsize
+    if end > len(data):
+      raise error_util.CameraItsError('JPEG DQT segment is truncated')
+    tables.append((table_id, data[pos+1:end].view(dtype).astype(numpy.uint16)))
+    pos = end
+  return tables
+
+
+def get_jpeg_icc_profile(jpeg):
+  """Returns the ICC profile bytes of JPEG data, or None if it has none.
+
+  Args:
+    jpeg: bytes-like JPEG data, or the segments from index_jpeg_segments().
+  """
+  segments = jpeg if isinstance(jpeg, list) else index_jpeg_segments(jpeg)
+  chunks = {}
+  for segment in segments:
+    if (segment.marker == JPEG_APP2_MARKER and
+        segment.payload[:len(_JPEG_ICC_PROFILE_ID)] == _JPEG_ICC_PROFILE_ID):
+      chunks[segment.payload[len(_JPEG_ICC_PROFILE_ID)]] = (
+          segment.payload[_JPEG_ICC_CHUNK_HEADER_SIZE:])
+  if not chunks:
+    return None
+  return b''.join(chunks[seq] for seq in sorted(chunks))
+
+
+def jpeg_has_gain_map(jpeg):
+  """Checks if JPEG data is UltraHDR, with a gain map image after the primary.
+
+  Args:
+    jpeg: bytes-like JPEG data.
+
+  Returns:
+    True if a JPEG image with gain map XMP metadata follows the primary.
+  """
+  for segments in index_jpeg_images(jpeg)[1:]:
+    for segment in segments:
+      if (segment.marker == JPEG_APP1_MARKER and
+          _JPEG_XMP_GAIN_MAP_NAMESPACE in segment.payload.tobytes()):
+        return True
+  return False
+
+
+def _get_icc_profile(jpeg_img):
+  """Returns the icc profile of a PIL.Image or of JPEG data."""
+  if isinstance(jpeg_img, Image.Image):
+    return jpeg_img.info.get('icc_profile')
+  return get_jpeg_icc_profile(jpeg_img)
+
+
 def jpeg_has_icc_profile(jpeg_img):
   """Checks if a jpeg PIL.Image has an icc profile attached.
 
   Args:
-    jpeg_img: The PIL.Image.
+    jpeg_img: The PIL.Image, or bytes-like JPEG data.
 
   Returns:
     True if an icc profile is present, False otherwise.
   """
-  return jpeg_img.info.get('icc_profile') is not None
+  return _get_icc_profile(jpeg_img) is not None
 
 
 def get_primary_chromaticity(primary):
@@ -1367,7 +2213,7 @@ def is_jpeg_icc_profile_correct(jpeg_img, color_space, icc_profile_path=None):
   """Compare a jpeg's icc profile to a color space's expected parameters.
 
   Args:
-    jpeg_img: The PIL.Image.
+    jpeg_img: The PIL.Image, or bytes-like JPEG data.
     color_space: 'DISPLAY_P3' or 'SRGB'
     icc_profile_path: Optional path to an icc file to be created with the
         raw contents.
@@ -1375,7 +2221,7 @@ def is_jpeg_icc_profile_correct(jpeg_img, color_space, icc_profile_path=None):
   Returns:
     True if the icc profile matches expectations, False otherwise.
   """
-  icc = jpeg_img.info.get('icc_profile')
+  icc = _get_icc_profile(jpeg_img)
   f = io.BytesIO(icc)
   icc_profile = ImageCms.getOpenProfile(f)
 
@@ -1479,46 +2325,85 @@ def distance(p, q):
   return math.sqrt(sum((px - qx) ** 2.0 for px, qx in zip(p, q)))
 
 
-def p3_img_has_wide_gamut(wide_img):
-  """Check if a DISPLAY_P3 image contains wide gamut pixels.
+def _p3_rgb_outside_srgb(rgb):
+  """Checks which DISPLAY_P3 colors are outside the SRGB gamut.
 
-  Given a DISPLAY_P3 image that should have a wider gamut than SRGB, checks all
-  pixel values to see if any reside outside the SRGB gamut. This is done by
-  converting to CIE xy chromaticities using a Bradford chromatic adaptation for
-  consistency with ICC profiles.
+  Colors are converted to CIE xy chromaticities using a Bradford chromatic
+  adaptation for consistency with ICC profiles. A chromaticity is inside the
+  SRGB triangle when the areas of the 3 triangles it forms with the primaries,
+  its unnormalized barycentric coordinates, sum to the area of the triangle.
 
   Args:
-    wide_img: The PIL.Image in the DISPLAY_P3 color space.
+    rgb: numpy array of [..., 3] DISPLAY_P3 colors in [0, 255].
 
   Returns:
-    True if the gamut of wide_img is greater than that of SRGB.
-    False otherwise.
+    Boolean numpy array of rgb.shape[:-1], True where outside SRGB.
   """
-  w = wide_img.size[0]
-  h = wide_img.size[1]
-  wide_arr = numpy.array(wide_img)
-
   img_arr = colour.RGB_to_XYZ(
-      wide_arr / 255.0,
+      rgb / 255.0,
       colour.models.rgb.datasets.display_p3.RGB_COLOURSPACE_DISPLAY_P3.whitepoint,
       colour.models.rgb.datasets.display_p3.RGB_COLOURSPACE_DISPLAY_P3.whitepoint,
       colour.models.rgb.datasets.display_p3.RGB_COLOURSPACE_DISPLAY_P3.matrix_RGB_to_XYZ,
       'Bradford', lambda x: colour.eotf(x, 'sRGB'))
-
   xy_arr = colour.XYZ_to_xy(img_arr)
+  xp, yp = xy_arr[..., 0], xy_arr[..., 1]
 
   srgb_colorspace = colour.models.RGB_COLOURSPACE_sRGB
-  srgb_primaries = srgb_colorspace.primaries
-
-  for y in range(h):
-    for x in range(w):
-      # Check if the pixel chromaticity is inside or outside the SRGB gamut.
-      # This check is not guaranteed not to emit false positives / negatives,
-      # however the probability of either on an arbitrary DISPLAY_P3 camera
-      # capture is exceedingly unlikely.
-      if not point_in_triangle(*srgb_primaries.reshape(6),
-                               xy_arr[y][x][0], xy_arr[y][x][1],
-                               COLORSPACE_TRIANGLE_AREA_TOL):
-        return True
+  x1, y1, x2, y2, x3, y3 = srgb_colorspace.primaries.reshape(6)
+  # This check is not guaranteed not to emit false positives / negatives,
+  # however the probability of either on an arbitrary DISPLAY_P3 camera
+  # capture is exceedingly unlikely.
+  a = area_of_triangle(x1, y1, x2, y2, x3, y3)
+  a_sum = (area_of_triangle(xp, yp, x2, y2, x3, y3) +
+           area_of_triangle(x1, y1, xp, yp, x3, y3) +
+           area_of_triangle(x1, y1, x2, y2, xp, yp))
+  return numpy.abs(a_sum - a) > COLORSPACE_TRIANGLE_AREA_TOL
 
-  return False
+
+def p3_img_wide_gamut_mask(wide_img):
+  """Finds the pixels of a DISPLAY_P3 image outside the SRGB gamut.
+
+  8-bit RGB images are checked once per distinct color, with the result
+  scattered back to the pixels through a lookup table.
+
+  Args:
+    wide_img: The PIL.Image or numpy array in the DISPLAY_P3 color space.
+
+  Returns:
+    Boolean numpy array of the image height x width, True for wide gamut
+    pixels. Its mean() is the fraction of wide gamut pixels.
+  """
+  wide_arr = numpy.asarray(wide_img)
+  if (wide_arr.dtype != numpy.uint8 or wide_arr.ndim != 3 or
+      wide_arr.shape[2] != 3):
+    return _p3_rgb_outside_srgb(wide_arr)
+
+  packed = wide_arr[..., 0].astype(numpy.uint32) << 16
+  packed |= wide_arr[..., 1].astype(numpy.uint32) << 8
+  packed |= wide_arr[..., 2]
+  is_present = numpy.zeros(_NUM_RGB888_COLORS, dtype=bool)
+  is_present[packed] = True
+  colors = numpy.flatnonzero(is_present)
+  rgb = numpy.stack((colors >> 16, (colors >> 8) & 0xFF, colors & 0xFF),
+                    axis=-1)
+  is_outside = numpy.zeros(_NUM_RGB888_COLORS, dtype=bool)
+  is_outside[colors] = _p3_rgb_outside_srgb(rgb)
+  return is_outside[packed]
+
+
+def p3_img_has_wide_gamut(wide_img):
+  """Check if a DISPLAY_P3 image contains wide gamut pixels.
+
+  Given a DISPLAY_P3 image that should have a wider gamut than SRGB, checks all
+  pixel values to see if any reside outside the SRGB gamut. This is done by
+  converting to CIE xy chromaticities using a Bradford chromatic adaptation for
+  consistency with ICC profiles.
+
+  Args:
+    wide_img: The PIL.Image in the DISPLAY_P3 color space.
+
+  Returns:
+    True if the gamut of wide_img is greater than that of SRGB.
+    False otherwise.
+  """
+  return bool(p3_img_wide_gamut_mask(wide_img).any())
@@ -14,15 +14,21 @@
 """Tests for image_processing_utils."""
 
 
+import copy
+import io
+import json
 import math
 import os
 import random
+import tempfile
 import unittest
+from unittest import mock
 
 import cv2
 import numpy
 from PIL import Image
 
+import error_util
 import image_processing_utils
 
 
@@ -70,6 +76,194 @@ class ImageProcessingUtilsTest(unittest.TestCase):
         image_processing_utils.unpack_raw10_image(img_raw10),
         img_check))
 
+  def test_unpack_raw10_image_into_out_buffer(self):
+    """Unit test for unpack_raw10_image with a caller-supplied output buffer.
+
+    Uses a quad Bayer sized image spanning several unpack bands.
+    """
+    img_w, img_h = 16, 136
+    img_check = numpy.random.default_rng(0).integers(
+        0, 1024, (img_h, img_w // 4, 4), dtype=numpy.uint16)
+    lsbs = sum((img_check[:, :, i] & 0x3) << (2 * i) for i in range(4))
+    img_raw10 = numpy.dstack(
+        [img_check >> 2, lsbs]).astype(numpy.uint8).reshape(img_h, -1)
+    out = numpy.zeros((img_h, img_w), dtype=numpy.uint16)
+    img = image_processing_utils.unpack_raw10_image(img_raw10, out)
+    self.assertIs(img, out)
+    self.assertTrue(numpy.array_equal(img, img_check.reshape(img_h, img_w)))
+
+  def test_unpack_raw12_image(self):
+    """Unit test for unpack_raw12_image.
+
+    RAW12 bit packing format
+            bit 7   bit 6   bit 5   bit 4   bit 3   bit 2   bit 1   bit 0
+    Byte 0: P0[11]  P0[10]  P0[9]   P0[8]   P0[7]   P0[6]   P0[5]   P0[4]
+    Byte 1: P1[11]  P1[10]  P1[9]   P1[8]   P1[7]   P1[6]   P1[5]   P1[4]
+    Byte 2: P1[3]   P1[2]   P1[1]   P1[0]   P0[3]   P0[2]   P0[1]   P0[0]
+    """
+    img_w, img_h = 8, 4
+    img_check = numpy.random.default_rng(0).integers(
+        0, 4096, (img_h, img_w // 2, 2), dtype=numpy.uint16)
+    lsbs = (img_check[:, :, 0] & 0xF) | ((img_check[:, :, 1] & 0xF) << 4)
+    img_raw12 = numpy.dstack(
+        [img_check >> 4, lsbs]).astype(numpy.uint8).reshape(img_h, -1)
+    self.assertTrue(numpy.array_equal(
+        image_processing_utils.unpack_raw12_image(img_raw12),
+        img_check.reshape(img_h, img_w)))
+
+  def _make_raw_capture(self, fmt, w, h, rng):
+    """Returns a random raw capture of format fmt, and its raw-16 data."""
+    raw16 = rng.integers(0, 1024, (h, w), dtype=numpy.uint16)
+    if fmt == 'raw10':
+      pixels = raw16.reshape(h, w // 4, 4)
+      lsbs = sum((pixels[:, :, i] & 0x3) << (2 * i) for i in range(4))
+      data = numpy.dstack([pixels >> 2, lsbs]).astype(numpy.uint8)
+    else:
+      data = raw16.view(numpy.uint8)
+    metadata = {
+        'android.colorCorrection.gains': [2.0, 1.0, 1.1, 1.6],
+        'android.colorCorrection.transform': [
+            {'numerator': n, 'denominator': 128}
+            for n in (180, -40, -12, -30, 170, -12, -4, -60, 192)],
+        'android.sensor.dynamicBlackLevel': [64, 63, 65, 64],
+        'android.sensor.dynamicWhiteLevel': 1023,
+    }
+    cap = {'format': fmt, 'width': w, 'height': h,
+           'data': data.reshape(-1), 'metadata': metadata}
+    raw16_cap = dict(
+        cap, format='raw', data=raw16.view(numpy.uint8).reshape(-1))
+    return cap, raw16_cap
+
+  def test_convert_raw_capture_to_rgb_image_matches_planes(self):
+    """Unit test for the tiled Bayer to RGB conversion.
+
+    Compares against convert_capture_to_planes and convert_raw_to_rgb_image
+    for a cropped image spanning several tiles.
+    """
+    w, h = 40, 2 * image_processing_utils._RAW_TO_RGB_TILE_ROWS + 20
+    props = {
+        'android.sensor.info.colorFilterArrangement': 2,
+        'android.sensor.info.whiteLevel': 1023,
+        'android.sensor.blackLevelPattern': [64, 64, 64, 64],
+        'android.sensor.info.pixelArraySize': {'width': w, 'height': h},
+        'android.sensor.info.preCorrectionActiveArraySize': {
+            'left': 4, 'top': 2, 'right': w - 4, 'bottom': h - 6},
+    }
+    rng = numpy.random.default_rng(0)
+    for fmt in ('raw', 'raw10'):
+      cap, raw16_cap = self._make_raw_capture(fmt, w, h, rng)
+      r, gr, gb, b = image_processing_utils.convert_capture_to_planes(
+          raw16_cap, props)
+      for apply_ccm in (True, False):
+        expected = image_processing_utils.convert_raw_to_rgb_image(
+            r, gr, gb, b, props, cap['metadata'], apply_ccm)
+        img = image_processing_utils.convert_capture_to_rgb_image(
+            cap, props, apply_ccm)
+        self.assertEqual(img.dtype, numpy.float64)
+        self.assertEqual(img.shape, expected.shape)
+        numpy.testing.assert_allclose(img, expected, rtol=0, atol=1e-6)
+        img = image_processing_utils.convert_capture_to_rgb_image(
+            cap, props, apply_ccm, use_float32=True)
+        self.assertEqual(img.dtype, numpy.float32)
+        numpy.testing.assert_allclose(img, expected, rtol=0, atol=1e-5)
+
+  def test_populate_lens_shading_map(self):
+    """Unit test for populate_lens_shading_map against per-pixel bilinear."""
+    lsc_map = numpy.random.default_rng(0).uniform(1, 4, (5, 7))
+    img_h, img_w = 13, 30
+    lsc_map_fs = image_processing_utils.populate_lens_shading_map(
+        (img_h, img_w, 1), lsc_map)
+    self.assertEqual(lsc_map_fs.shape, (img_h, img_w))
+    for y in range(img_h):
+      for x in range(img_w):
+        v = y * (lsc_map.shape[0] - 1) / (img_h - 1)
+        u = x * (lsc_map.shape[1] - 1) / (img_w - 1)
+        v0 = min(int(v), lsc_map.shape[0] - 2)
+        u0 = min(int(u), lsc_map.shape[1] - 2)
+        top = lsc_map[v0, u0] * (u0 + 1 - u) + lsc_map[v0, u0 + 1] * (u - u0)
+        bottom = (lsc_map[v0 + 1, u0] * (u0 + 1 - u) +
+                  lsc_map[v0 + 1, u0 + 1] * (u - u0))
+        self.assertAlmostEqual(
+            lsc_map_fs[y, x], top * (v0 + 1 - v) + bottom * (v - v0))
+
+    # Weights are reused for other channels of the same shape
+    cache_info = image_processing_utils._get_lens_shading_map_weights.cache_info
+    hits = cache_info().hits
+    image_processing_utils.populate_lens_shading_map((img_h, img_w), lsc_map)
+    self.assertEqual(cache_info().hits, hits + 1)
+
+  def test_capture_memoizes_decoded_images(self):
+    """Unit test for Capture decoding once and releasing its cache."""
+    w, h = 8, 4
+    y = numpy.arange(w * h, dtype=numpy.uint8)
+    data = numpy.concatenate([y, numpy.full(w * h // 2, 128, numpy.uint8)])
+    cap = image_processing_utils.Capture(
+        width=w, height=h, format='yuv', data=data, metadata={})
+    self.assertEqual(cap, {'width': w, 'height': h, 'format': 'yuv',
+                           'data': data, 'metadata': {}})
+    rgb = cap.rgb()
+    self.assertIs(cap.rgb(), rgb)
+    self.assertFalse(rgb.flags.writeable)
+    numpy.testing.assert_allclose(
+        rgb, image_processing_utils.convert_capture_to_rgb_image(cap))
+    self.assertIs(cap.y(), cap.planes()[0])
+    numpy.testing.assert_allclose(cap.y()[:, :, 0], y.reshape(h, w) / 255)
+
+    cap_copy = copy.copy(cap)
+    self.assertIsInstance(cap_copy, image_processing_utils.Capture)
+    self.assertIsNot(cap_copy.rgb(), rgb)
+    cap.release()
+    self.assertIsNot(cap.rgb(), rgb)
+
+  def test_capture_decodes_again_for_other_props(self):
+    """Unit test for Capture keying decoded images by camera properties."""
+    cap = image_processing_utils.Capture(
+        width=2, height=2, format='yuv', data=numpy.zeros(6, numpy.uint8),
+        metadata={})
+    props = {'android.sensor.info.colorFilterArrangement': 0}
+    with mock.patch.object(image_processing_utils,
+                           'convert_capture_to_rgb_image') as convert:
+      cap.rgb(props)
+      cap.rgb(dict(props))
+      self.assertEqual(convert.call_count, 1)
+      cap.rgb({'android.sensor.info.colorFilterArrangement': 1})
+      self.assertEqual(convert.call_count, 2)
+      convert.assert_called_with(
+          cap, {'android.sensor.info.colorFilterArrangement': 1}, True)
+
+  def test_convert_captures_to_rgb_images(self):
+    """Unit test for batched conversion matching per capture conversion."""
+    w, h, num_caps = 8, 4, 5
+    rng = numpy.random.default_rng(0)
+    for fmt, size in (('yuv', w * h * 3 // 2), ('y8', w * h)):
+      caps = [{'width': w, 'height': h, 'format': fmt,
+               'data': rng.integers(0, 256, size, dtype=numpy.uint8)}
+              for _ in range(num_caps)]
+      # Batches of 2 frames, leaving a last partial batch
+      with mock.patch.object(
+          image_processing_utils, '_YUV_BATCH_PIXELS', 2 * w * h):
+        imgs = image_processing_utils.convert_captures_to_rgb_images(caps)
+      self.assertEqual(imgs.shape, (num_caps, h, w, 3))
+      for img, cap in zip(imgs, caps):
+        numpy.testing.assert_allclose(
+            img, image_processing_utils.convert_capture_to_rgb_image(cap),
+            atol=1.001 / 255)
+
+  def test_background_image_writer(self):
+    """Unit test for writing, flushing and skipping background writes."""
+    img = numpy.full((4, 8, 3), 0.5)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      with image_processing_utils.BackgroundImageWriter() as image_writer:
+        for i in range(3):
+          image_writer.write_image(img, os.path.join(tmp_dir, f'{i}.png'))
+        image_writer.flush()
+        self.assertCountEqual(os.listdir(tmp_dir), ['0.png', '1.png', '2.png'])
+        image_writer.enabled = False
+        image_writer.write_image(img, os.path.join(tmp_dir, 'skipped.png'))
+      self.assertNotIn('skipped.png', os.listdir(tmp_dir))
+      numpy.testing.assert_array_equal(
+          numpy.array(Image.open(os.path.join(tmp_dir, '0.png'))), 127)
+
   def test_compute_image_sharpness(self):
     """Unit test for compute_img_sharpness.
 
@@ -137,6 +331,111 @@ class ImageProcessingUtilsTest(unittest.TestCase):
     self.assertTrue(image_processing_utils.p3_img_has_wide_gamut(
         Image.fromarray(p3_green)))
 
+  def test_p3_img_wide_gamut_mask(self):
+    # sRGB red converted to Display P3 next to max Display P3 green
+    img = numpy.array([[[234, 51, 35], [0, 255, 0]],
+                       [[234, 51, 35], [234, 51, 35]]], dtype='uint8')
+    mask = image_processing_utils.p3_img_wide_gamut_mask(img)
+    numpy.testing.assert_array_equal(mask, [[False, True], [False, False]])
+    numpy.testing.assert_array_equal(
+        image_processing_utils.p3_img_wide_gamut_mask(img.astype(float)),
+        mask)
+    self.assertEqual(mask.mean(), 0.25)
+
+  def test_default_gamma_lut(self):
+    lut = image_processing_utils.DEFAULT_GAMMA_LUT
+    self.assertIs(lut, image_processing_utils.DEFAULT_GAMMA_LUT)
+    self.assertEqual(len(lut), image_processing_utils.MAX_LUT_SIZE)
+    max_value = image_processing_utils.MAX_LUT_SIZE - 1
+    for i in (0, 1, 100, 4096, max_value):
+      self.assertEqual(
+          lut[i],
+          math.floor(max_value * math.pow(i / max_value, 1 / 2.2) + 0.5))
+
+  def test_index_jpeg_segments(self):
+    """Unit test for JPEG segment index, DQT and ICC profile parsing."""
+    icc_profile = bytes(range(256)) * 300  # split over 2 APP2 segments
+    jpeg_file = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 100, 50)).save(
+        jpeg_file, 'JPEG', quality=50, icc_profile=icc_profile)
+    jpeg = numpy.frombuffer(jpeg_file.getvalue(), dtype=numpy.uint8)
+
+    segments = image_processing_utils.index_jpeg_segments(jpeg)
+    markers = [segment.marker for segment in segments]
+    self.assertEqual(markers[0], image_processing_utils.JPEG_SOI_MARKER)
+    self.assertEqual(markers[-1], image_processing_utils.JPEG_EOI_MARKER)
+    self.assertEqual(segments[-1].offset, len(jpeg) - 2)
+    self.assertIn(image_processing_utils.JPEG_SOS_MARKER, markers)
+
+    tables = {}
+    for segment in segments:
+      if segment.marker == image_processing_utils.JPEG_DQT_MARKER:
+        tables.update(image_processing_utils.parse_jpeg_dqt(segment.payload))
+    quantization = Image.open(jpeg_file).quantization
+    self.assertEqual(tables.keys(), quantization.keys())
+    for table_id, table in tables.items():
+      self.assertEqual(sorted(table), sorted(quantization[table_id]))
+
+    self.assertEqual(image_processing_utils.get_jpeg_icc_profile(jpeg),
+                     icc_profile)
+    self.assertTrue(image_processing_utils.jpeg_has_icc_profile(jpeg))
+    self.assertFalse(image_processing_utils.jpeg_has_gain_map(jpeg))
+
+    xmp = b'http://ns.adobe.com/xap/1.0/\0<x hdrgm:Version="1.0"/>'
+    gain_map = (jpeg[:2].tobytes() + b'\xff\xe1' +
+                (len(xmp) + 2).to_bytes(2, 'big') + xmp + jpeg[2:].tobytes())
+    ultrahdr = jpeg.tobytes() + gain_map
+    self.assertEqual(len(image_processing_utils.index_jpeg_images(ultrahdr)), 2)
+    self.assertTrue(image_processing_utils.jpeg_has_gain_map(ultrahdr))
+
+    with self.assertRaises(error_util.CameraItsError):
+      image_processing_utils.index_jpeg_segments(jpeg[:len(jpeg) // 2])
+
+  def test_capture_metadata(self):
+    """Unit test for lazily decoded capture metadata."""
+    raw = (b'{"android.sensor.timestamp": 12, '
+           b'"android.tonemap.curve": {"red": [0, 0, 1, 1], '
+           b'"green": [0, 0, 1, 1], "blue": [0, 0.5, 1, 1]}, '
+           b'"android.statistics.lensShadingCorrectionMap": '
+           b'{"width": 2, "height": 1, "map": [1, 2, 3, 4, 5, 6, 7, 8]}, '
+           b'"android.colorCorrection.gains": [1.5, 1, 1, 2]}')
+    md = image_processing_utils.CaptureMetadata(raw)
+    self.assertEqual(md['android.sensor.timestamp'], 12)
+    self.assertNotIn('android.sensor.exposureTime', md)
+    self.assertEqual(md, json.loads(raw))
+    self.assertEqual(list(md), list(json.loads(raw)))
+
+    numpy.testing.assert_array_equal(
+        md.array('android.colorCorrection.gains'), [1.5, 1, 1, 2])
+    lsc = md.lens_shading_map()
+    self.assertEqual(lsc.shape, (1, 2, 4))
+    self.assertEqual(lsc[0, 1, 0], 5)
+    curves = md.tonemap_curve()
+    numpy.testing.assert_array_equal(curves['blue'], [[0, 0.5], [1, 1]])
+
+    projected = md.project(['android.sensor.timestamp', 'missing.key'])
+    self.assertEqual(projected, {'android.sensor.timestamp': 12})
+    md['android.sensor.timestamp'] = 13
+    del md['android.tonemap.curve']
+    self.assertEqual(copy.deepcopy(md)['android.sensor.timestamp'], 13)
+    self.assertNotIn('android.tonemap.curve', dict(md))
+
+  def test_capture_metadata_json_dumps(self):
+    """Unit test for json.dumps of undecoded capture metadata."""
+    raw = (b'{"android.sensor.timestamp": 12, '
+           b'"android.colorCorrection.gains": [1.5, 1, 1, 2], '
+           b'"android.sensor.exposureTime": 5}')
+    expected = json.dumps(json.loads(raw))
+    md = image_processing_utils.CaptureMetadata(raw)
+    self.assertEqual(json.dumps(md), expected)
+    md = image_processing_utils.CaptureMetadata(raw)
+    self.assertEqual(json.dumps({'m': md}), f'{{"m": {expected}}}')
+    md = image_processing_utils.CaptureMetadata(raw)
+    md.pop('android.sensor.timestamp')
+    del md['android.sensor.exposureTime']
+    self.assertEqual(json.dumps(md),
+                     '{"android.colorCorrection.gains": [1.5, 1, 1, 2]}')
+
   def test_compute_slanted_edge_image_sharpness(self):
     """Unit test for computing slanted edge img sharpness.
 
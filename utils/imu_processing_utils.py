@@ -14,6 +14,116 @@
 """Utility functions for IMU data processing."""
 
 
+import numpy as np
+
+SENSOR_EVENT_DTYPE = np.dtype([('time', np.int64), ('x', np.float32),
+                               ('y', np.float32), ('z', np.float32)])
+_SENSOR_EVENT_FIELDS = SENSOR_EVENT_DTYPE.names
+# Events from the JSON transport keep their float64 values.
+_JSON_SENSOR_EVENT_DTYPE = np.dtype([('time', np.int64), ('x', np.float64),
+                                     ('y', np.float64), ('z', np.float64)])
+_SENSOR_EVENT_TIME_DTYPE = np.dtype('<i8')
+_SENSOR_EVENT_XYZ_DTYPE = np.dtype('<f4')
+
+
+class SensorTrace(object):
+  """Trace of sensor events stored as a numpy structured array.
+
+  Each element has 'time' (int64 ns) and 'x', 'y', 'z' fields, which are
+  float32 for packed binary events and float64 for events from JSON.
+  Indexing by a field name returns that column as an array. Integer indexing
+  and iteration return event dicts, and slicing returns a SensorTrace, so a
+  trace can be used in place of the list of event dicts from the JSON
+  transport.
+
+  Attributes:
+    data: numpy structured array with 'time', 'x', 'y' and 'z' fields.
+  """
+
+  def __init__(self, data):
+    if (not isinstance(data, np.ndarray) or
+        data.dtype.names != _SENSOR_EVENT_FIELDS):
+      data = np.asarray(data, dtype=SENSOR_EVENT_DTYPE)
+    self.data = data
+
+  @classmethod
+  def from_events(cls, events):
+    """Builds a SensorTrace from a list of event dicts.
+
+    Missing 'x', 'y' or 'z' values, as in gyro events holding only 'time' and
+    'z', are NaN.
+    """
+    data = np.empty(len(events), dtype=_JSON_SENSOR_EVENT_DTYPE)
+    data['time'] = [e['time'] for e in events]
+    for field in _SENSOR_EVENT_FIELDS[1:]:
+      data[field] = [e.get(field, np.nan) for e in events]
+    return cls(data)
+
+  @classmethod
+  def from_buffer(cls, buf, count, offset=0):
+    """Builds a SensorTrace from a packed binary buffer.
+
+    The buffer holds count little-endian int64 timestamps followed by count
+    little-endian float32 x,y,z triplets.
+
+    Args:
+      buf: bytes-like object or numpy uint8 array.
+      count: number of events.
+      offset: byte offset of the events in buf.
+
+    Returns:
+      SensorTrace.
+    """
+    times = np.frombuffer(buf, dtype=_SENSOR_EVENT_TIME_DTYPE, count=count,
+                          offset=offset)
+    offset += count * _SENSOR_EVENT_TIME_DTYPE.itemsize
+    xyz = np.frombuffer(buf, dtype=_SENSOR_EVENT_XYZ_DTYPE, count=3*count,
+                        offset=offset).reshape(count, 3)
+    data = np.empty(count, dtype=SENSOR_EVENT_DTYPE)
+    data['time'] = times
+    data['x'] = xyz[:, 0]
+    data['y'] = xyz[:, 1]
+    data['z'] = xyz[:, 2]
+    return cls(data)
+
+  @staticmethod
+  def packed_size(count):
+    """Returns the number of bytes of count events in a packed buffer."""
+    return count * (_SENSOR_EVENT_TIME_DTYPE.itemsize +
+                    3 * _SENSOR_EVENT_XYZ_DTYPE.itemsize)
+
+  def __len__(self):
+    return len(self.data)
+
+  def __getitem__(self, key):
+    if isinstance(key, str):
+      return self.data[key]
+    if isinstance(key, slice):
+      return SensorTrace(self.data[key])
+    return dict(zip(_SENSOR_EVENT_FIELDS, self.data[key].item()))
+
+  def __iter__(self):
+    return iter(self.to_list())
+
+  def to_list(self):
+    """Returns the events as a list of 'time', 'x', 'y', 'z' dicts."""
+    return [dict(zip(_SENSOR_EVENT_FIELDS, e)) for e in self.data.tolist()]
+
+
+def get_sensor_trace(events):
+  """Returns events as a SensorTrace.
+
+  Args:
+    events: SensorTrace, or list of dicts with 'time', 'x', 'y', 'z' keys.
+
+  Returns:
+    SensorTrace.
+  """
+  if isinstance(events, SensorTrace):
+    return events
+  return SensorTrace.from_events(events)
+
+
 def calc_rv_drift(data):
   """Calculate data drift accounting for +/-180 degrees for stationary DUT.
 
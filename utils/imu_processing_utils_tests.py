@@ -45,6 +45,28 @@ class ImuProcessingUtilsTest(unittest.TestCase):
     self.assertTrue(np.allclose(imu_processing_utils.calc_rv_drift(d), d_drift),
                     'd_drift is incorrect')
 
+  def test_sensor_trace_compat_accessors(self):
+    """Unit test for SensorTrace list-of-dicts compatibility."""
+    events = [{'time': 10, 'x': 0.5, 'y': 1.0, 'z': -2.0},
+              {'time': 25, 'x': 0.0, 'y': 0.25, 'z': 4.0},
+              {'time': 40, 'x': -1.5, 'y': 0.0, 'z': 0.125}]
+    trace = imu_processing_utils.get_sensor_trace(events)
+    self.assertIs(imu_processing_utils.get_sensor_trace(trace), trace)
+    self.assertEqual(len(trace), 3)
+    self.assertEqual(trace.to_list(), events)
+    self.assertEqual(list(trace), events)
+    self.assertEqual(trace[-1], events[-1])
+    self.assertEqual(trace[1:].to_list(), events[1:])
+    np.testing.assert_array_equal(trace['time'], [10, 25, 40])
+    self.assertEqual(trace['z'].dtype, np.float64)
+
+  def test_sensor_trace_missing_fields(self):
+    """Unit test for SensorTrace of events holding only time and z."""
+    trace = imu_processing_utils.get_sensor_trace(
+        [{'time': 10, 'z': 0.1}, {'time': 20, 'z': 0.2}])
+    np.testing.assert_array_equal(trace['z'], [0.1, 0.2])
+    self.assertTrue(np.isnan(trace['x']).all())
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -18,13 +18,17 @@
 import collections
 import fnmatch
 import glob
+import hashlib
 import json
 import logging
 import math
 import os
+import re
+import shlex
 import socket
 import subprocess
 import sys
+import tempfile
 import time
 import types
 import unicodedata
@@ -36,10 +40,15 @@ import camera_properties_utils
 import capture_request_utils
 import error_util
 import image_processing_utils
+import imu_processing_utils
 import its_device_utils
-import opencv_processing_utils
+import lazy_import_utils
 import ui_interaction_utils
 
+# cv2 and scipy are slow to import and only used for chart scaling.
+opencv_processing_utils = lazy_import_utils.lazy_import(
+    'opencv_processing_utils')
+
 ANDROID13_API_LEVEL = 33
 ANDROID14_API_LEVEL = 34
 ANDROID15_API_LEVEL = 35
@@ -126,10 +135,25 @@ _STR_VALUE_STR = 'strValue'
 _TAG_STR = 'tag'
 _CAMERA_ID_STR = 'cameraId'
 _EXTRA_TIMEOUT_FACTOR = 10
-_COPY_SCENE_DELAY_SEC = 1
 _DST_SCENE_DIR = '/sdcard/Download/'
+_SCENE_FILE_EXTENSIONS = ('.png', '.mp4')
 _BIT_HLG10 = 0x01  # bit 1 for feature mask
 _BIT_STABILIZATION = 0x02  # bit 2 for feature mask
+_SOCKET_RECV_CHUNK_SIZE = 256 * 1024  # bytes per recv() when reading headers
+_CAPTURE_RESULT_RE = re.compile(rb'"captureResult"\s*:\s*\{')
+# Set by session_broker_utils to '<device_id>:<port>' of a running broker.
+SESSION_BROKER_ENV = 'ITS_SESSION_BROKER'
+# Camera properties are cached per device build in CAMERA_PROPS_CACHE_DIR.
+# Set CAMERA_PROPS_CACHE_ENV to 'false' to always read them from the device.
+CAMERA_PROPS_CACHE_DIR = os.path.join(
+    tempfile.gettempdir(), 'its_camera_properties')
+CAMERA_PROPS_CACHE_ENV = 'ITS_CAMERA_PROPS_CACHE'
+_camera_props_cache = {}  # cache file name: JSON string of camera properties
+_build_fingerprints = {}  # device_id: ro.build.fingerprint
+_its_service_versions = {}  # device_id: versionCode and lastUpdateTime
+_ITS_SERVICE_PACKAGE = 'com.android.cts.verifier'
+_scene_file_hashes = {}  # path: (mtime_ns, size, sha256 hex digest)
+_tablet_scene_manifests = {}  # tablet_id: {file name: sha256 hex digest}
 
 
 def validate_tablet(tablet_name, brightness, device_id):
@@ -180,6 +204,166 @@ def check_apk_installed(device_id, package_name):
     )
 
 
+class SocketReadStats(object):
+  """Byte and timing counters for responses read from the ItsService socket.
+
+  Attributes:
+    num_messages: number of responses (JSON header + optional buffer) read.
+    header_bytes: total bytes of newline-terminated JSON headers.
+    payload_bytes: total bytes of binary buffers following the headers.
+    parse_time_sec: total time spent parsing JSON headers.
+    read_time_sec: total time spent reading and parsing responses.
+  """
+
+  def __init__(self):
+    self.num_messages = 0
+    self.header_bytes = 0
+    self.payload_bytes = 0
+    self.parse_time_sec = 0.0
+    self.read_time_sec = 0.0
+
+  def copy(self):
+    """Returns a copy of these stats."""
+    stats = SocketReadStats()
+    stats.__dict__.update(self.__dict__)
+    return stats
+
+  def __sub__(self, other):
+    stats = SocketReadStats()
+    for k, v in self.__dict__.items():
+      setattr(stats, k, v - getattr(other, k))
+    return stats
+
+  def __repr__(self):
+    return (f'{self.num_messages} msgs, header: {self.header_bytes} bytes, '
+            f'payload: {self.payload_bytes} bytes, '
+            f'parse: {self.parse_time_sec*1000:.1f}ms, '
+            f'read: {self.read_time_sec*1000:.1f}ms')
+
+
+def _loads_response(line):
+  """Deserializes a response line, with any captureResult left undecoded.
+
+  The captureResult object is returned as an
+  image_processing_utils.CaptureMetadata holding its JSON bytes, so only the
+  metadata keys used are decoded.
+
+  Args:
+    line: bytes of the JSON response.
+
+  Returns:
+    Deserialized json obj.
+  """
+  match = _CAPTURE_RESULT_RE.search(line)
+  if not match:
+    return json.loads(line)
+  start = match.end() - 1
+  end = image_processing_utils.find_json_container_end(line, start)
+  jobj = json.loads(line[:start] + b'null' + line[end:])
+  obj = jobj.get(_OBJ_VALUE_STR)
+  if not isinstance(obj, dict) or obj.get('captureResult', 0) is not None:
+    return json.loads(line)
+  obj['captureResult'] = image_processing_utils.CaptureMetadata(
+      line[start:end])
+  return jobj
+
+
+def _project_metadata(metadata, keys):
+  """Returns metadata with only keys, as a CaptureMetadata if it was one."""
+  if isinstance(metadata, image_processing_utils.CaptureMetadata):
+    return metadata.project(keys)
+  return {key: metadata[key] for key in keys if key in metadata}
+
+
+class BufferedSocketReader(object):
+  """Reads ItsService responses from a socket through a receive buffer.
+
+  Each response is a newline-terminated JSON header, optionally followed by
+  a binary buffer of 'bufValueSize' bytes. Headers are read in large chunks
+  and scanned for the newline; any bytes received past the newline are kept
+  for the following payload or header. Payloads are read directly into their
+  destination buffer.
+
+  Attributes:
+    stats: SocketReadStats accumulated over all responses read.
+    last_stats: SocketReadStats of the most recent response.
+  """
+
+  def __init__(self, sock, chunk_size=_SOCKET_RECV_CHUNK_SIZE):
+    self._sock = sock
+    self._chunk = bytearray(chunk_size)
+    self._chunk_view = memoryview(self._chunk)
+    self._buf = bytearray()
+    self.stats = SocketReadStats()
+    self.last_stats = SocketReadStats()
+
+  def _recv_chunk(self):
+    """Receives up to one chunk from the socket into the receive buffer."""
+    nbytes = self._sock.recv_into(self._chunk_view)
+    if not nbytes:
+      # Socket was probably closed; otherwise don't get empty strings
+      raise error_util.CameraItsError('Problem with socket on device side')
+    self._buf += self._chunk_view[:nbytes]
+
+  def read_line(self):
+    """Returns the next newline-terminated line, including the newline."""
+    scan_start = 0
+    while True:
+      end = self._buf.find(b'\n', scan_start)
+      if end >= 0:
+        break
+      scan_start = len(self._buf)
+      self._recv_chunk()
+    line = bytes(self._buf[:end+1])
+    del self._buf[:end+1]
+    return line
+
+  def read_exact(self, n):
+    """Returns a bytearray of exactly n bytes read from the socket."""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    nbuffered = min(n, len(self._buf))
+    view[:nbuffered] = self._buf[:nbuffered]
+    del self._buf[:nbuffered]
+    view = view[nbuffered:]
+    n -= nbuffered
+    while n > 0:
+      nbytes = self._sock.recv_into(view, n)
+      if not nbytes:
+        raise error_util.CameraItsError('Problem with socket on device side')
+      view = view[nbytes:]
+      n -= nbytes
+    return buf
+
+  def read_response(self):
+    """Reads one JSON header and its optional binary buffer.
+
+    Returns:
+      Tuple of (deserialized json obj, numpy uint8 array or None).
+    """
+    start_time = time.perf_counter()
+    line = self.read_line()
+    parse_start_time = time.perf_counter()
+    jobj = _loads_response(line)
+    parse_time = time.perf_counter() - parse_start_time
+    # Optionally read a binary buffer of a fixed size.
+    buf = None
+    if 'bufValueSize' in jobj:
+      buf = numpy.frombuffer(
+          self.read_exact(jobj['bufValueSize']), dtype=numpy.uint8)
+
+    last_stats = SocketReadStats()
+    last_stats.num_messages = 1
+    last_stats.header_bytes = len(line)
+    last_stats.payload_bytes = 0 if buf is None else buf.size
+    last_stats.parse_time_sec = parse_time
+    last_stats.read_time_sec = time.perf_counter() - start_time
+    for k, v in last_stats.__dict__.items():
+      setattr(self.stats, k, getattr(self.stats, k) + v)
+    self.last_stats = last_stats
+    return jobj, buf
+
+
 class ItsSession(object):
   """Controls a device over adb to run ITS scripts.
 
@@ -320,6 +504,7 @@ class ItsSession(object):
     self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     self.sock.connect((self.IPADDR, port))
     self.sock.settimeout(self.SOCK_TIMEOUT)
+    self._reader = BufferedSocketReader(self.sock)
 
   def check_port_availability(self, check_port, used_ports):
     """Check if the port is available or not.
@@ -396,6 +581,35 @@ class ItsSession(object):
 
     # Initialize device id and adb command.
     self.adb = 'adb -s ' + self._device_id
+    broker_port = get_session_broker_port(self._device_id)
+    if broker_port is None or not self.__init_broker_socket(broker_port):
+      self.__wait_for_service()
+      self.__init_socket_port()
+
+  def __init_broker_socket(self, port):
+    """Connects to a session broker already connected to ItsService.
+
+    Args:
+      port: int; local port the broker for this device listens on.
+
+    Returns:
+      True if connected, False if the broker could not be reached.
+    """
+    try:
+      self.sock = socket.create_connection(
+          (self.IPADDR, port), timeout=self.SOCK_TIMEOUT)
+    except OSError as e:
+      logging.debug('Session broker on port %d unavailable: %s', port, e)
+      return False
+    self.sock.settimeout(self.SOCK_TIMEOUT)
+    self._reader = BufferedSocketReader(self.sock)
+    logging.debug('Connected to session broker on port %d', port)
+    return True
+
+  def restart_service(self):
+    """Restarts ItsService and reconnects the forwarded device socket."""
+    if hasattr(self, 'sock') and self.sock:
+      self.sock.close()
     self.__wait_for_service()
     self.__init_socket_port()
 
@@ -444,14 +658,19 @@ class ItsSession(object):
     Returns:
      The Python dictionary object for the CameraProperties object.
     """
-    cmd = {}
-    cmd[_CMD_NAME_STR] = 'getCameraProperties'
-    self.sock.send(json.dumps(cmd).encode() + '\n'.encode())
-    data, _ = self.__read_response_from_socket()
-    if data[_TAG_STR] != 'cameraProperties':
-      raise error_util.CameraItsError('Invalid command response')
-    self.props = data[_OBJ_VALUE_STR]['cameraProperties']
-    return data[_OBJ_VALUE_STR]['cameraProperties']
+    def fetch():
+      cmd = {}
+      cmd[_CMD_NAME_STR] = 'getCameraProperties'
+      self.sock.send(json.dumps(cmd).encode() + '\n'.encode())
+      data, _ = self.__read_response_from_socket()
+      if data[_TAG_STR] != 'cameraProperties':
+        raise error_util.CameraItsError('Invalid command response')
+      return data[_OBJ_VALUE_STR]['cameraProperties']
+
+    self.props = get_cached_camera_properties(
+        self._device_id, 'session', self._camera_id,
+        self._override_to_portrait, fetch)
+    return self.props
 
   def get_session_properties(self, out_surfaces, cap_request):
     """Get the camera properties object for a session configuration.
@@ -503,16 +722,20 @@ class ItsSession(object):
      The Python dictionary object for the CameraProperties object. Empty
      if no such device exists.
     """
-    cmd = {}
-    cmd[_CMD_NAME_STR] = 'getCameraPropertiesById'
-    cmd[_CAMERA_ID_STR] = camera_id
-    if override_to_portrait is not None:
-      cmd['overrideToPortrait'] = override_to_portrait
-    self.sock.send(json.dumps(cmd).encode() + '\n'.encode())
-    data, _ = self.__read_response_from_socket()
-    if data[_TAG_STR] != 'cameraProperties':
-      raise error_util.CameraItsError('Invalid command response')
-    return data[_OBJ_VALUE_STR]['cameraProperties']
+    def fetch():
+      cmd = {}
+      cmd[_CMD_NAME_STR] = 'getCameraPropertiesById'
+      cmd[_CAMERA_ID_STR] = camera_id
+      if override_to_portrait is not None:
+        cmd['overrideToPortrait'] = override_to_portrait
+      self.sock.send(json.dumps(cmd).encode() + '\n'.encode())
+      data, _ = self.__read_response_from_socket()
+      if data[_TAG_STR] != 'cameraProperties':
+        raise error_util.CameraItsError('Invalid command response')
+      return data[_OBJ_VALUE_STR]['cameraProperties']
+
+    return get_cached_camera_properties(
+        self._device_id, 'id', camera_id, override_to_portrait, fetch)
 
   def __read_response_from_socket(self):
     """Reads a line (newline-terminated) string serialization of JSON object.
@@ -520,27 +743,11 @@ class ItsSession(object):
     Returns:
      Deserialized json obj.
     """
-    chars = []
-    while not chars or chars[-1] != '\n':
-      ch = self.sock.recv(1).decode('utf-8')
-      if not ch:
-        # Socket was probably closed; otherwise don't get empty strings
-        raise error_util.CameraItsError('Problem with socket on device side')
-      chars.append(ch)
-    line = ''.join(chars)
-    jobj = json.loads(line)
-    # Optionally read a binary buffer of a fixed size.
-    buf = None
-    if 'bufValueSize' in jobj:
-      n = jobj['bufValueSize']
-      buf = bytearray(n)
-      view = memoryview(buf)
-      while n > 0:
-        nbytes = self.sock.recv_into(view, n)
-        view = view[nbytes:]
-        n -= nbytes
-      buf = numpy.frombuffer(buf, dtype=numpy.uint8)
-    return jobj, buf
+    return self._reader.read_response()
+
+  def get_socket_read_stats(self):
+    """Returns a copy of the SocketReadStats accumulated by this session."""
+    return self._reader.stats.copy()
 
   def __open_camera(self):
     """Get the camera ID to open if it is an argument as a single camera.
@@ -673,22 +880,30 @@ class ItsSession(object):
         Note that sensor events are only produced if the device isn't in its
         standby mode (i.e.) if the screen is on.
 
+        The events are requested in packed binary form. In that case the JSON
+        value maps each sensor name to its number of events, and the binary
+        buffer holds each sensor's events in the same order, see
+        imu_processing_utils.SensorTrace.from_buffer. Services which only
+        send JSON lists of events are also supported.
+
     Returns:
             A Python dictionary with three keys ("accel", "mag", "gyro") each
-            of which maps to a list of objects containing "time","x","y","z"
-            keys.
+            of which maps to an imu_processing_utils.SensorTrace. Use
+            SensorTrace.to_list() for a list of objects containing
+            "time","x","y","z" keys.
     """
     cmd = {}
     cmd[_CMD_NAME_STR] = 'getSensorEvents'
+    cmd['packedEvents'] = True
     self.sock.send(json.dumps(cmd).encode() + '\n'.encode())
     timeout = self.SOCK_TIMEOUT + self.EXTRA_SOCK_TIMEOUT
     self.sock.settimeout(timeout)
-    data, _ = self.__read_response_from_socket()
+    data, buf = self.__read_response_from_socket()
     if data[_TAG_STR] != 'sensorEvents':
       raise error_util.CameraItsError('Invalid response for command: %s ' %
                                       cmd[_CMD_NAME_STR])
     self.sock.settimeout(self.SOCK_TIMEOUT)
-    return data[_OBJ_VALUE_STR]
+    return parse_sensor_events(data[_OBJ_VALUE_STR], buf)
 
   def get_camera_ids(self):
     """Returns the list of all camera_ids.
@@ -1386,7 +1601,7 @@ class ItsSession(object):
       cmd: Dictionary specifying command name, requests, and output surface.
       out_surface: Dictionary describing output surface.
     Returns:
-      An object which contains following fields:
+      An image_processing_utils.Capture dict with the following fields:
       * data: the image data as a numpy array of bytes.
       * width: the width of the captured image.
       * height: the height of the captured image.
@@ -1517,7 +1732,8 @@ class ItsSession(object):
       cam_id = out_surface['physicalCamera']
     else:
       cam_id = self._camera_id
-    ret = {'width': width, 'height': height, 'format': fmt}
+    ret = image_processing_utils.Capture(
+        width=width, height=height, format=fmt)
     if cam_id == self._camera_id:
       ret['metadata'] = md
     else:
@@ -1652,13 +1868,16 @@ class ItsSession(object):
 
     Returns:
       An object, list of objects, or list of lists of objects, where each
-      object contains the following fields:
+      object is an image_processing_utils.Capture dict with the following
+      fields:
       * data: the image data as a numpy array of bytes.
       * width: the width of the captured image.
       * height: the height of the captured image.
       * format: image the format, in [
                         "yuv","jpeg","raw","raw10","raw12","rawStats","dng"].
       * metadata: the capture result object (Python dictionary).
+      Its rgb(), planes(), y() and unpacked_raw() methods decode the image
+      once and keep it until release() is called.
     """
     cmd = {}
     cmd[_CMD_NAME_STR] = 'doCaptureWithExtensions'
@@ -1676,7 +1895,8 @@ class ItsSession(object):
                  reprocess_format=None,
                  repeat_request=None,
                  reuse_session=False,
-                 first_surface_for_3a=False):
+                 first_surface_for_3a=False,
+                 metadata_keys=None):
     """Issue capture request(s), and read back the image(s) and metadata.
 
     The main top-level function for capturing one or more images using the
@@ -1817,16 +2037,23 @@ class ItsSession(object):
         the existing CameraCaptureSession.
       first_surface_for_3a: Use first surface in out_surfaces for 3A, not capture
         Only applicable if out_surfaces contains at least 1 surface.
+      metadata_keys: (Optional) list of capture result keys to keep. The
+        device is asked to send only these keys, and other keys are dropped
+        if it sends them, which saves memory in long bursts.
 
     Returns:
       An object, list of objects, or list of lists of objects, where each
-      object contains the following fields:
+      object is an image_processing_utils.Capture dict with the following
+      fields:
       * data: the image data as a numpy array of bytes.
       * width: the width of the captured image.
       * height: the height of the captured image.
       * format: image the format, in [
                         "yuv","jpeg","raw","raw10","raw12","rawStats","dng"].
-      * metadata: the capture result object (Python dictionary).
+      * metadata: the capture result object, an
+        image_processing_utils.CaptureMetadata dict decoding its keys on use.
+      Its rgb(), planes(), y() and unpacked_raw() methods decode the image
+      once and keep it until release() is called.
     """
     cmd = {}
     if reprocess_format is not None:
@@ -1871,6 +2098,8 @@ class ItsSession(object):
 
     cmd['reuseSession'] = reuse_session
     cmd['firstSurfaceFor3A'] = first_surface_for_3a
+    if metadata_keys is not None:
+      cmd['metadataKeys'] = list(metadata_keys)
 
     requested_surfaces = cmd['outputSurfaces'][:]
     if first_surface_for_3a:
@@ -1993,6 +2222,7 @@ class ItsSession(object):
                   's' if ncap > 1 else '', nsurf, 's' if nsurf > 1 else '',
                   ','.join(formats))
     self.sock.send(json.dumps(cmd).encode() + '\n'.encode())
+    read_stats_start = self.get_socket_read_stats()
 
     # Wait for ncap*nsurf images and ncap metadata responses.
     # Assume that captures come out in the same order as requested in
@@ -2026,7 +2256,10 @@ class ItsSession(object):
         yuv_bufs[camera_id][buf_size].append(buf)
         nbufs += 1
       elif json_obj[_TAG_STR] == 'captureResults':
-        mds.append(json_obj[_OBJ_VALUE_STR]['captureResult'])
+        md = json_obj[_OBJ_VALUE_STR]['captureResult']
+        if metadata_keys is not None:
+          md = _project_metadata(md, metadata_keys)
+        mds.append(md)
         physical_mds.append(json_obj[_OBJ_VALUE_STR]['physicalResults'])
         outputs = json_obj[_OBJ_VALUE_STR]['outputs']
         widths = [out['width'] for out in outputs]
@@ -2058,7 +2291,7 @@ class ItsSession(object):
         cam_id = self._camera_id
 
       for i in range(ncap):
-        obj = {}
+        obj = image_processing_utils.Capture()
         obj['width'] = widths[j]
         obj['height'] = heights[j]
         obj['format'] = fmt
@@ -2077,6 +2310,8 @@ class ItsSession(object):
           obj['data'] = bufs[cam_id][fmt][i]
         objs.append(obj)
       rets.append(objs if ncap > 1 else objs[0])
+    logging.debug('Socket reads for capture: %s',
+                  self.get_socket_read_stats() - read_stats_start)
     self.sock.settimeout(self.SOCK_TIMEOUT)
     if len(rets) > 1 or (isinstance(rets[0], dict) and
                          isinstance(cap_request, list)):
@@ -2630,6 +2865,162 @@ class ItsSession(object):
     return [surface]
 
 
+def get_build_fingerprint(device_id):
+  """Returns ro.build.fingerprint of the device, read once per process."""
+  if device_id not in _build_fingerprints:
+    cmd = f'adb -s {device_id} shell getprop ro.build.fingerprint'
+    try:
+      _build_fingerprints[device_id] = subprocess.check_output(
+          cmd.split()).decode().strip()
+    except subprocess.CalledProcessError as e:
+      raise AssertionError('No build fingerprint.') from e
+    logging.debug('Build fingerprint: %s', _build_fingerprints[device_id])
+  return _build_fingerprints[device_id]
+
+
+def get_its_service_version(device_id):
+  """Returns versionCode and lastUpdateTime of ItsService, read once.
+
+  The update time changes whenever the APK is reinstalled, which catches
+  development builds of ItsService that keep the same versionCode.
+  """
+  if device_id not in _its_service_versions:
+    cmd = f'adb -s {device_id} shell dumpsys package {_ITS_SERVICE_PACKAGE}'
+    try:
+      dumpsys = subprocess.check_output(cmd.split()).decode()
+    except subprocess.CalledProcessError as e:
+      raise AssertionError('Cannot read ItsService package info.') from e
+    version_code = re.search(r'versionCode=(\d+)', dumpsys)
+    if not version_code:
+      raise AssertionError(f'{_ITS_SERVICE_PACKAGE} is not installed.')
+    update_time = re.search(r'lastUpdateTime=([^\n]+)', dumpsys)
+    _its_service_versions[device_id] = (
+        f'{version_code.group(1)}_'
+        f'{update_time.group(1).strip() if update_time else ""}')
+    logging.debug('ItsService version: %s', _its_service_versions[device_id])
+  return _its_service_versions[device_id]
+
+
+def _get_cache_file_stem(key):
+  """Returns key with characters not allowed in file names replaced."""
+  return re.sub(r'[^\w.-]', '_', key)
+
+
+def _get_camera_props_cache_file(device_id, props_type, camera_id,
+                                 override_to_portrait):
+  """Returns the cache file name of camera properties on this device build."""
+  build = (f'{get_build_fingerprint(device_id)}_'
+           f'{get_its_service_version(device_id)}')
+  fingerprint = hashlib.sha1(build.encode()).hexdigest()[:16]
+  key = (f'{device_id}_{fingerprint}_{props_type}_{camera_id}_'
+         f'{override_to_portrait}')
+  return os.path.join(CAMERA_PROPS_CACHE_DIR,
+                      f'{_get_cache_file_stem(key)}.json')
+
+
+def get_cached_camera_properties(device_id, props_type, camera_id,
+                                 override_to_portrait, fetch):
+  """Returns camera properties from memory, disk, or fetch().
+
+  Properties are keyed by device, build fingerprint, installed ItsService
+  version, camera ID and overrideToPortrait, so a new build or a reinstalled
+  ItsService on the device reads them again. Each call returns a new dict, so
+  callers can modify it.
+
+  Args:
+    device_id: str; ID of the device.
+    props_type: str; 'session' for the open camera, 'id' for by ID.
+    camera_id: camera ID string.
+    override_to_portrait: overrideToPortrait value, or None for default.
+    fetch: function reading the properties from the device.
+
+  Returns:
+    The Python dictionary object for the CameraProperties object.
+  """
+  if os.environ.get(CAMERA_PROPS_CACHE_ENV, '').lower() == 'false':
+    return fetch()
+  cache_file = _get_camera_props_cache_file(
+      device_id, props_type, camera_id, override_to_portrait)
+  if cache_file not in _camera_props_cache:
+    if os.path.isfile(cache_file):
+      logging.debug('Reading camera properties from %s', cache_file)
+      with open(cache_file, 'r') as f:
+        _camera_props_cache[cache_file] = f.read()
+    else:
+      props_json = json.dumps(fetch())
+      os.makedirs(CAMERA_PROPS_CACHE_DIR, exist_ok=True)
+      # Write a temp file and rename, as tests on other testbeds may read it
+      tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+      with open(tmp_file, 'w') as f:
+        f.write(props_json)
+      os.replace(tmp_file, cache_file)
+      _camera_props_cache[cache_file] = props_json
+  return json.loads(_camera_props_cache[cache_file])
+
+
+def invalidate_camera_properties_cache(device_id=None):
+  """Removes cached camera properties of device_id, or of all devices.
+
+  Args:
+    device_id: (Optional) str; ID of the device.
+  """
+  pattern = f'{_get_cache_file_stem(device_id)}_*' if device_id else '*'
+  for cache_file in glob.glob(os.path.join(CAMERA_PROPS_CACHE_DIR,
+                                           f'{pattern}.json')):
+    os.remove(cache_file)
+  for cache_file in list(_camera_props_cache):
+    if fnmatch.fnmatch(os.path.basename(cache_file), f'{pattern}.json'):
+      del _camera_props_cache[cache_file]
+  logging.debug('Invalidated camera properties cache for %s',
+                device_id or 'all devices')
+
+
+def get_session_broker_port(device_id):
+  """Returns the port of the session broker for device_id, if one is running.
+
+  Args:
+    device_id: str; ID of the device.
+
+  Returns:
+    int port from SESSION_BROKER_ENV, or None if unset or for another device.
+  """
+  broker = os.environ.get(SESSION_BROKER_ENV)
+  if not broker:
+    return None
+  broker_device_id, port = broker.rsplit(':', 1)
+  if broker_device_id != device_id:
+    return None
+  return int(port)
+
+
+def parse_sensor_events(obj, buf=None):
+  """Parses a getSensorEvents response into SensorTraces.
+
+  Args:
+    obj: JSON value of the response. With a binary buffer, maps each sensor
+      name to its number of events. Otherwise, maps each sensor name to a
+      list of 'time', 'x', 'y', 'z' dicts.
+    buf: optional numpy uint8 array holding the packed events of each sensor,
+      in the order of obj.
+
+  Returns:
+    Dict mapping each sensor name to an imu_processing_utils.SensorTrace.
+  """
+  if buf is None:
+    return {sensor: imu_processing_utils.SensorTrace.from_events(events)
+            for sensor, events in obj.items()}
+  traces = {}
+  offset = 0
+  for sensor, count in obj.items():
+    traces[sensor] = imu_processing_utils.SensorTrace.from_buffer(
+        buf, count, offset)
+    offset += imu_processing_utils.SensorTrace.packed_size(count)
+  if offset != buf.size:
+    raise error_util.CameraItsError(
+        f'Sensor events buffer is {buf.size} bytes, expected {offset}')
+  return traces
+
+
 def parse_camera_ids(ids):
   """Parse the string of camera IDs into array of CameraIdCombo tuples.
 
@@ -2720,23 +3111,83 @@ def load_scene(cam, props, scene, tablet, chart_distance, lighting_check=True,
     validate_lighting(y_plane, scene, log_path=log_path, fov=float(camera_fov))
 
 
+def _get_scene_file_hash(path):
+  """Returns the sha256 hex digest of path, hashed once per file version."""
+  stat = os.stat(path)
+  cached = _scene_file_hashes.get(path)
+  if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+    return cached[2]
+  sha = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      sha.update(block)
+  _scene_file_hashes[path] = (stat.st_mtime_ns, stat.st_size, sha.hexdigest())
+  return sha.hexdigest()
+
+
+def _get_tablet_scene_hashes(tablet_id, file_names):
+  """Returns {file name: sha256} of file_names in the tablet's scene dir.
+
+  All files are hashed by one adb shell call. Files missing on the tablet,
+  or all files if the tablet cannot hash them, are left out.
+
+  Args:
+    tablet_id: device id of tablet.
+    file_names: list of file names in _DST_SCENE_DIR.
+  """
+  quoted_names = ' '.join(shlex.quote(f) for f in file_names)
+  cmd = ['adb', '-s', tablet_id, 'shell',
+         f'cd {_DST_SCENE_DIR} && sha256sum {quoted_names} 2>/dev/null']
+  output = subprocess.run(cmd, capture_output=True, check=False).stdout
+  hashes = {}
+  for line in output.decode(errors='replace').splitlines():
+    digest, _, file_name = line.strip().partition(' ')
+    file_name = file_name.lstrip(' *')
+    if file_name in file_names:
+      hashes[file_name] = digest
+  return hashes
+
+
 def copy_scenes_to_tablet(scene, tablet_id):
-  """Copies scenes onto the tablet before running the tests.
+  """Copies changed scene files onto the tablet before running the tests.
+
+  Scene files are compared by sha256 with those already on the tablet. The
+  hashes known to be on each tablet are kept for the process, so the tablet
+  is only asked for files not copied or checked before. Changed files are
+  copied with a single adb push, which returns once they are on the tablet.
 
   Args:
     scene: Name of the scene to copy image files.
     tablet_id: device id of tablet
   """
-  logging.info('Copying files to tablet: %s', tablet_id)
+  logging.info('Syncing files to tablet: %s', tablet_id)
   scene_path = os.path.join(os.environ['CAMERA_ITS_TOP'], 'tests', scene)
-  scene_dir = os.listdir(scene_path)
-  for file_name in scene_dir:
-    if file_name.endswith('.png') or file_name.endswith('.mp4'):
-      src_scene_file = os.path.join(scene_path, file_name)
-      cmd = f'adb -s {tablet_id} push {src_scene_file} {_DST_SCENE_DIR}'
-      subprocess.Popen(cmd.split())
-  time.sleep(_COPY_SCENE_DELAY_SEC)
-  logging.info('Finished copying files to tablet.')
+  local_hashes = {
+      file_name: _get_scene_file_hash(os.path.join(scene_path, file_name))
+      for file_name in sorted(os.listdir(scene_path))
+      if file_name.endswith(_SCENE_FILE_EXTENSIONS)
+  }
+  manifest = _tablet_scene_manifests.setdefault(tablet_id, {})
+  unknown = [f for f, digest in local_hashes.items()
+             if manifest.get(f) != digest]
+  if unknown:
+    manifest.update(_get_tablet_scene_hashes(tablet_id, unknown))
+  changed = [f for f in unknown if manifest.get(f) != local_hashes[f]]
+  if changed:
+    logging.debug('Pushing %d of %d files of %s', len(changed),
+                  len(local_hashes), scene)
+    cmd = (['adb', '-s', tablet_id, 'push'] +
+           [os.path.join(scene_path, f) for f in changed] + [_DST_SCENE_DIR])
+    try:
+      subprocess.run(cmd, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+      for f in changed:
+        manifest.pop(f, None)
+      raise AssertionError(
+          f'Failed to copy {scene} files to tablet {tablet_id}: '
+          f'{e.stderr.decode(errors="replace")}') from e
+    manifest.update({f: local_hashes[f] for f in changed})
+  logging.info('Finished syncing files to tablet, %d copied.', len(changed))
 
 
 def validate_lighting(y_plane, scene, state='ON', log_path=None,
@@ -13,12 +13,18 @@
 # limitations under the License.
 """Tests for its_session_utils."""
 
+import json
+import os
+import socket
+import tempfile
 import unittest
 import unittest.mock
 
 import numpy
 
+import error_util
 import image_processing_utils
+import imu_processing_utils
 import its_session_utils
 
 
@@ -91,5 +97,227 @@ class ItsSessionUtilsTests(unittest.TestCase):
                                         tablet_state='OFF')
 
 
+class BufferedSocketReaderTests(unittest.TestCase):
+  """Unit tests for BufferedSocketReader."""
+
+  def setUp(self):
+    super().setUp()
+    self.host_sock, self.device_sock = socket.socketpair()
+    self.addCleanup(self.host_sock.close)
+    self.addCleanup(self.device_sock.close)
+
+  def test_read_responses_split_across_chunks(self):
+    payload = bytes(range(256)) * 40
+    header = {'tag': 'yuvImage', 'bufValueSize': len(payload)}
+    self.device_sock.sendall(json.dumps(header).encode() + b'\n' + payload +
+                             json.dumps({'tag': 'done'}).encode() + b'\n')
+    reader = its_session_utils.BufferedSocketReader(self.host_sock,
+                                                    chunk_size=7)
+    jobj, buf = reader.read_response()
+    self.assertEqual(jobj, header)
+    self.assertEqual(buf.tobytes(), payload)
+    jobj, buf = reader.read_response()
+    self.assertEqual(jobj, {'tag': 'done'})
+    self.assertIsNone(buf)
+    self.assertEqual(reader.stats.num_messages, 2)
+    self.assertEqual(reader.stats.payload_bytes, len(payload))
+    self.assertEqual(reader.last_stats.payload_bytes, 0)
+
+  def test_read_response_capture_result_is_lazy(self):
+    header = {'tag': 'captureResults',
+              'objValue': {'captureResult': {'android.sensor.timestamp': 5},
+                           'physicalResults': []}}
+    self.device_sock.sendall(json.dumps(header).encode() + b'\n')
+    reader = its_session_utils.BufferedSocketReader(self.host_sock)
+    jobj, _ = reader.read_response()
+    md = jobj['objValue']['captureResult']
+    self.assertIsInstance(md, image_processing_utils.CaptureMetadata)
+    self.assertEqual(jobj, header)
+
+  def test_read_response_closed_socket(self):
+    self.device_sock.sendall(b'{"tag": ')
+    self.device_sock.close()
+    reader = its_session_utils.BufferedSocketReader(self.host_sock)
+    with self.assertRaises(error_util.CameraItsError):
+      reader.read_response()
+
+
+class ParseSensorEventsTests(unittest.TestCase):
+  """Unit tests for parse_sensor_events."""
+
+  def test_packed_events_match_json_events(self):
+    events = {
+        'accel': [{'time': 1000, 'x': 0.5, 'y': -1.0, 'z': 9.75}],
+        'gyro': [{'time': 2000, 'x': 0.25, 'y': 0.0, 'z': -0.5},
+                 {'time': 7000, 'x': 0.0, 'y': 0.125, 'z': 1.5}],
+    }
+    payload = b''
+    for sensor_events in events.values():
+      payload += numpy.array([e['time'] for e in sensor_events],
+                             dtype='<i8').tobytes()
+      payload += numpy.array([[e['x'], e['y'], e['z']] for e in sensor_events],
+                             dtype='<f4').tobytes()
+    buf = numpy.frombuffer(payload, dtype=numpy.uint8)
+    packed = its_session_utils.parse_sensor_events(
+        {sensor: len(e) for sensor, e in events.items()}, buf)
+    unpacked = its_session_utils.parse_sensor_events(events)
+    for sensor, sensor_events in events.items():
+      self.assertEqual(packed[sensor].to_list(), sensor_events)
+      self.assertEqual(unpacked[sensor].to_list(), sensor_events)
+    self.assertEqual(packed['gyro'][-1]['time'], 7000)
+
+  def test_packed_events_size_mismatch(self):
+    buf = numpy.zeros(imu_processing_utils.SensorTrace.packed_size(2) + 1,
+                      dtype=numpy.uint8)
+    with self.assertRaises(error_util.CameraItsError):
+      its_session_utils.parse_sensor_events({'gyro': 2}, buf)
+
+
+class CameraPropertiesCacheTests(unittest.TestCase):
+  """Unit tests for the camera properties cache."""
+
+  def setUp(self):
+    super().setUp()
+    tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    for patcher in (
+        unittest.mock.patch.object(
+            its_session_utils, 'CAMERA_PROPS_CACHE_DIR', tmp_dir.name),
+        unittest.mock.patch.object(its_session_utils, '_camera_props_cache',
+                                   {}),
+        unittest.mock.patch.object(
+            its_session_utils, 'get_build_fingerprint',
+            return_value='vendor/device:15/AP1A/123:userdebug/dev-keys'),
+        unittest.mock.patch.object(
+            its_session_utils, 'get_its_service_version',
+            return_value='35_2026-01-01 10:00:00'),
+        unittest.mock.patch.dict(os.environ),
+    ):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    os.environ.pop(its_session_utils.CAMERA_PROPS_CACHE_ENV, None)
+    self.fetch = unittest.mock.Mock(
+        side_effect=lambda: {'android.lens.facing': 1, 'camera.id': '0'})
+
+  def _get_props(self, device_id='serial:1', camera_id='0'):
+    return its_session_utils.get_cached_camera_properties(
+        device_id, 'session', camera_id, None, self.fetch)
+
+  def test_fetches_once_and_returns_copies(self):
+    props = self._get_props()
+    props['android.lens.facing'] = 0
+    self.assertEqual(self._get_props()['android.lens.facing'], 1)
+    self._get_props(camera_id='1')
+    self.assertEqual(self.fetch.call_count, 2)
+
+    # A new process reads the properties from disk
+    its_session_utils._camera_props_cache.clear()
+    self.assertEqual(self._get_props()['camera.id'], '0')
+    self.assertEqual(self.fetch.call_count, 2)
+
+  def test_invalidate_refetches(self):
+    self._get_props()
+    self._get_props(device_id='other')
+    its_session_utils.invalidate_camera_properties_cache('serial:1')
+    self._get_props()
+    self._get_props(device_id='other')
+    self.assertEqual(self.fetch.call_count, 3)
+
+  def test_its_service_version_in_key(self):
+    self._get_props()
+    with unittest.mock.patch.object(
+        its_session_utils, 'get_its_service_version',
+        return_value='35_2026-01-02 10:00:00'):
+      self._get_props()
+    self._get_props()
+    self.assertEqual(self.fetch.call_count, 2)
+
+  def test_disabled_by_env(self):
+    os.environ[its_session_utils.CAMERA_PROPS_CACHE_ENV] = 'false'
+    self._get_props()
+    self._get_props()
+    self.assertEqual(self.fetch.call_count, 2)
+
+
+class ItsServiceVersionTests(unittest.TestCase):
+  """Unit tests for get_its_service_version."""
+
+  def setUp(self):
+    super().setUp()
+    patcher = unittest.mock.patch.object(
+        its_session_utils, '_its_service_versions', {})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  @unittest.mock.patch.object(its_session_utils.subprocess, 'check_output')
+  def test_reads_version_once(self, check_output):
+    check_output.return_value = (
+        b'Packages:\n'
+        b'  Package [com.android.cts.verifier] (1a2b3c):\n'
+        b'    versionCode=35 minSdk=34 targetSdk=35\n'
+        b'    lastUpdateTime=2026-01-01 10:00:00\n')
+    for _ in range(2):
+      self.assertEqual(
+          its_session_utils.get_its_service_version('serial:1'),
+          '35_2026-01-01 10:00:00')
+    check_output.assert_called_once()
+
+  @unittest.mock.patch.object(its_session_utils.subprocess, 'check_output',
+                              return_value=b'')
+  def test_not_installed(self, _):
+    with self.assertRaises(AssertionError):
+      its_session_utils.get_its_service_version('serial:1')
+
+
+class CopyScenesToTabletTests(unittest.TestCase):
+  """Unit tests for copy_scenes_to_tablet."""
+
+  def setUp(self):
+    super().setUp()
+    tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    self.scene_path = os.path.join(tmp_dir.name, 'tests', 'scene1')
+    os.makedirs(self.scene_path)
+    for file_name, content in (('a.png', b'a'), ('b.png', b'b'),
+                               ('notes.txt', b'c')):
+      with open(os.path.join(self.scene_path, file_name), 'wb') as f:
+        f.write(content)
+    self.tablet_hashes = {
+        'a.png': its_session_utils._get_scene_file_hash(
+            os.path.join(self.scene_path, 'a.png')),
+        'b.png': 'stale',
+    }
+    for patcher in (
+        unittest.mock.patch.dict(os.environ,
+                                 {'CAMERA_ITS_TOP': tmp_dir.name}),
+        unittest.mock.patch.object(its_session_utils,
+                                   '_tablet_scene_manifests', {}),
+        unittest.mock.patch.object(its_session_utils.subprocess, 'run',
+                                   side_effect=self._run),
+    ):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.cmds = []
+
+  def _run(self, cmd, **unused_kwargs):
+    self.cmds.append(cmd)
+    stdout = ''.join(f'{digest}  {file_name}\n'
+                     for file_name, digest in self.tablet_hashes.items()
+                     if file_name in cmd[-1])
+    return unittest.mock.Mock(stdout=stdout.encode())
+
+  def test_pushes_only_changed_files_once(self):
+    its_session_utils.copy_scenes_to_tablet('scene1', 'tablet')
+    self.assertEqual(len(self.cmds), 2)
+    self.assertEqual(self.cmds[1], [
+        'adb', '-s', 'tablet', 'push',
+        os.path.join(self.scene_path, 'b.png'),
+        its_session_utils._DST_SCENE_DIR])
+
+    # Files known to be on the tablet are not checked or pushed again
+    its_session_utils.copy_scenes_to_tablet('scene1', 'tablet')
+    self.assertEqual(len(self.cmds), 2)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,49 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utility functions to defer loading of heavy modules until they are used."""
+
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+  """Imports a module whose code only runs when an attribute is first used.
+
+  Each ITS test runs in a new interpreter, so modules only used by a few
+  functions, such as colour or opencv_processing_utils, are imported with
+  this to keep their load time out of tests that never call them.
+
+  Args:
+    name: str; top level name of the module, e.g. 'colour'. Submodules would
+      load their parent package to be found, so import them where used.
+
+  Returns:
+    The module. It is added to sys.modules, so later imports share it.
+
+  Raises:
+    ModuleNotFoundError: if the module cannot be found.
+  """
+  module = sys.modules.get(name)
+  if module is not None:
+    return module
+  spec = importlib.util.find_spec(name)
+  if spec is None:
+    raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+  loader = importlib.util.LazyLoader(spec.loader)
+  spec.loader = loader
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  loader.exec_module(module)
+  return module
@@ -0,0 +1,58 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for lazy_import_utils."""
+
+
+import os
+import sys
+import tempfile
+import unittest
+
+import lazy_import_utils
+
+_MODULE_NAME = 'lazy_import_utils_unittest_module'
+
+
+class LazyImportUtilsTest(unittest.TestCase):
+  """Unit tests for this module."""
+
+  def setUp(self):
+    super().setUp()
+    module_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(module_dir.cleanup)
+    with open(os.path.join(module_dir.name, f'{_MODULE_NAME}.py'), 'w') as f:
+      f.write('import sys\n'
+              'sys.lazy_import_utils_unittest_runs += 1\n'
+              'VALUE = 5\n')
+    sys.path.insert(0, module_dir.name)
+    self.addCleanup(sys.path.remove, module_dir.name)
+    self.addCleanup(sys.modules.pop, _MODULE_NAME, None)
+    sys.lazy_import_utils_unittest_runs = 0
+    self.addCleanup(delattr, sys, 'lazy_import_utils_unittest_runs')
+
+  def test_lazy_import_runs_module_on_first_use(self):
+    module = lazy_import_utils.lazy_import(_MODULE_NAME)
+    self.assertEqual(sys.lazy_import_utils_unittest_runs, 0)
+    self.assertIs(lazy_import_utils.lazy_import(_MODULE_NAME), module)
+    self.assertEqual(module.VALUE, 5)
+    self.assertEqual(module.VALUE, 5)
+    self.assertEqual(sys.lazy_import_utils_unittest_runs, 1)
+
+  def test_lazy_import_missing_module(self):
+    with self.assertRaises(ModuleNotFoundError):
+      lazy_import_utils.lazy_import('lazy_import_utils_unittest_missing')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,9 +14,6 @@
 """Noise model constants."""
 
 
-import matplotlib.colors
-import matplotlib.pyplot as plt
-
 # Standard Bayer color channel names in canonical order.
 BAYER_COLORS = ('R', 'Gr', 'Gb', 'B')
 
@@ -86,10 +83,27 @@ VALID_RAW_STATS_FORMATS = (
     'rawStats', 'rawQuadBayerStats',
     'raw10Stats', 'raw10QuadBayerStats',
 )
-
-# Rainbow color map used to plot stats samples of different exposure times.
-RAINBOW_CMAP = plt.cm.rainbow
-# Assume the maximum exposure time is 2^12 ms for calibration.
-COLOR_NORM = matplotlib.colors.Normalize(vmin=0, vmax=12)
-COLOR_BAR = plt.cm.ScalarMappable(cmap=RAINBOW_CMAP, norm=COLOR_NORM)
 OUTLIER_MEDIAN_ABS_DEVS_DEFAULT = 3
+
+# Plotting constants, created by __getattr__ so matplotlib is only imported
+# when they are used.
+_MATPLOTLIB_CONSTANTS = ('RAINBOW_CMAP', 'COLOR_NORM', 'COLOR_BAR')
+
+
+def __getattr__(name):
+  """Creates RAINBOW_CMAP, COLOR_NORM and COLOR_BAR when first used."""
+  if name not in _MATPLOTLIB_CONSTANTS:
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+  import matplotlib.colors  # pylint: disable=g-import-not-at-top
+  import matplotlib.pyplot as plt  # pylint: disable=g-import-not-at-top
+
+  # Rainbow color map used to plot stats samples of different exposure times.
+  rainbow_cmap = plt.cm.rainbow
+  # Assume the maximum exposure time is 2^12 ms for calibration.
+  color_norm = matplotlib.colors.Normalize(vmin=0, vmax=12)
+  globals().update(
+      RAINBOW_CMAP=rainbow_cmap,
+      COLOR_NORM=color_norm,
+      COLOR_BAR=plt.cm.ScalarMappable(cmap=rainbow_cmap, norm=color_norm),
+  )
+  return globals()[name]
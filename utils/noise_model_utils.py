@@ -235,6 +235,45 @@ def crop_and_reorder_stats_images(
   return means, vars_
 
 
+class RaggedPlanes:
+  """Per color plane 1-D arrays of different lengths in one flat buffer.
+
+  Plane i is values[offsets[i]:offsets[i + 1]], and is returned as a view by
+  ragged[i], so code indexing per plane lists of arrays works unchanged.
+
+  Attributes:
+    values: 1-D numpy array with the values of all planes, plane by plane.
+    offsets: 1-D int numpy array of num_planes + 1 plane start offsets.
+  """
+
+  def __init__(self, values: np.ndarray, offsets: np.ndarray):
+    self.values = values
+    self.offsets = offsets
+
+  @classmethod
+  def from_planes(cls, planes) -> 'RaggedPlanes':
+    """Packs a sequence of per plane arrays, e.g. an object-dtype array."""
+    if isinstance(planes, cls):
+      return planes
+    planes = [np.asarray(p, dtype=float).ravel() for p in planes]
+    offsets = np.zeros(len(planes) + 1, dtype=int)
+    np.cumsum([p.size for p in planes], out=offsets[1:])
+    return cls(np.concatenate(planes) if planes else np.zeros(0), offsets)
+
+  def __len__(self) -> int:
+    return len(self.offsets) - 1
+
+  def __getitem__(self, pidx: int) -> np.ndarray:
+    return self.values[self.offsets[pidx]:self.offsets[pidx + 1]]
+
+  def __iter__(self):
+    return (self[pidx] for pidx in range(len(self)))
+
+  def plane_indices(self) -> np.ndarray:
+    """Returns the plane index of each value."""
+    return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+
 def filter_stats(
     means: np.ndarray,
     vars_: np.ndarray,
@@ -243,9 +282,12 @@ def filter_stats(
     max_signal_value: float = 0.25,
     is_remove_var_outliers: bool = False,
     deviations: int = _OUTLIER_MEDIAN_ABS_DEVS_DEFAULT,
-) -> Tuple[np.ndarray, np.ndarray]:
+) -> Tuple[RaggedPlanes, RaggedPlanes]:
   """Filters means outliers and variance outliers.
 
+  All planes are filtered and normalized at once; the kept values of each
+  plane have different counts, so they are returned packed in RaggedPlanes.
+
   Args:
       means: A numpy ndarray of pixel mean values.
       vars_: A numpy ndarray of pixel variance values.
@@ -259,8 +301,8 @@ def filter_stats(
 
   Returns:
       A tuple of (means_filtered, vars_filtered) where means_filtered and
-      vars_filtered are numpy ndarrays of filtered pixel mean and variance
-      values, respectively.
+      vars_filtered are RaggedPlanes of filtered pixel mean and variance
+      values of each plane, respectively.
   """
   if means.shape != vars_.shape:
     raise AssertionError(
@@ -268,61 +310,36 @@ def filter_stats(
         f' vars.shape={vars_.shape}.'
     )
   num_planes = len(means)
-  means_filtered = []
-  vars_filtered = []
-
-  for pidx in range(num_planes):
-    black_level = black_levels[pidx]
-    means_i = means[pidx]
-    vars_i = vars_[pidx]
-
-    # Basic constraints:
-    # (1) means are within the range [0, 1],
-    # (2) vars are non-negative values.
-    constraints = [
-        means_i >= black_level,
-        means_i <= white_level,
-        vars_i >= 0,
-    ]
-    if is_remove_var_outliers:
-      # Filter out variances that differ too much from the median of variances.
-      std_dev = scipy.stats.median_abs_deviation(vars_i, axis=None, scale=1)
-      med = np.median(vars_i)
-      constraints.extend([
-          vars_i > med - deviations * std_dev,
-          vars_i < med + deviations * std_dev,
-      ])
-
-    keep_indices = np.where(np.logical_and.reduce(constraints))
-    if not np.any(keep_indices):
-      logging.info('After filter channel %d, stats array is empty.', pidx)
-
-    # Normalizes the range to [0, 1].
-    means_i = (means_i[keep_indices] - black_level) / (
-        white_level - black_level
-    )
-    vars_i = vars_i[keep_indices] / ((white_level - black_level) ** 2)
-    # Filter out the tiles if they have samples that might be clipped.
-    mean_var_pairs = list(
-        filter(
-            lambda x: x[0] + 2 * math.sqrt(x[1]) < max_signal_value,
-            zip(means_i, vars_i),
-        )
-    )
-    if mean_var_pairs:
-      means_i, vars_i = zip(*mean_var_pairs)
-    else:
-      means_i, vars_i = [], []
-    means_i = np.asarray(means_i)
-    vars_i = np.asarray(vars_i)
-    means_filtered.append(means_i)
-    vars_filtered.append(vars_i)
-
-  # After filtering, means_filtered and vars_filtered may have different shapes
-  # in each color planes.
-  means_filtered = np.asarray(means_filtered, dtype=object)
-  vars_filtered = np.asarray(vars_filtered, dtype=object)
-  return means_filtered, vars_filtered
+  means = np.asarray(means, dtype=float).reshape(num_planes, -1)
+  vars_ = np.asarray(vars_, dtype=float).reshape(num_planes, -1)
+  black_levels = np.asarray(black_levels[:num_planes], dtype=float)[:, None]
+
+  # Basic constraints:
+  # (1) means are within the range [0, 1],
+  # (2) vars are non-negative values.
+  keep = (means >= black_levels) & (means <= white_level) & (vars_ >= 0)
+  if is_remove_var_outliers:
+    # Filter out variances that differ too much from the median of variances.
+    std_dev = scipy.stats.median_abs_deviation(
+        vars_, axis=1, scale=1)[:, None]
+    med = np.median(vars_, axis=1)[:, None]
+    keep &= (vars_ > med - deviations * std_dev)
+    keep &= (vars_ < med + deviations * std_dev)
+
+  # Normalizes the range to [0, 1].
+  signal_range = white_level - black_levels
+  means = (means - black_levels) / signal_range
+  vars_ = vars_ / signal_range ** 2
+  # Filter out the tiles if they have samples that might be clipped.
+  keep &= means + 2 * np.sqrt(np.maximum(vars_, 0)) < max_signal_value
+
+  counts = np.count_nonzero(keep, axis=1)
+  for pidx in np.flatnonzero(counts == 0):
+    logging.info('After filter channel %d, stats array is empty.', pidx)
+  offsets = np.zeros(num_planes + 1, dtype=int)
+  np.cumsum(counts, out=offsets[1:])
+  return (RaggedPlanes(means[keep], offsets),
+          RaggedPlanes(vars_[keep], offsets))
 
 
 def get_next_iso(
@@ -368,7 +385,7 @@ def capture_stats_images(
     is_remove_var_outliers: bool = False,
     outlier_median_abs_deviations: int = _OUTLIER_MEDIAN_ABS_DEVS_DEFAULT,
     is_debug_mode: bool = False,
-) -> Dict[int, List[Tuple[float, np.ndarray, np.ndarray]]]:
+) -> Dict[int, List[Tuple[float, RaggedPlanes, RaggedPlanes]]]:
   """Capture stats images and saves the stats in a dictionary.
 
   This function captures stats images at different ISO values and exposure
@@ -582,7 +599,7 @@ def measure_linear_noise_models(
       A tuple containing:
           measured_models: A list of linear models, one for each color plane.
           samples: A list of samples, one for each color plane. Each sample is a
-              tuple of (iso, mean, var).
+              tuple of (isos, means, vars) numpy arrays.
   """
   num_planes = len(color_planes)
   # Model parameters for each color plane.
@@ -592,21 +609,26 @@ def measure_linear_noise_models(
 
   for iso in sorted(iso_to_stats_dict.keys()):
     logging.info('Calculating measured models for ISO %d.', iso)
-    stats_per_plane = [[] for _ in range(num_planes)]
-    for _, means, vars_ in iso_to_stats_dict[iso]:
-      for pidx in range(num_planes):
-        means_p = means[pidx]
-        vars_p = vars_[pidx]
-        if means_p.size > 0 and vars_p.size > 0:
-          stats_per_plane[pidx].extend(list(zip(means_p, vars_p)))
-
-    for pidx, mean_var_pairs in enumerate(stats_per_plane):
-      if not mean_var_pairs:
+    # Stats saved by older versions are object arrays, not RaggedPlanes.
+    stats = [(RaggedPlanes.from_planes(means), RaggedPlanes.from_planes(vars_))
+             for _, means, vars_ in iso_to_stats_dict[iso]]
+    # Group the samples of all exposures by plane, keeping exposure order.
+    plane_indices = np.concatenate([m.plane_indices() for m, _ in stats])
+    order = np.argsort(plane_indices, kind='stable')
+    means_iso = np.concatenate([m.values for m, _ in stats])[order]
+    vars_iso = np.concatenate([v.values for _, v in stats])[order]
+    plane_ends = np.searchsorted(
+        plane_indices[order], np.arange(num_planes + 1))
+
+    for pidx in range(num_planes):
+      plane = slice(plane_ends[pidx], plane_ends[pidx + 1])
+      means_p, vars_p = means_iso[plane], vars_iso[plane]
+      if not means_p.size:
         raise ValueError(
             f'For ISO {iso}, samples are empty in color plane'
             f' {color_planes[pidx]}.'
         )
-      slope, intercept, rvalue, _, _ = scipy.stats.linregress(mean_var_pairs)
+      slope, intercept, rvalue, _, _ = scipy.stats.linregress(means_p, vars_p)
 
       measured_models[pidx].append((iso, slope, intercept))
       logging.info(
@@ -618,13 +640,15 @@ def measure_linear_noise_models(
       )
 
       # Add the samples for this sensitivity to the global samples list.
-      samples[pidx].extend([(iso, mean, var) for (mean, var) in mean_var_pairs])
+      samples[pidx].append((np.full(means_p.size, iso), means_p, vars_p))
 
+  samples = [tuple(np.concatenate(x) for x in zip(*samples_p))
+             for samples_p in samples]
   return measured_models, samples
 
 
 def compute_noise_model(
-    samples: List[List[Tuple[float, np.ndarray, np.ndarray]]],
+    samples: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
     sens_max_analog: int,
     offset_a: np.ndarray,
     offset_b: np.ndarray,
@@ -649,8 +673,9 @@ def compute_noise_model(
   find the model parameters that minimize the mean squared error.
 
   Args:
-    samples: A list of samples, each of which is a list of tuples of `(gains,
-      means, vars_)`.
+    samples: A list of samples, one per color plane, each of which is a tuple
+      of `(gains, means, vars_)` numpy arrays, as returned by
+      measure_linear_noise_models.
     sens_max_analog: The maximum analog gain.
     offset_a: The gradient coefficients from the read noise calibration.
     offset_b: The intercept coefficients from the read noise calibration.
@@ -662,11 +687,7 @@ def compute_noise_model(
     offset_a, offset_b) of each channel.
   """
   noise_model = []
-  for pidx, samples_p in enumerate(samples):
-    gains, means, vars_ = zip(*samples_p)
-    gains = np.asarray(gains).flatten()
-    means = np.asarray(means).flatten()
-    vars_ = np.asarray(vars_).flatten()
+  for pidx, (gains, means, vars_) in enumerate(samples):
 
     compute_digital_gains(gains, sens_max_analog)
 
@@ -0,0 +1,72 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for noise_model_utils."""
+
+import unittest
+
+import numpy as np
+
+import noise_model_utils
+
+
+class NoiseModelUtilsTest(unittest.TestCase):
+  """Unit tests for this module."""
+
+  def test_filter_stats(self):
+    """Unit test for filtering and normalizing stats of all planes at once."""
+    white_level = 1064
+    black_levels = [64, 64]
+    means = np.array([[[64, 164], [1000, 50]],
+                      [[164, 264], [364, 464]]], dtype=float)
+    vars_ = np.array([[[100, 100], [100, 100]],
+                      [[100, -1], [100, 10000]]], dtype=float)
+    means_f, vars_f = noise_model_utils.filter_stats(
+        means, vars_, black_levels, white_level, max_signal_value=0.4)
+    # Plane 0: 1000 is clipped and 50 is below black level.
+    # Plane 1: -1 is a negative variance, and 464 + 2 * 100 is clipped.
+    self.assertEqual(len(means_f), 2)
+    np.testing.assert_allclose(means_f[0], [0, 0.1])
+    np.testing.assert_allclose(vars_f[0], [1e-4, 1e-4])
+    np.testing.assert_allclose(means_f[1], [0.1, 0.3])
+    np.testing.assert_allclose(vars_f[1], [1e-4, 1e-4])
+    np.testing.assert_array_equal(means_f.plane_indices(), [0, 0, 1, 1])
+
+  def test_measure_linear_noise_models(self):
+    """Unit test for fitting per plane models over exposures and old stats."""
+    def stats(offset):
+      means = [np.array([0.1, 0.2]), np.array([0.1, 0.2, 0.3])]
+      vars_ = [2 * m + offset for m in means]
+      return means, vars_
+
+    means, vars_ = stats(0.01)
+    iso_to_stats_dict = {
+        100: [(1.0, noise_model_utils.RaggedPlanes.from_planes(means),
+               noise_model_utils.RaggedPlanes.from_planes(vars_))],
+        # Stats saved as object arrays by older versions.
+        200: [(1.0, *[np.asarray(x, dtype=object) for x in stats(0.02)]),
+              (2.0, *[np.asarray(x, dtype=object) for x in stats(0.02)])],
+    }
+    measured_models, samples = noise_model_utils.measure_linear_noise_models(
+        iso_to_stats_dict, ['R', 'B'])
+    for pidx in range(2):
+      np.testing.assert_allclose(
+          measured_models[pidx], [(100, 2, 0.01), (200, 2, 0.02)], atol=1e-9)
+    isos, means_p, vars_p = samples[1]
+    np.testing.assert_array_equal(isos, [100] * 3 + [200] * 6)
+    np.testing.assert_allclose(means_p, [0.1, 0.2, 0.3] * 3)
+    np.testing.assert_allclose(vars_p[:3], [0.21, 0.41, 0.61])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,10 +14,13 @@
 """Image processing utilities using openCV."""
 
 
+import json
 import logging
 import math
 import os
 import pathlib
+import re
+import tempfile
 import cv2
 import numpy
 import scipy.spatial
@@ -43,6 +46,11 @@ CHART_SCALE_RTOL = 0.1
 CHART_SCALE_START = 0.65
 CHART_SCALE_STOP = 1.35
 CHART_SCALE_STEP = 0.025
+CHART_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'its_chart_locations')
+CHART_CACHE_OPT_VAL_RTOL = 0.1  # cached location kept if opt val within RTOL
+CHART_COARSE_SCALE = 0.25  # scene and chart scaling for coarse chart search
+CHART_REFINE_MARGIN = 16  # pixels searched around coarse chart location
+CHART_REFINE_STEPS = 1  # scale steps refined on each side of coarse scale
 
 CIRCLE_AR_ATOL = 0.1  # circle aspect ratio tolerance
 CIRCLISH_ATOL = 0.10  # contour area vs ideal circle area & aspect ratio TOL
@@ -225,6 +233,86 @@ def scale_img(img, scale=1.0):
   return cv2.resize(img.copy(), dim, interpolation=cv2.INTER_AREA)
 
 
+def _match_chart(scene_gray, chart, scale, top_left=None):
+  """Matches chart in a scaled scene.
+
+  Args:
+    scene_gray: numpy uint8 grayscale image of the scene.
+    chart: numpy uint8 grayscale chart template.
+    scale: float; scaling of scene_gray to chart size.
+    top_left: (Optional) (x, y) expected chart location in the scaled scene.
+      If set, only locations within CHART_REFINE_MARGIN pixels are searched.
+
+  Returns:
+    (opt_val, (x, y) top left of chart in the scaled scene), or None if the
+    scaled scene is smaller than the chart.
+  """
+  scene_scaled = scale_img(scene_gray, scale)
+  h, w = chart.shape
+  if scene_scaled.shape[0] < h or scene_scaled.shape[1] < w:
+    logging.debug(
+        'Skipped scale %.3f. scene_scaled shape: %s, chart shape: %s',
+        scale, scene_scaled.shape, chart.shape)
+    return None
+  x0 = y0 = 0
+  if top_left is not None:
+    x0 = int(numpy.clip(top_left[0] - CHART_REFINE_MARGIN, 0,
+                        scene_scaled.shape[1] - w))
+    y0 = int(numpy.clip(top_left[1] - CHART_REFINE_MARGIN, 0,
+                        scene_scaled.shape[0] - h))
+    scene_scaled = scene_scaled[y0:y0 + h + 2 * CHART_REFINE_MARGIN,
+                                x0:x0 + w + 2 * CHART_REFINE_MARGIN]
+  result = cv2.matchTemplate(scene_scaled, chart, cv2.TM_CCOEFF_NORMED)
+  _, opt_val, _, (x, y) = cv2.minMaxLoc(result)
+  return opt_val, (x + x0, y + y0)
+
+
+def find_chart_in_scene(scene_gray, chart, scales):
+  """Finds the best scale and location of chart in scene with a coarse search.
+
+  All scales are matched on the scene and chart scaled by CHART_COARSE_SCALE.
+  The best coarse scale and its CHART_REFINE_STEPS neighbors on each side are
+  then matched at full size, within CHART_REFINE_MARGIN pixels of the coarse
+  location.
+
+  Args:
+    scene_gray: numpy uint8 grayscale image of the scene.
+    chart: numpy uint8 grayscale chart template.
+    scales: list of float scalings of scene_gray to chart size.
+
+  Returns:
+    coarse_opt_vals: list of coarse match values of the matched scales.
+    match: (opt_val, scale, (x, y) top left of chart in the scene scaled by
+      scale) of the best match, or None if no scale could be matched.
+  """
+  chart_coarse = scale_img(chart, CHART_COARSE_SCALE)
+  coarse_matches = []
+  for i, scale in enumerate(scales):
+    coarse_match = _match_chart(
+        scene_gray, chart_coarse, scale * CHART_COARSE_SCALE)
+    if coarse_match:
+      logging.debug(' scale factor: %.3f, coarse opt val: %.3f',
+                    scale, coarse_match[0])
+      coarse_matches.append((coarse_match[0], i, coarse_match[1]))
+  if not coarse_matches:
+    return [], None
+
+  _, i_best, (x, y) = max(coarse_matches)
+  match = None
+  for scale in scales[max(i_best - CHART_REFINE_STEPS, 0):
+                      i_best + CHART_REFINE_STEPS + 1]:
+    # Scale coarse location to the full size scene at this scale
+    loc_scale = scale / (scales[i_best] * CHART_COARSE_SCALE)
+    fine_match = _match_chart(scene_gray, chart, scale,
+                              (round(x * loc_scale), round(y * loc_scale)))
+    if fine_match:
+      logging.debug(' scale factor: %.3f, opt val: %.3f',
+                    scale, fine_match[0])
+      if match is None or fine_match[0] > match[0]:
+        match = (fine_match[0], scale, fine_match[1])
+  return [m[0] for m in coarse_matches], match
+
+
 class Chart(object):
   """Definition for chart object.
 
@@ -242,7 +330,8 @@ class Chart(object):
       scale_start=None,
       scale_stop=None,
       scale_step=None,
-      rotation=None):
+      rotation=None,
+      scene=None):
     """Initial constructor for class.
 
     Args:
@@ -256,8 +345,12 @@ class Chart(object):
      scale_stop: float; stop value for scaling for chart search
      scale_step: float; step value for scaling for chart search
      rotation: clockwise rotation in degrees (multiple of 90) or None
+     scene: (Optional) str; scene name. If set, the chart location is cached
+       in CHART_CACHE_DIR per device, camera, scene and distance, and later
+       charts only verify the cached location with a single match.
     """
     self._file = chart_file or CHART_FILE
+    self._scene = scene
     if math.isclose(
         distance, CHART_DISTANCE_31CM, rel_tol=CHART_SCALE_RTOL):
       self._height = height or CHART_HEIGHT_31CM
@@ -271,6 +364,41 @@ class Chart(object):
     self.opt_val = None
     self.locate(cam, props, log_path, rotation)
 
+  def _get_cache_file(self, cam, rotation):
+    """Returns the chart location cache file for cam, or None if no scene."""
+    if not self._scene:
+      return None
+    # pylint: disable=protected-access
+    key = (f'{cam._device_id}_{cam._camera_id}_{cam._hidden_physical_id}_'
+           f'{cam._override_to_portrait}_{self._scene}_{self._distance:g}cm_'
+           f'{rotation}_{os.path.basename(self._file)}')
+    return os.path.join(CHART_CACHE_DIR, re.sub(r'[^\w.-]', '_', key) + '.json')
+
+  def _verify_cached_location(self, cache_file, scene_gray, chart):
+    """Matches chart once at the cached location.
+
+    Args:
+      cache_file: str; chart location cache file, or None.
+      scene_gray: numpy uint8 grayscale image of the scene.
+      chart: numpy uint8 grayscale chart template.
+
+    Returns:
+      (opt_val, scale, top_left_scaled) of the match, or None if there is no
+      cached location or the chart is not found there.
+    """
+    if not cache_file or not os.path.isfile(cache_file):
+      return None
+    with open(cache_file, 'r') as f:
+      cached = json.load(f)
+    match = _match_chart(
+        scene_gray, chart, cached['scale'], cached['top_left_scaled'])
+    if match is None or match[0] < cached['opt_val'] * (
+        1 - CHART_CACHE_OPT_VAL_RTOL):
+      logging.debug('Chart not found at cached location %s', cache_file)
+      return None
+    logging.debug('Verified cached chart location %s', cache_file)
+    return match[0], cached['scale'], match[1]
+
   def _set_scale_factors_to_one(self):
     """Set scale factors to 1.0 for skipped tests."""
     self.wnorm = 1.0
@@ -360,64 +488,64 @@ class Chart(object):
     logging.debug('scale start: %.3f, stop: %.3f, step: %.3f',
                   scale_start, scale_stop, scale_step)
     logging.debug('Used offset of %.3f to include stop value.', offset)
-    max_match = []
     # convert [0.0, 1.0] image to [0, 255] and then grayscale
     scene_uint8 = image_processing_utils.convert_image_to_uint8(scene)
     scene_gray = image_processing_utils.convert_rgb_to_grayscale(scene_uint8)
 
     # find scene
-    logging.debug('Finding chart in scene...')
-    for scale in numpy.arange(scale_start, scale_stop + offset, scale_step):
-      scene_scaled = scale_img(scene_gray, scale)
-      if (scene_scaled.shape[0] < chart.shape[0] or
-          scene_scaled.shape[1] < chart.shape[1]):
-        logging.debug(
-            'Skipped scale %.3f. scene_scaled shape: %s, chart shape: %s',
-            scale, scene_scaled.shape, chart.shape)
-        continue
-      result = cv2.matchTemplate(scene_scaled, chart, cv2.TM_CCOEFF_NORMED)
-      _, opt_val, _, top_left_scaled = cv2.minMaxLoc(result)
-      logging.debug(' scale factor: %.3f, opt val: %.3f', scale, opt_val)
-      max_match.append((opt_val, scale, top_left_scaled))
-
-    # determine if optimization results are valid
-    opt_values = [x[0] for x in max_match]
-    if not opt_values or (2.0 * min(opt_values) > max(opt_values)):
-      estring = ('Warning: unable to find chart in scene!\n'
-                 'Check camera distance and self-reported '
-                 'pixel pitch, focal length and hyperfocal distance.')
-      logging.warning(estring)
-      self._set_scale_factors_to_one()
-    else:
+    cache_file = self._get_cache_file(cam, rotation)
+    matched_scale_and_loc = self._verify_cached_location(
+        cache_file, scene_gray, chart)
+    if matched_scale_and_loc is None:
+      logging.debug('Finding chart in scene...')
+      opt_values, matched_scale_and_loc = find_chart_in_scene(
+          scene_gray, chart,
+          numpy.arange(scale_start, scale_stop + offset, scale_step))
+
+      # determine if optimization results are valid
+      if (matched_scale_and_loc is None or
+          2.0 * min(opt_values) > max(opt_values)):
+        estring = ('Warning: unable to find chart in scene!\n'
+                   'Check camera distance and self-reported '
+                   'pixel pitch, focal length and hyperfocal distance.')
+        logging.warning(estring)
+        self._set_scale_factors_to_one()
+        return
       if (max(opt_values) == opt_values[0] or
           max(opt_values) == opt_values[len(opt_values) - 1]):
         estring = ('Warning: Chart is at extreme range of locator.')
         logging.warning(estring)
-      # find max and draw bbox
-      matched_scale_and_loc = max(max_match, key=lambda x: x[0])
-      self.opt_val = matched_scale_and_loc[0]
-      self.scale = matched_scale_and_loc[1]
-      logging.debug('Optimum scale factor: %.3f', self.scale)
-      logging.debug('Opt val: %.3f', self.opt_val)
-      top_left_scaled = matched_scale_and_loc[2]
-      logging.debug('top_left_scaled: %d, %d', top_left_scaled[0],
-                    top_left_scaled[1])
-      h, w = chart.shape
-      bottom_right_scaled = (top_left_scaled[0] + w, top_left_scaled[1] + h)
-      logging.debug('bottom_right_scaled: %d, %d', bottom_right_scaled[0],
-                    bottom_right_scaled[1])
-      top_left = ((top_left_scaled[0] // self.scale),
-                  (top_left_scaled[1] // self.scale))
-      bottom_right = ((bottom_right_scaled[0] // self.scale),
-                      (bottom_right_scaled[1] // self.scale))
-      self.wnorm = ((bottom_right[0]) - top_left[0]) / scene.shape[1]
-      self.hnorm = ((bottom_right[1]) - top_left[1]) / scene.shape[0]
-      self.xnorm = (top_left[0]) / scene.shape[1]
-      self.ynorm = (top_left[1]) / scene.shape[0]
-      patch = image_processing_utils.get_image_patch(
-          scene_uint8, self.xnorm, self.ynorm, self.wnorm, self.hnorm) / 255
-      image_processing_utils.write_image(
-          patch, os.path.join(log_path, 'template_scene.jpg'))
+      if cache_file:
+        os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+        with open(cache_file, 'w') as f:
+          json.dump({'opt_val': matched_scale_and_loc[0],
+                     'scale': matched_scale_and_loc[1],
+                     'top_left_scaled': matched_scale_and_loc[2]}, f)
+
+    # find max and draw bbox
+    self.opt_val = matched_scale_and_loc[0]
+    self.scale = matched_scale_and_loc[1]
+    logging.debug('Optimum scale factor: %.3f', self.scale)
+    logging.debug('Opt val: %.3f', self.opt_val)
+    top_left_scaled = matched_scale_and_loc[2]
+    logging.debug('top_left_scaled: %d, %d', top_left_scaled[0],
+                  top_left_scaled[1])
+    h, w = chart.shape
+    bottom_right_scaled = (top_left_scaled[0] + w, top_left_scaled[1] + h)
+    logging.debug('bottom_right_scaled: %d, %d', bottom_right_scaled[0],
+                  bottom_right_scaled[1])
+    top_left = ((top_left_scaled[0] // self.scale),
+                (top_left_scaled[1] // self.scale))
+    bottom_right = ((bottom_right_scaled[0] // self.scale),
+                    (bottom_right_scaled[1] // self.scale))
+    self.wnorm = ((bottom_right[0]) - top_left[0]) / scene.shape[1]
+    self.hnorm = ((bottom_right[1]) - top_left[1]) / scene.shape[0]
+    self.xnorm = (top_left[0]) / scene.shape[1]
+    self.ynorm = (top_left[1]) / scene.shape[0]
+    patch = image_processing_utils.get_image_patch(
+        scene_uint8, self.xnorm, self.ynorm, self.wnorm, self.hnorm) / 255
+    image_processing_utils.write_image(
+        patch, os.path.join(log_path, 'template_scene.jpg'))
 
 
 def component_shape(contour):
@@ -431,19 +559,10 @@ def component_shape(contour):
     The most left, right, top, bottom pixel location, height, width, and
     the center pixel location of the contour.
   """
-  shape = {'left': numpy.inf, 'right': 0, 'top': numpy.inf, 'bottom': 0,
-           'width': 0, 'height': 0, 'ctx': 0, 'cty': 0}
-  for pt in contour:
-    if pt[0][0] < shape['left']:
-      shape['left'] = pt[0][0]
-    if pt[0][0] > shape['right']:
-      shape['right'] = pt[0][0]
-    if pt[0][1] < shape['top']:
-      shape['top'] = pt[0][1]
-    if pt[0][1] > shape['bottom']:
-      shape['bottom'] = pt[0][1]
-  shape['width'] = shape['right'] - shape['left'] + 1
-  shape['height'] = shape['bottom'] - shape['top'] + 1
+  left, top, width, height = cv2.boundingRect(contour)
+  shape = {'left': left, 'right': left + width - 1,
+           'top': top, 'bottom': top + height - 1,
+           'width': width, 'height': height}
   shape['ctx'] = (shape['left'] + shape['right']) // 2
   shape['cty'] = (shape['top'] + shape['bottom']) // 2
   return shape
@@ -459,152 +578,188 @@ def find_circle_fill_metric(shape, img_bw, color):
   Returns:
     float: number of x, y axis points matching color / total x, y axis points
   """
-  matching = 0
-  total = 0
-  for y in range(shape['top'], shape['bottom']):
-    total += 1
-    matching += 1 if img_bw[y][shape['ctx']] == color else 0
-  for x in range(shape['left'], shape['right']):
-    total += 1
-    matching += 1 if img_bw[shape['cty']][x] == color else 0
+  y_axis = img_bw[shape['top']:shape['bottom'], shape['ctx']]
+  x_axis = img_bw[shape['cty'], shape['left']:shape['right']]
+  matching = (numpy.count_nonzero(y_axis == color) +
+              numpy.count_nonzero(x_axis == color))
+  total = y_axis.size + x_axis.size
   logging.debug('Found %d matching points out of %d', matching, total)
   return matching / total
 
 
+def _screen_circle_contours(contours, min_circle_area, circlish_atol):
+  """Returns indices of contours shaped like circles, in contour order.
+
+  Contours are screened by area and number of points first, and the
+  remaining ones by circlish, aspect ratio and points per radius, with
+  array math over their areas and bounding rectangles.
+
+  Args:
+    contours: list of contours from find_all_contours.
+    min_circle_area: float; minimum contour area in pixels.
+    circlish_atol: float; tolerance of ideal circle area vs contour area.
+
+  Returns:
+    Array of contour indices.
+  """
+  if not contours:
+    return numpy.array([], dtype=int)
+  num_pts = numpy.array([len(contour) for contour in contours])
+  candidates = numpy.flatnonzero(num_pts >= CIRCLE_MIN_PTS)
+  areas = numpy.array([cv2.contourArea(contours[i]) for i in candidates])
+  candidates = candidates[areas > min_circle_area]
+  areas = areas[areas > min_circle_area]
+  if not candidates.size:
+    return candidates
+  rects = numpy.array([cv2.boundingRect(contours[i]) for i in candidates])
+  widths, heights = rects[:, 2], rects[:, 3]
+  radii = (widths + heights) / 4
+  circlish = numpy.pi * radii**2 / areas
+  aspect_ratios = widths / heights
+  keep = ((numpy.abs(1 - circlish) <= circlish_atol) &
+          (numpy.abs(1 - aspect_ratios) <= CIRCLE_AR_ATOL) &
+          (num_pts[candidates] / radii >= CIRCLE_RADIUS_NUMPTS_THRESH))
+  logging.debug('%d of %d contours above min area have a circle shape.',
+                numpy.count_nonzero(keep), candidates.size)
+  return candidates[keep]
+
+
+def _find_circles_in_binarized_image(img_bw, img_size, min_area, color,
+                                     circlish_atol):
+  """Finds up to two circles of color in a binarized image.
+
+  Args:
+    img_bw: binarized numpy image array.
+    img_size: shape of the input image.
+    min_area: float of minimum area of circle to find, relative to image.
+    color: int of [0 or 255] 0 is black, 255 is white
+    circlish_atol: float; tolerance of ideal circle area vs contour area.
+
+  Returns:
+    circle dict of the last circle found, and list of the circles' contours.
+  """
+  contours = find_all_contours(255-img_bw)
+  circle = {}
+  circle_contours = []
+  logging.debug('Initial number of contours: %d', len(contours))
+  min_circle_area = min_area * img_size[0] * img_size[1]
+  logging.debug('Screening out circles w/ radius < %.1f (pixels) or %d pts.',
+                math.sqrt(min_circle_area / math.pi), CIRCLE_MIN_PTS)
+  for i in _screen_circle_contours(contours, min_circle_area, circlish_atol):
+    contour = contours[i]
+    shape = component_shape(contour)
+    colour = img_bw[shape['cty']][shape['ctx']]
+    if colour != color:
+      continue
+    fill = find_circle_fill_metric(shape, img_bw, color)
+    logging.debug('Potential circle found. center: %d x %d, color: %d, '
+                  'pts: %d, fill metric: %.3f',
+                  shape['ctx'], shape['cty'], colour, len(contour), fill)
+    if not math.isclose(1.0, fill, abs_tol=CIRCLE_COLOR_ATOL):
+      continue
+    pts = contour.reshape(-1, 2)
+    radii = numpy.hypot(pts[:, 0] - shape['ctx'], pts[:, 1] - shape['cty'])
+    radius_spread = float(numpy.ptp(radii))
+    logging.debug('Minimum radius: %.2f, maximum radius: %.2f',
+                  radii.min(), radii.max())
+    if circle:
+      old_circle_center = (circle['x'], circle['y'])
+      new_circle_center = (shape['ctx'], shape['cty'])
+      # Based on image height
+      center_distance_atol = img_size[0]*CIRCLE_LOCATION_VARIATION_RTOL
+      if math.isclose(
+          image_processing_utils.distance(
+              old_circle_center, new_circle_center),
+          0,
+          abs_tol=center_distance_atol
+      ) and radius_spread < circle['radius_spread']:
+        logging.debug('Replacing the previously found circle. '
+                      'Circle located at %s has a smaller radius spread '
+                      'than the previously found circle at %s. '
+                      'Current radius spread: %.2f, '
+                      'previous radius spread: %.2f',
+                      new_circle_center, old_circle_center,
+                      radius_spread, circle['radius_spread'])
+        circle_contours.pop()
+    circle_contours.append(contour)
+
+    # Populate circle dictionary
+    circle['x'] = shape['ctx']
+    circle['y'] = shape['cty']
+    circle['r'] = (shape['width'] + shape['height']) / 4
+    circle['w'] = float(shape['width'])
+    circle['h'] = float(shape['height'])
+    circle['x_offset'] = (shape['ctx'] - img_size[1]//2) / circle['w']
+    circle['y_offset'] = (shape['cty'] - img_size[0]//2) / circle['h']
+    circle['radius_spread'] = radius_spread
+    logging.debug('Num pts: %d', len(contour))
+    logging.debug('Aspect ratio: %.3f', circle['w'] / circle['h'])
+    logging.debug('Circlish value: %.3f',
+                  math.pi * circle['r']**2 / cv2.contourArea(contour))
+    logging.debug('Location: %.1f x %.1f', circle['x'], circle['y'])
+    logging.debug('Radius: %.3f', circle['r'])
+    logging.debug('Circle center position wrt to image center: %.3fx%.3f',
+                  circle['x_offset'], circle['y_offset'])
+    # if more than one circle found, break
+    if len(circle_contours) == 2:
+      break
+  return circle, circle_contours
+
+
 def find_circle(img, img_name, min_area, color, use_adaptive_threshold=False):
   """Find the circle in the test image.
 
+  The image is binarized with a global threshold first, and with an adaptive
+  threshold if not exactly one circle is found. Both passes share one
+  grayscale conversion.
+
   Args:
     img: numpy image array in RGB, with pixel values in [0,255].
     img_name: string with image info of format and size.
     min_area: float of minimum area of circle to find
     color: int of [0 or 255] 0 is black, 255 is white
-    use_adaptive_threshold: True if binarization should use adaptive threshold.
+    use_adaptive_threshold: True if binarization should only use adaptive
+      threshold.
 
   Returns:
     circle = {'x', 'y', 'r', 'w', 'h', 'x_offset', 'y_offset'}
   """
-  circle = {}
   img_size = img.shape
   if img_size[0]*img_size[1] >= LOW_RES_IMG_THRESH:
     circlish_atol = CIRCLISH_ATOL
   else:
     circlish_atol = CIRCLISH_LOW_RES_ATOL
 
-  # convert to gray-scale image and binarize using adaptive/global threshold
-  if use_adaptive_threshold:
-    img_gray = cv2.cvtColor(img.astype(numpy.uint8), cv2.COLOR_BGR2GRAY)
-    img_bw = cv2.adaptiveThreshold(img_gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                   cv2.THRESH_BINARY, CV2_THRESHOLD_BLOCK_SIZE,
-                                   CV2_THRESHOLD_CONSTANT)
-  else:
-    img_gray = image_processing_utils.convert_rgb_to_grayscale(img)
-    img_bw = binarize_image(img_gray)
-
-  # find contours
-  contours = find_all_contours(255-img_bw)
-
-  # Check each contour and find the circle bigger than min_area
-  num_circles = 0
-  circle_contours = []
-  logging.debug('Initial number of contours: %d', len(contours))
-  min_circle_area = min_area * img_size[0] * img_size[1]
-  logging.debug('Screening out circles w/ radius < %.1f (pixels) or %d pts.',
-                math.sqrt(min_circle_area / math.pi), CIRCLE_MIN_PTS)
-  for contour in contours:
-    area = cv2.contourArea(contour)
-    num_pts = len(contour)
-    if (area > min_circle_area and num_pts >= CIRCLE_MIN_PTS):
-      shape = component_shape(contour)
-      radius = (shape['width'] + shape['height']) / 4
-      colour = img_bw[shape['cty']][shape['ctx']]
-      circlish = (math.pi * radius**2) / area
-      aspect_ratio = shape['width'] / shape['height']
-      fill = find_circle_fill_metric(shape, img_bw, color)
-      logging.debug('Potential circle found. radius: %.2f, color: %d, '
-                    'circlish: %.3f, ar: %.3f, pts: %d, fill metric: %.3f',
-                    radius, colour, circlish, aspect_ratio, num_pts, fill)
-      if (colour == color and
-          math.isclose(1.0, circlish, abs_tol=circlish_atol) and
-          math.isclose(1.0, aspect_ratio, abs_tol=CIRCLE_AR_ATOL) and
-          num_pts/radius >= CIRCLE_RADIUS_NUMPTS_THRESH and
-          math.isclose(1.0, fill, abs_tol=CIRCLE_COLOR_ATOL)):
-        radii = [
-            image_processing_utils.distance(
-                (shape['ctx'], shape['cty']), numpy.squeeze(point))
-            for point in contour
-        ]
-        minimum_radius, maximum_radius = min(radii), max(radii)
-        logging.debug('Minimum radius: %.2f, maximum radius: %.2f',
-                      minimum_radius, maximum_radius)
-        if circle:
-          old_circle_center = (circle['x'], circle['y'])
-          new_circle_center = (shape['ctx'], shape['cty'])
-          # Based on image height
-          center_distance_atol = img_size[0]*CIRCLE_LOCATION_VARIATION_RTOL
-          if math.isclose(
-              image_processing_utils.distance(
-                  old_circle_center, new_circle_center),
-              0,
-              abs_tol=center_distance_atol
-          ) and maximum_radius - minimum_radius < circle['radius_spread']:
-            logging.debug('Replacing the previously found circle. '
-                          'Circle located at %s has a smaller radius spread '
-                          'than the previously found circle at %s. '
-                          'Current radius spread: %.2f, '
-                          'previous radius spread: %.2f',
-                          new_circle_center, old_circle_center,
-                          maximum_radius - minimum_radius,
-                          circle['radius_spread'])
-            circle_contours.pop()
-            circle = {}
-            num_circles -= 1
-        circle_contours.append(contour)
-
-        # Populate circle dictionary
-        circle['x'] = shape['ctx']
-        circle['y'] = shape['cty']
-        circle['r'] = (shape['width'] + shape['height']) / 4
-        circle['w'] = float(shape['width'])
-        circle['h'] = float(shape['height'])
-        circle['x_offset'] = (shape['ctx'] - img_size[1]//2) / circle['w']
-        circle['y_offset'] = (shape['cty'] - img_size[0]//2) / circle['h']
-        circle['radius_spread'] = maximum_radius - minimum_radius
-        logging.debug('Num pts: %d', num_pts)
-        logging.debug('Aspect ratio: %.3f', aspect_ratio)
-        logging.debug('Circlish value: %.3f', circlish)
-        logging.debug('Location: %.1f x %.1f', circle['x'], circle['y'])
-        logging.debug('Radius: %.3f', circle['r'])
-        logging.debug('Circle center position wrt to image center: %.3fx%.3f',
-                      circle['x_offset'], circle['y_offset'])
-        num_circles += 1
-        # if more than one circle found, break
-        if num_circles == 2:
-          break
-
-  if num_circles == 0:
-    image_processing_utils.write_image(img/255, img_name, True)
-    if not use_adaptive_threshold:
-      return find_circle(
-          img, img_name, min_area, color, use_adaptive_threshold=True)
+  img_gray = image_processing_utils.convert_rgb_to_grayscale(img)
+  adaptive_passes = (True,) if use_adaptive_threshold else (False, True)
+  for adaptive in adaptive_passes:
+    # binarize using adaptive/global threshold
+    if adaptive:
+      img_bw = cv2.adaptiveThreshold(
+          numpy.uint8(img_gray), 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+          cv2.THRESH_BINARY, CV2_THRESHOLD_BLOCK_SIZE, CV2_THRESHOLD_CONSTANT)
     else:
-      raise AssertionError('No circle detected. '
-                           'Please take pictures according to instructions.')
+      img_bw = binarize_image(img_gray)
+    circle, circle_contours = _find_circles_in_binarized_image(
+        img_bw, img_size, min_area, color, circlish_atol)
+    if len(circle_contours) == 1:
+      return circle
 
-  if num_circles > 1:
     image_processing_utils.write_image(img/255, img_name, True)
-    cv2.drawContours(img, circle_contours, -1, CV2_RED,
-                     CV2_LINE_THICKNESS)
-    img_name_parts = img_name.split('.')
-    image_processing_utils.write_image(
-        img/255, f'{img_name_parts[0]}_contours.{img_name_parts[1]}', True)
-    if not use_adaptive_threshold:
-      return find_circle(
-          img, img_name, min_area, color, use_adaptive_threshold=True)
-    raise AssertionError('More than 1 circle detected. '
-                         'Background of scene may be too complex.')
+    if circle_contours:
+      img_contours = img.copy()
+      cv2.drawContours(img_contours, circle_contours, -1, CV2_RED,
+                       CV2_LINE_THICKNESS)
+      img_name_parts = img_name.split('.')
+      image_processing_utils.write_image(
+          img_contours/255,
+          f'{img_name_parts[0]}_contours.{img_name_parts[1]}', True)
 
-  return circle
+  if not circle_contours:
+    raise AssertionError('No circle detected. '
+                         'Please take pictures according to instructions.')
+  raise AssertionError('More than 1 circle detected. '
+                       'Background of scene may be too complex.')
 
 
 def append_circle_center_to_img(circle, img, img_name, save_img=True):
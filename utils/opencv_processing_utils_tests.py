@@ -19,6 +19,7 @@ import os
 import unittest
 
 import cv2
+import numpy
 
 import opencv_processing_utils
 
@@ -72,6 +73,50 @@ class Cv2ImageProcessingUtilsTests(unittest.TestCase):
 
     self.assertEqual(len(test_fails), 0, test_fails)
 
+  def test_find_chart_in_scene(self):
+    """Unit test for coarse to fine chart search and cached location match."""
+    chart = cv2.imread(opencv_processing_utils.CHART_FILE, cv2.IMREAD_ANYDEPTH)
+    chart_h = chart.shape[0]
+    scene = numpy.full((opencv_processing_utils.VGA_HEIGHT,
+                        opencv_processing_utils.VGA_WIDTH), 120, numpy.uint8)
+    scene_chart_h = 260
+    scene_chart = opencv_processing_utils.scale_img(
+        chart, scene_chart_h / chart_h)
+    x, y = 150, 120
+    scene[y:y + scene_chart.shape[0], x:x + scene_chart.shape[1]] = scene_chart
+    scale_factor = chart_h / 280  # locator estimate of the chart size
+    scales = numpy.arange(
+        opencv_processing_utils.CHART_SCALE_START,
+        opencv_processing_utils.CHART_SCALE_STOP,
+        opencv_processing_utils.CHART_SCALE_STEP) * scale_factor
+
+    opt_values, (opt_val, scale, top_left_scaled) = (
+        opencv_processing_utils.find_chart_in_scene(scene, chart, scales))
+    self.assertLess(2 * min(opt_values), max(opt_values))
+    self.assertGreater(opt_val, 0.9)
+    self.assertAlmostEqual(scale, chart_h / scene_chart_h, delta=0.1)
+    self.assertAlmostEqual(top_left_scaled[0] / scale, x, delta=1)
+    self.assertAlmostEqual(top_left_scaled[1] / scale, y, delta=1)
+
+    # A location search around the result finds the same match
+    match_val, match_loc = opencv_processing_utils._match_chart(
+        scene, chart, scale, (top_left_scaled[0] + 5, top_left_scaled[1]))
+    self.assertAlmostEqual(match_val, opt_val, places=4)
+    self.assertEqual(match_loc, top_left_scaled)
+
+  def test_find_circle(self):
+    """Unit test for circle screening on a scene4-like image."""
+    img = numpy.full((opencv_processing_utils.VGA_HEIGHT,
+                      opencv_processing_utils.VGA_WIDTH, 3), 255.0)
+    cv2.circle(img, (340, 250), 100, opencv_processing_utils.CV2_BLACK, -1)
+    # Squares near the corners are not circles
+    for x, y in ((20, 20), (560, 400)):
+      img[y:y + 60, x:x + 60] = 0
+    circle = opencv_processing_utils.find_circle(img, 'circle.png', 0.01, 0)
+    self.assertEqual((circle['x'], circle['y']), (340, 250))
+    self.assertAlmostEqual(circle['r'], 100, delta=1)
+    self.assertLess(circle['radius_spread'], 3)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -15,7 +15,7 @@
 """
 
 import cv2
-import fnmatch
+import itertools
 import logging
 import os
 import threading
@@ -24,7 +24,6 @@ import time
 import numpy as np
 
 import its_session_utils
-import image_processing_utils
 import sensor_fusion_utils
 import video_processing_utils
 
@@ -204,20 +203,13 @@ def verify_preview_stabilization(recording_obj, gyro_events,
   video_size = recording_obj['videoSize']
   logging.debug('video size: %s', video_size)
 
-  # Get all frames from the video
-  file_list = video_processing_utils.extract_all_frames_from_video(
-      log_path, file_name, _IMG_FORMAT
-  )
-  frames = []
-
-  logging.debug('Number of frames %d', len(file_list))
-  for file in file_list:
-    img = image_processing_utils.convert_image_to_numpy_array(
-        os.path.join(log_path, file)
-    )
-    frames.append(img / 255)
-  frame_h, frame_w, _ = frames[0].shape
+  # Stream frames from the video, skipping frames before 3A is converged
+  frame_w, frame_h = video_processing_utils.get_video_frame_size(
+      os.path.join(log_path, file_name))
   logging.debug('Frame size %d x %d', frame_w, frame_h)
+  frames = itertools.islice(
+      video_processing_utils.iter_video_frames(log_path, file_name),
+      _START_FRAME, None)
 
   # Extract camera rotations
   if zoom_ratio:
@@ -227,7 +219,7 @@ def verify_preview_stabilization(recording_obj, gyro_events,
   file_name_stem = (
       f'{os.path.join(log_path, test_name)}_{video_size}_{zoom_ratio_suffix}x')
   cam_rots = sensor_fusion_utils.get_cam_rotations(
-      frames[_START_FRAME:],
+      frames,
       facing,
       frame_h,
       file_name_stem,
@@ -272,20 +264,11 @@ def verify_preview_stabilization(recording_obj, gyro_events,
         f'Max gyro angle: {max_gyro_angle:.3f}, '
         f'ratio: {max_camera_angle/max_gyro_angle:.3f} '
         f'THRESH: {preview_stabilization_factor}.')
-  # Delete saved frames if the format is a PASS
+    # Save frame images for debugging only if the format is a FAIL
+    video_processing_utils.extract_all_frames_from_video(
+        log_path, file_name, _IMG_FORMAT)
   else:
-    try:
-      tmpdir = os.listdir(log_path)
-    except FileNotFoundError:
-      logging.debug('Tmp directory: %s not found', log_path)
-    for file in tmpdir:
-      if fnmatch.fnmatch(file, f'*_{video_size}_stabilized_frame_*'):
-        file_to_remove = os.path.join(log_path, file)
-        try:
-          os.remove(file_to_remove)
-        except FileNotFoundError:
-          logging.debug('File Not Found: %s', str(file))
-    logging.debug('Format %s passes, frame images removed', video_size)
+    logging.debug('Format %s passes', video_size)
 
   return {'gyro': max_gyro_angle, 'cam': max_camera_angle,
           'failure': failure_msg}
@@ -445,39 +428,52 @@ def mirror_preview_image_by_sensor_orientation(
   return output_preview_img
 
 
-def is_image_green(image_path):
-  """Checks if an image is mostly green.
+def is_frame_green(frame):
+  """Checks if a frame is mostly green.
 
-  Checks if an image is mostly green by ensuring green is dominant
+  Checks if a frame is mostly green by ensuring green is dominant
   and red/blue values are low.
 
   Args:
-    image_path: str; The path to the image file.
+    frame: numpy uint8 array of shape (h, w, 3) in RGB order.
 
   Returns:
     bool: True if mostly green, False otherwise.
   """
+  red_value, green_value, blue_value = np.mean(frame, axis=(0, 1))
+
+  # Check if green is dominant and red/blue are below the threshold
+  return bool(green_value > _GREEN_TOL and
+              red_value < _RED_BLUE_TOL and
+              blue_value < _RED_BLUE_TOL)
 
-  image = cv2.imread(image_path)
 
-  average_color = np.mean(image, axis=(0, 1))
+def is_image_green(image_path):
+  """Checks if an image is mostly green.
 
-  # Extract individual color values
-  blue_value = average_color[0]
-  green_value = average_color[1]
-  red_value = average_color[2]
+  Args:
+    image_path: str; The path to the image file.
+
+  Returns:
+    bool: True if mostly green, False otherwise.
+  """
+  image = cv2.imread(image_path)
+  return is_frame_green(image[:, :, ::-1])
 
-  # Check if green is dominant and red/blue are below the threshold
-  if (green_value > _GREEN_TOL and
-      red_value < _RED_BLUE_TOL and
-      blue_value < _RED_BLUE_TOL):
-    return True
-  else:
-    return False
+
+def _iter_preview_frames(log_path, video_file_name, start, stop):
+  """Yields (file name, frame number, RGB frame) for frames [start, stop)."""
+  frames = itertools.islice(
+      video_processing_utils.iter_video_frames(log_path, video_file_name),
+      start, stop)
+  for frame_number, frame in enumerate(frames, start + 1):
+    file_name = video_processing_utils.get_frame_file_name(
+        video_file_name, frame_number, _IMG_FORMAT)
+    yield file_name, frame_number, frame
 
 
 def preview_over_zoom_range(dut, cam, preview_size, z_min, z_max, z_step_size,
-                            log_path):
+                            log_path, stream_frames=False):
   """Captures a preview video from the device over zoom range.
 
   Captures camera preview frames at various zoom level in zoom range.
@@ -490,10 +486,15 @@ def preview_over_zoom_range(dut, cam, preview_size, z_min, z_max, z_step_size,
     z_max: maximum zoom for preview capture
     z_step_size: zoom step size from min to max
     log_path: str; path for video file directory
+    stream_frames: bool; return a generator of decoded frames instead of
+      writing frame image files.
 
   Returns:
     capture_results: total capture results of each frame
-    file_list: file name for each frame
+    file_list: file name for each frame, or if stream_frames is True, a
+      generator of (file name, RGB numpy uint8 frame) for each frame. The
+      generator reuses one frame buffer, and the file names are only for
+      logging and debug images.
   """
   logging.debug('z_min : %.2f, z_max = %.2f, z_step_size = %.2f',
                 z_min, z_max, z_step_size)
@@ -518,58 +519,42 @@ def preview_over_zoom_range(dut, cam, preview_size, z_min, z_max, z_step_size,
   logging.debug('recorded video size : %s',
                 str(preview_rec_obj['videoSize']))
 
-  # Extract frames as png from mp4 preview recording
-  file_list = video_processing_utils.extract_all_frames_from_video(
-      log_path, preview_file_name, _IMG_FORMAT
-  )
-
-  first_camera_frame_idx = 0
-  last_camera_frame_idx = len(file_list)
-
-  # Find index of the first-non green frame
-  for (idx, file_name) in enumerate(file_list):
-    file_path = os.path.join(log_path, file_name)
-    if is_image_green(file_path):
-      its_session_utils.remove_file(file_path)
-      logging.debug('Removed green file %s', file_name)
-    else:
-      logging.debug('First camera frame: %s', file_name)
-      first_camera_frame_idx = idx
-      break
-
-  # Find index of last non-green frame
-  for (idx, file_name) in reversed(list(enumerate(file_list))):
-    file_path = os.path.join(log_path, file_name)
-    if is_image_green(file_path):
-      its_session_utils.remove_file(file_path)
-      logging.debug('Removed green file %s', file_name)
-    else:
-      logging.debug('Last camera frame: %s', file_name)
-      last_camera_frame_idx = idx
-      break
-
+  # Find the first and last non-green frames of the mp4 preview recording
+  camera_frame_idxs = np.flatnonzero([
+      not is_frame_green(frame) for frame in
+      video_processing_utils.iter_video_frames(log_path, preview_file_name)])
+  if camera_frame_idxs.size:
+    first_camera_frame_idx = camera_frame_idxs[0]
+    last_camera_frame_idx = camera_frame_idxs[-1]
+  else:
+    first_camera_frame_idx, last_camera_frame_idx = 0, -1
   logging.debug('start idx = %d -- end idx = %d', first_camera_frame_idx,
                 last_camera_frame_idx)
-  file_list = file_list[first_camera_frame_idx:last_camera_frame_idx+1]
+  num_frames = last_camera_frame_idx - first_camera_frame_idx + 1
 
   # Raise error if capture result and frame count doesn't match
   capture_results = preview_rec_obj['captureMetadata']
-  extra_capture_result_count = len(capture_results) - len(file_list)
-  logging.debug('Number of frames %d', len(file_list))
+  extra_capture_result_count = len(capture_results) - num_frames
+  logging.debug('Number of frames %d', num_frames)
   if extra_capture_result_count != 0:
-    its_session_utils.remove_frame_files(log_path)
     e_msg = (f'Number of CaptureResult ({len(capture_results)}) '
-             f'vs number of Frames ({len(file_list)}) count mismatch.'
+             f'vs number of Frames ({num_frames}) count mismatch.'
              ' Retry Test.')
     raise AssertionError(e_msg)
 
   # skip frames which might not have 3A converged
   capture_results = capture_results[_SKIP_INITIAL_FRAMES:]
-  skipped_files = file_list[:_SKIP_INITIAL_FRAMES]
-  file_list = file_list[_SKIP_INITIAL_FRAMES:]
-
-  # delete skipped files
-  for file_name in skipped_files:
-    its_session_utils.remove_file(os.path.join(log_path, file_name))
-
+  frames = _iter_preview_frames(
+      log_path, preview_file_name,
+      first_camera_frame_idx + _SKIP_INITIAL_FRAMES, last_camera_frame_idx + 1)
+  if stream_frames:
+    return capture_results, ((file_name, frame)
+                             for file_name, _, frame in frames)
+
+  # Write png files only for the frames returned
+  file_list = []
+  for file_name, frame_number, frame in frames:
+    video_processing_utils.write_frame(
+        frame, log_path, preview_file_name, frame_number, _IMG_FORMAT)
+    file_list.append(file_name)
   return capture_results, file_list
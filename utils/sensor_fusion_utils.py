@@ -14,8 +14,9 @@
 """Utility functions for sensor_fusion hardware rig."""
 
 
-import bisect
 import codecs
+import concurrent.futures
+import functools
 import logging
 import math
 import os
@@ -26,12 +27,12 @@ import cv2
 from matplotlib import pylab
 import matplotlib.pyplot
 import numpy as np
-import scipy.spatial
 import serial
 from serial.tools import list_ports
 
 import camera_properties_utils
 import image_processing_utils
+import imu_processing_utils
 
 # Constants for Rotation Rig
 ARDUINO_ANGLE_MAX = 180.0  # degrees
@@ -74,6 +75,7 @@ HS755HB_ANGLE_MAX = 202.0  # throw for rotation motor in degrees
 _FEATURE_MARGIN = 0.20  # Only take feature points from center 20% so that
                         # rotation measured has less rolling shutter effect.
 _FEATURE_PTS_MIN = 30  # Min number of feature pts to perform rotation analysis.
+_CAM_ROTATIONS_CHUNK_SIZE = 8  # frame pairs per thread pool task
 # cv2.goodFeatures to track.
 # 'POSTMASK' is the measurement method in all previous versions of Android.
 # 'POSTMASK' finds best features on entire frame and then masks the features
@@ -394,6 +396,67 @@ def calc_max_rotation_angle(rotations, sensor_type):
   return rotation_max-rotation_min
 
 
+def _get_cumulative_gyro_rotations(gyro_events):
+  """Integrates the gyro z rate over time.
+
+  Each gyro sample holds its rate over the interval since the previous sample,
+  so the integral is piecewise linear between sample times.
+
+  Args:
+    gyro_events: SensorTrace or list of gyro event objects.
+
+  Returns:
+    Arrays of gyro times (ns), rates (rads/s), and cumulative rotations (rads)
+    at those times.
+  """
+  gyro_trace = imu_processing_utils.get_sensor_trace(gyro_events)
+  gyro_times = gyro_trace['time']
+  all_gyro_rots = gyro_trace['z'].astype(float)
+  gyro_cum_rots = np.zeros(len(gyro_times))
+  np.cumsum(all_gyro_rots[1:] * np.diff(gyro_times) * _NSEC_TO_SEC,
+            out=gyro_cum_rots[1:])
+  return gyro_times, all_gyro_rots, gyro_cum_rots
+
+
+def _interpolate_gyro_rotations(gyro_times, all_gyro_rots, gyro_cum_rots,
+                                cam_times):
+  """Returns the gyro rotations between consecutive camera times.
+
+  The rotation over a window is the cumulative rotation at its end minus
+  that at its start. The start is interpolated in its gyro interval. The end
+  is taken back from the first gyro sample after it at the rate of the
+  sample following that one, matching the per-sample integration this
+  replaces.
+
+  Args:
+    gyro_times: Array of gyro times (ns).
+    all_gyro_rots: Array of gyro rates (rads/s) at gyro_times.
+    gyro_cum_rots: Array of cumulative gyro rotations (rads) at gyro_times.
+    cam_times: Array of camera times with N times in the last axis; extra
+      leading axes evaluate several sets of camera times at once.
+
+  Returns:
+    Array of N-1 gyro rotations in the last axis.
+  """
+  if gyro_times[0] > np.min(cam_times) or gyro_times[-1] < np.max(cam_times):
+    raise AssertionError('Gyro times do not bound camera times! '
+                         f'gyro: {gyro_times[0]:.0f} -> {gyro_times[-1]:.0f} '
+                         f'cam: {np.min(cam_times)} -> {np.max(cam_times)} '
+                         '(ns).')
+  # Work relative to the first gyro time to keep ns precision.
+  rel_gyro_times = gyro_times - gyro_times[0]
+  rel_cam_times = cam_times - gyro_times[0]
+  start_rots = np.interp(
+      rel_cam_times[..., :-1], rel_gyro_times, gyro_cum_rots)
+  end_times = rel_cam_times[..., 1:]
+  i_gyro = np.searchsorted(rel_gyro_times, end_times, side='right')
+  i_gyro = np.minimum(i_gyro, len(gyro_times) - 1)
+  i_rate = np.minimum(i_gyro + 1, len(gyro_times) - 1)
+  end_rots = (gyro_cum_rots[i_gyro] - all_gyro_rots[i_rate] *
+              (rel_gyro_times[i_gyro] - end_times) * _NSEC_TO_SEC)
+  return end_rots - start_rots
+
+
 def get_gyro_rotations(gyro_events, cam_times):
   """Get the rotation values of the gyro.
 
@@ -401,55 +464,21 @@ def get_gyro_rotations(gyro_events, cam_times):
   displacement.
 
   Args:
-    gyro_events: List of gyro event objects.
+    gyro_events: SensorTrace or list of gyro event objects.
     cam_times: Array of N camera times, one for each frame.
 
   Returns:
     Array of N-1 gyro rotation measurements (rads/s).
   """
-  gyro_times = np.array([e['time'] for e in gyro_events])
-  all_gyro_rots = np.array([e['z'] for e in gyro_events])
-  gyro_rots = []
-  if gyro_times[0] > cam_times[0] or gyro_times[-1] < cam_times[-1]:
-    raise AssertionError('Gyro times do not bound camera times! '
-                         f'gyro: {gyro_times[0]:.0f} -> {gyro_times[-1]:.0f} '
-                         f'cam: {cam_times[0]} -> {cam_times[-1]} (ns).')
-
-  # Integrate the gyro data between each pair of camera frame times.
-  for i_cam in range(len(cam_times)-1):
-    # Get the window of gyro samples within the current pair of frames.
-    # Note: bisect always picks first gyro index after camera time.
-    t_cam0 = cam_times[i_cam]
-    t_cam1 = cam_times[i_cam+1]
-    i_gyro_window0 = bisect.bisect(gyro_times, t_cam0)
-    i_gyro_window1 = bisect.bisect(gyro_times, t_cam1)
-    gyro_sum = 0
-
-    # Integrate samples within the window.
-    for i_gyro in range(i_gyro_window0, i_gyro_window1):
-      gyro_val = all_gyro_rots[i_gyro+1]
-      t_gyro0 = gyro_times[i_gyro]
-      t_gyro1 = gyro_times[i_gyro+1]
-      t_gyro_delta = (t_gyro1 - t_gyro0) * _NSEC_TO_SEC
-      gyro_sum += gyro_val * t_gyro_delta
-
-    # Handle the fractional intervals at the sides of the window.
-    for side, i_gyro in enumerate([i_gyro_window0-1, i_gyro_window1]):
-      gyro_val = all_gyro_rots[i_gyro+1]
-      t_gyro0 = gyro_times[i_gyro]
-      t_gyro1 = gyro_times[i_gyro+1]
-      t_gyro_delta = (t_gyro1 - t_gyro0) * _NSEC_TO_SEC
-      if side == 0:
-        f = (t_cam0 - t_gyro0) / (t_gyro1 - t_gyro0)
-        frac_correction = gyro_val * t_gyro_delta * (1.0 - f)
-        gyro_sum += frac_correction
-      else:
-        f = (t_cam1 - t_gyro0) / (t_gyro1 - t_gyro0)
-        frac_correction = gyro_val * t_gyro_delta * f
-        gyro_sum += frac_correction
-    gyro_rots.append(gyro_sum)
-  gyro_rots = np.array(gyro_rots)
-  return gyro_rots
+  return _interpolate_gyro_rotations(
+      *_get_cumulative_gyro_rotations(gyro_events), np.asarray(cam_times))
+
+
+def _correlation_distances(u, v):
+  """Returns scipy.spatial.distance.correlation(u, v_i) for each row v_i."""
+  u = u - np.mean(u)
+  v = v - np.mean(v, axis=-1, keepdims=True)
+  return 1.0 - (v @ u) / (np.linalg.norm(u) * np.linalg.norm(v, axis=-1))
 
 
 def procrustes_rotation(x, y):
@@ -473,6 +502,83 @@ def procrustes_rotation(x, y):
   return np.dot(vt.T, u.T)
 
 
+def _get_pair_rotation(gframe0, gframe1, facing, masking, ymin, ymax):
+  """Measures the camera rotation between two grayscale frames.
+
+  Args:
+    gframe0: grayscale numpy uint8 image of the first frame.
+    gframe1: grayscale numpy uint8 image of the second frame.
+    facing: Direction camera is facing.
+    masking: str; 'post' or 'pre' feature masking method.
+    ymin: int; top row of the feature margin.
+    ymax: int; bottom row of the feature margin.
+
+  Returns:
+    (rotation, features, tracked features) where features are found in
+    gframe0 and tracked features are those found again in gframe1. rotation
+    and tracked features are None if there are too few features.
+  """
+  if masking == 'post':
+    p0 = cv2.goodFeaturesToTrack(
+        gframe0, mask=None, **_CV2_FEATURE_PARAMS_POSTMASK)
+    post_mask = (p0[:, 0, 1] >= ymin) & (p0[:, 0, 1] <= ymax)
+    p0_filtered = p0[post_mask]
+  else:
+    pre_mask = np.zeros_like(gframe0)
+    pre_mask[ymin:ymax, :] = 255
+    p0_filtered = cv2.goodFeaturesToTrack(
+        gframe0, mask=pre_mask, **_CV2_FEATURE_PARAMS_PREMASK)
+  if len(p0_filtered) < _FEATURE_PTS_MIN:
+    return None, p0_filtered, None
+  p1, st, _ = cv2.calcOpticalFlowPyrLK(gframe0, gframe1, p0_filtered, None,
+                                       **_CV2_LK_PARAMS)
+  tform = procrustes_rotation(p0_filtered[st == 1], p1[st == 1])
+  if facing == camera_properties_utils.LENS_FACING['BACK']:
+    rotation = -math.atan2(tform[0, 1], tform[0, 0])
+  elif facing == camera_properties_utils.LENS_FACING['FRONT']:
+    rotation = math.atan2(tform[0, 1], tform[0, 0])
+  else:
+    raise AssertionError(f'Unknown lens facing: {facing}.')
+  return rotation, p0_filtered, p0_filtered[st == 1]
+
+
+def _get_pair_rotations(gframes, pair_idxs, maskings, facing, ymin, ymax):
+  """Measures rotations of frame pairs (j, j+1) for j in pair_idxs.
+
+  Runs in a worker thread; cv2 releases the GIL while it works.
+
+  Args:
+    gframes: list of grayscale numpy uint8 images.
+    pair_idxs: list of int; index of the first frame of each pair.
+    maskings: tuple of masking methods tried in order for each pair until
+      one finds enough features.
+    facing: Direction camera is facing.
+    ymin: int; top row of the feature margin.
+    ymax: int; bottom row of the feature margin.
+
+  Returns:
+    List of dicts of masking method to _get_pair_rotation result per pair.
+  """
+  results = []
+  for j in pair_idxs:
+    pair_results = {}
+    for masking in maskings:
+      pair_results[masking] = _get_pair_rotation(
+          gframes[j], gframes[j+1], facing, masking, ymin, ymax)
+      if pair_results[masking][0] is not None:
+        break
+    results.append(pair_results)
+  return results
+
+
+def _write_features_image(gframe, features, file_name):
+  """Saves a debug image of features drawn on a grayscale frame."""
+  frame = cv2.cvtColor(gframe, cv2.COLOR_GRAY2RGB)
+  for x, y in np.rint(features.reshape(-1, 2)).astype(int):
+    cv2.circle(frame, (x, y), 3, (100, 255, 255), -1)
+  image_processing_utils.write_image(frame / 255, file_name)
+
+
 def get_cam_rotations(frames, facing, h, file_name_stem,
                       start_frame, stabilized_video=False):
   """Get the rotations of the camera between each pair of frames.
@@ -485,8 +591,18 @@ def get_cam_rotations(frames, facing, h, file_name_stem,
   Uses FEATURE_PARAMS for cv2 to identify features in checkerboard images.
   Ensures camera rotates enough if not calling with stabilized video.
 
+  Frames are converted to grayscale as they are read, so frames can be a
+  generator of decoded video frames that reuses one buffer. Feature debug
+  images are drawn on the grayscale frames.
+
+  Frame pairs are measured in chunks on a thread pool. Post-masking is used
+  for all pairs if it finds enough features in every pair, else pre-masking
+  is used for all pairs. A pair that fails post-masking is measured with
+  pre-masking right away, and the other pairs only if any pair failed.
+
   Args:
-    frames: List of N images (as RGB numpy arrays).
+    frames: Iterable of N images (as RGB numpy arrays, float [0, 1] or
+      uint8 [0, 255]).
     facing: Direction camera is facing.
     h: Pixel height of each frame.
     file_name_stem: file name stem including location for data.
@@ -496,75 +612,67 @@ def get_cam_rotations(frames, facing, h, file_name_stem,
   Returns:
     numpy array of N-1 camera rotation measurements (rad).
   """
+  stage_start_time = time.time()
+  timings = {}
   gframes = []
   for frame in frames:
-    frame = (frame * 255.0).astype(np.uint8)  # cv2 uses [0, 255]
+    if frame.dtype != np.uint8:
+      frame = (frame * 255.0).astype(np.uint8)  # cv2 uses [0, 255]
     gframes.append(cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY))
   num_frames = len(gframes)
   logging.debug('num_frames: %d', num_frames)
-  # create mask
+  timings['grayscale'] = time.time() - stage_start_time
+  # feature margin
   ymin = int(h * (1 - _FEATURE_MARGIN) / 2)
   ymax = int(h * (1 + _FEATURE_MARGIN) / 2)
-  pre_mask = np.zeros_like(gframes[0])
-  pre_mask[ymin:ymax, :] = 255
-
-  for masking in ['post', 'pre']:  # Do post-masking (original) method 1st
-    logging.debug('Using %s masking method', masking)
-    rotations = []
-    for i in range(1, num_frames):
-      j = i - 1
-      gframe0 = gframes[j]
-      gframe1 = gframes[i]
-      if masking == 'post':
-        p0 = cv2.goodFeaturesToTrack(
-            gframe0, mask=None, **_CV2_FEATURE_PARAMS_POSTMASK)
-        post_mask = (p0[:, 0, 1] >= ymin) & (p0[:, 0, 1] <= ymax)
-        p0_filtered = p0[post_mask]
-      else:
-        p0_filtered = cv2.goodFeaturesToTrack(
-            gframe0, mask=pre_mask, **_CV2_FEATURE_PARAMS_PREMASK)
-      num_features = len(p0_filtered)
-      if num_features < _FEATURE_PTS_MIN:
-        for pt in np.rint(p0_filtered).astype(int):
-          x, y = pt[0][0], pt[0][1]
-          cv2.circle(frames[j], (x, y), 3, (100, 255, 255), -1)
-        image_processing_utils.write_image(
-            frames[j], f'{file_name_stem}_features{j+start_frame:03d}.png')
-        msg = (f'Not enough features in frame {j+start_frame}. Need at least '
-               f'{_FEATURE_PTS_MIN} features, got {num_features}.')
-        if masking == 'pre':
-          raise AssertionError(msg)
-        else:
-          logging.debug(msg)
-          break
-      else:
-        logging.debug('Number of features in frame %s is %d',
-                      str(j+start_frame).zfill(3), num_features)
-      p1, st, _ = cv2.calcOpticalFlowPyrLK(gframe0, gframe1, p0_filtered, None,
-                                           **_CV2_LK_PARAMS)
-      tform = procrustes_rotation(p0_filtered[st == 1], p1[st == 1])
-      if facing == camera_properties_utils.LENS_FACING['BACK']:
-        rotation = -math.atan2(tform[0, 1], tform[0, 0])
-      elif facing == camera_properties_utils.LENS_FACING['FRONT']:
-        rotation = math.atan2(tform[0, 1], tform[0, 0])
+
+  pair_results = [{} for _ in range(num_frames - 1)]
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=os.cpu_count()) as executor:
+    # Do post-masking (original) method 1st
+    for masking, maskings in (('post', ('post', 'pre')), ('pre', ('pre',))):
+      logging.debug('Using %s masking method', masking)
+      stage_start_time = time.time()
+      pair_idxs = [j for j, results in enumerate(pair_results)
+                   if masking not in results]
+      chunks = [pair_idxs[k:k+_CAM_ROTATIONS_CHUNK_SIZE]
+                for k in range(0, len(pair_idxs), _CAM_ROTATIONS_CHUNK_SIZE)]
+      chunk_results = executor.map(
+          functools.partial(_get_pair_rotations, gframes, maskings=maskings,
+                            facing=facing, ymin=ymin, ymax=ymax), chunks)
+      for chunk, results in zip(chunks, chunk_results):
+        for j, result in zip(chunk, results):
+          pair_results[j].update(result)
+      timings[f'{masking}_masking'] = time.time() - stage_start_time
+
+      failed_idxs = [j for j, results in enumerate(pair_results)
+                     if results[masking][0] is None]
+      if not failed_idxs:
+        break
+      j = failed_idxs[0]
+      num_features = len(pair_results[j][masking][1])
+      _write_features_image(
+          gframes[j], pair_results[j][masking][1],
+          f'{file_name_stem}_features{j+start_frame:03d}.png')
+      msg = (f'Not enough features in frame {j+start_frame}. Need at least '
+             f'{_FEATURE_PTS_MIN} features, got {num_features}.')
+      if masking == 'pre':
+        raise AssertionError(msg)
       else:
-        raise AssertionError(f'Unknown lens facing: {facing}.')
-      rotations.append(rotation)
-      if i == 1:
-        # Save debug visualization of features that are being
-        # tracked in the first frame.
-        frame = frames[j]
-        for x, y in np.rint(p0_filtered[st == 1]).astype(int):
-          cv2.circle(frame, (x, y), 3, (100, 255, 255), -1)
-        image_processing_utils.write_image(
-            frame, f'{file_name_stem}_features{j+start_frame:03d}.png')
-    if i == num_frames-1:
-      logging.debug('Correct num of frames found: %d', i)
-      break  # exit if enough features in all frames
-  if i != num_frames-1:
-    raise AssertionError('Neither method found enough features in all frames')
-
-  rotations = np.array(rotations)
+        logging.debug(msg)
+
+  for j, results in enumerate(pair_results):
+    logging.debug('Number of features in frame %s is %d',
+                  str(j+start_frame).zfill(3), len(results[masking][1]))
+  logging.debug('Correct num of frames found: %d', num_frames-1)
+  # Save debug visualization of features that are being
+  # tracked in the first frame.
+  _write_features_image(gframes[0], pair_results[0][masking][2],
+                        f'{file_name_stem}_features{start_frame:03d}.png')
+  logging.debug('Camera rotation timings: %s', ', '.join(
+      f'{stage} {t:.3f}s' for stage, t in timings.items()))
+
+  rotations = np.array([results[masking][0] for results in pair_results])
   rot_per_frame_max = max(abs(rotations))
   logging.debug('Max rotation in frame: %.2f degrees',
                 rot_per_frame_max*_RADS_TO_DEGS)
@@ -600,7 +708,7 @@ def get_best_alignment_offset(cam_times, cam_rots, gyro_events, degree=2):
   Args:
     cam_times: Array of N camera times, one for each frame.
     cam_rots: Array of N-1 camera rotation displacements (rad).
-    gyro_events: List of gyro event objects.
+    gyro_events: SensorTrace or list of gyro event objects.
     degree: Degree of polynomial
 
   Returns:
@@ -609,15 +717,18 @@ def get_best_alignment_offset(cam_times, cam_rots, gyro_events, degree=2):
   # Measure the correlation distance over defined shift
   shift_candidates = np.arange(-_CORR_TIME_OFFSET_MAX,
                                _CORR_TIME_OFFSET_MAX+_CORR_TIME_OFFSET_STEP,
-                               _CORR_TIME_OFFSET_STEP).tolist()
-  spatial_distances = []
-  for shift in shift_candidates:
-    shifted_cam_times = cam_times + shift*_MSEC_TO_NSEC
-    gyro_rots = get_gyro_rotations(gyro_events, shifted_cam_times)
-    spatial_distance = scipy.spatial.distance.correlation(cam_rots, gyro_rots)
+                               _CORR_TIME_OFFSET_STEP)
+  # Integrate the gyro once, and evaluate all shifts as one batch.
+  gyro_integral = _get_cumulative_gyro_rotations(gyro_events)
+  shifted_cam_times = (np.asarray(cam_times)[np.newaxis, :] +
+                       shift_candidates[:, np.newaxis] * _MSEC_TO_NSEC)
+  gyro_rots = _interpolate_gyro_rotations(*gyro_integral, shifted_cam_times)
+  spatial_distances = _correlation_distances(
+      np.asarray(cam_rots, dtype=float), gyro_rots).tolist()
+  shift_candidates = shift_candidates.tolist()
+  for shift, spatial_distance in zip(shift_candidates, spatial_distances):
     logging.debug('shift %.1fms spatial distance: %.5f', shift,
                   spatial_distance)
-    spatial_distances.append(spatial_distance)
 
   best_corr_dist = min(spatial_distances)
   coarse_best_shift = shift_candidates[spatial_distances.index(best_corr_dist)]
@@ -717,18 +828,17 @@ def plot_gyro_events(gyro_events, plot_name, log_path):
   random spikes in data.
 
   Args:
-    gyro_events: List of gyroscope events.
+    gyro_events: SensorTrace or list of gyroscope events.
     plot_name:  name of plot(s).
     log_path: location to save data.
   """
 
   nevents = (len(gyro_events) // _NUM_GYRO_PTS_TO_AVG) * _NUM_GYRO_PTS_TO_AVG
-  gyro_events = gyro_events[:nevents]
-  times = np.array([(e['time'] - gyro_events[0]['time']) * _NSEC_TO_SEC
-                    for e in gyro_events])
-  x = np.array([e['x'] for e in gyro_events])
-  y = np.array([e['y'] for e in gyro_events])
-  z = np.array([e['z'] for e in gyro_events])
+  gyro_trace = imu_processing_utils.get_sensor_trace(gyro_events)[:nevents]
+  times = (gyro_trace['time'] - gyro_trace['time'][0]) * _NSEC_TO_SEC
+  x = gyro_trace['x'].astype(float)
+  y = gyro_trace['y'].astype(float)
+  z = gyro_trace['z'].astype(float)
 
   # Group samples into size-N groups & average each together to minimize random
   # spikes in data.
@@ -776,8 +886,9 @@ def conv_acceleration_to_movement(gyro_events, video_delay_time):
   Returns:
     'z' acceleration converted to movement for times around VIDEO playing.
   """
-  gyro_times = np.array([e['time'] for e in gyro_events])
-  gyro_speed = np.array([e['z'] for e in gyro_events])
+  gyro_trace = imu_processing_utils.get_sensor_trace(gyro_events)
+  gyro_times = gyro_trace['time']
+  gyro_speed = gyro_trace['z'].astype(float)
   gyro_time_min = gyro_times[0]
   logging.debug('gyro start time: %dns', gyro_time_min)
   logging.debug('gyro stop time: %dns', gyro_times[-1])
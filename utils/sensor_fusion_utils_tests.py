@@ -14,11 +14,15 @@
 """Tests for sensor_fusion_utils."""
 
 import math
+import os
+import tempfile
 import unittest
 
+import cv2
 import numpy as np
 from scipy.optimize import fmin
 
+import camera_properties_utils
 import sensor_fusion_utils
 
 
@@ -136,6 +140,18 @@ class SensorFusionUtilsTests(unittest.TestCase):
       self.assertTrue(np.allclose(
           gyro_rots, cam_rots, atol=self._CAM_ROT_AMPLITUDE*0.10), e_msg)
 
+  def test_get_gyro_rotations_batched_shifts(self):
+    """Tests that batched shifted camera times match single calls."""
+    cam_times, _, gyro_events = self._generate_test_waveforms(1000)
+    shifts = np.array([-7.5, 0, 3.25]) * sensor_fusion_utils._MSEC_TO_NSEC
+    batched_rots = sensor_fusion_utils._interpolate_gyro_rotations(
+        *sensor_fusion_utils._get_cumulative_gyro_rotations(gyro_events),
+        cam_times[np.newaxis, :] + shifts[:, np.newaxis])
+    for shift, rots in zip(shifts, batched_rots):
+      np.testing.assert_allclose(
+          rots, sensor_fusion_utils.get_gyro_rotations(
+              gyro_events, cam_times + shift), atol=1e-12)
+
   def test_get_best_alignment_offset(self):
     """Unit test for alignment offset check."""
 
@@ -156,6 +172,30 @@ class SensorFusionUtilsTests(unittest.TestCase):
       self.assertTrue(
           math.isclose(t_offset_ms, best_fit_offset, abs_tol=0.1), e_msg)
 
+  def test_get_cam_rotations(self):
+    """Tests rotations of rotated frames, with post- and pre-masking."""
+    w, h = 320, 240
+    angles = [0, 0.3, 0.8, 1.0, 0.6]  # degrees
+    rng = np.random.default_rng(0)
+    checks = (rng.random((h // 8, w // 8)) > 0.5).astype(np.uint8) * 255
+    checks = cv2.GaussianBlur(
+        cv2.resize(checks, (w, h), interpolation=cv2.INTER_NEAREST), (5, 5), 1)
+    low_contrast_center = checks.copy()
+    # Features in the center are weaker than elsewhere, so post-masking fails
+    low_contrast_center[h // 3:h * 2 // 3] //= 5
+    for img in (checks, low_contrast_center):
+      frames = [
+          np.dstack([cv2.warpAffine(
+              img, cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1),
+              (w, h))] * 3)
+          for angle in angles]
+      with tempfile.TemporaryDirectory() as tmp_dir:
+        rotations = sensor_fusion_utils.get_cam_rotations(
+            frames, camera_properties_utils.LENS_FACING['BACK'], h,
+            os.path.join(tmp_dir, 'test'), 0, stabilized_video=True)
+      np.testing.assert_allclose(
+          rotations, -np.radians(np.diff(angles)), atol=2e-4)
+
   def test_polynomial_from_coefficients(self):
     """Unit test to check polynomial function generated from coefficients."""
     # -2x^4 + 3x^3 + 4x^2 + 5x - 6
@@ -0,0 +1,191 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Session broker sharing one ItsService connection across test processes.
+
+Starting ItsService (logcat flush, force-stop, restart, wait for 'ItsService
+ready') and forwarding its port costs several seconds for every ItsSession.
+The broker does this once, keeps the forwarded device socket open, and relays
+it to ItsSession clients connecting over a local socket. ItsSession finds the
+broker through its_session_utils.SESSION_BROKER_ENV, which is inherited by the
+test processes started by tools/run_all_tests.py.
+
+Clients are served one at a time. ItsService is only restarted when the
+device socket was closed or failed while relaying a previous client.
+"""
+
+
+import logging
+import os
+import select
+import socket
+import threading
+
+import its_session_utils
+
+_ACCEPT_POLL_SEC = 0.5  # how often the serving thread checks for stop
+_DRAIN_QUIET_SEC = 0.5  # device socket quiet time before serving next client
+_LISTEN_BACKLOG = 4
+_RELAY_CHUNK_SIZE = 1024 * 1024
+
+
+class ItsSessionBroker(object):
+  """Owns the ItsService socket of one device and relays it to clients.
+
+  Usage:
+    with session_broker_utils.ItsSessionBroker(device_id):
+      # ItsSession objects for device_id created here, or in subprocesses
+      # started here, connect through the broker.
+
+  Attributes:
+    device_id: str; ID of the device.
+    port: int; local port the broker listens on, None if not started.
+    num_clients: number of client connections served.
+    num_recoveries: number of times ItsService was restarted after a failure.
+  """
+
+  def __init__(self, device_id, session=None):
+    """Initializes the broker.
+
+    Args:
+      device_id: str; ID of the device.
+      session: optional object with 'sock' and 'restart_service()' to use as
+        the device connection. Defaults to a new ItsSession for device_id.
+    """
+    self.device_id = device_id
+    self.port = None
+    self.num_clients = 0
+    self.num_recoveries = 0
+    self._session = session
+    self._device_healthy = True
+    self._server_sock = None
+    self._thread = None
+    self._stop_event = threading.Event()
+    self._prev_env = None
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exec_type, exec_value, exec_traceback):
+    self.stop()
+    return False
+
+  def start(self):
+    """Connects to ItsService, starts serving and exports the broker port."""
+    if self._session is None:
+      self._session = its_session_utils.ItsSession(device_id=self.device_id)
+    self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._server_sock.bind((its_session_utils.ItsSession.IPADDR, 0))
+    self._server_sock.listen(_LISTEN_BACKLOG)
+    self.port = self._server_sock.getsockname()[1]
+    self._stop_event.clear()
+    self._thread = threading.Thread(target=self._serve, daemon=True)
+    self._thread.start()
+    self._prev_env = os.environ.get(its_session_utils.SESSION_BROKER_ENV)
+    os.environ[its_session_utils.SESSION_BROKER_ENV] = (
+        f'{self.device_id}:{self.port}')
+    logging.debug('Session broker for %s listening on port %d',
+                  self.device_id, self.port)
+
+  def stop(self):
+    """Stops serving, closes the device socket and restores the environment."""
+    if self._thread is None:
+      return
+    if self._prev_env is None:
+      os.environ.pop(its_session_utils.SESSION_BROKER_ENV, None)
+    else:
+      os.environ[its_session_utils.SESSION_BROKER_ENV] = self._prev_env
+    self._stop_event.set()
+    self._thread.join()
+    self._thread = None
+    self._server_sock.close()
+    self._server_sock = None
+    if self._session.sock:
+      self._session.sock.close()
+    logging.debug('Session broker for %s served %d clients, %d recoveries',
+                  self.device_id, self.num_clients, self.num_recoveries)
+
+  def _serve(self):
+    """Accepts clients one at a time until stopped."""
+    while not self._stop_event.is_set():
+      readable, _, _ = select.select(
+          [self._server_sock], [], [], _ACCEPT_POLL_SEC)
+      if not readable:
+        continue
+      client, _ = self._server_sock.accept()
+      with client:
+        self.num_clients += 1
+        if not self._device_healthy and not self._recover():
+          continue
+        self._relay(client)
+      if self._device_healthy:
+        self._drain_device()
+
+  def _recover(self):
+    """Restarts ItsService after a device socket failure.
+
+    Returns:
+      True if the device socket was reconnected.
+    """
+    logging.info('Restarting ItsService on %s', self.device_id)
+    try:
+      self._session.restart_service()
+    except Exception as e:  # pylint: disable=broad-except
+      logging.error('ItsService restart failed: %s', e)
+      return False
+    self._device_healthy = True
+    self.num_recoveries += 1
+    return True
+
+  def _relay(self, client):
+    """Copies bytes between client and device until either side closes."""
+    device = self._session.sock
+    while not self._stop_event.is_set():
+      readable, _, _ = select.select(
+          [client, device], [], [], _ACCEPT_POLL_SEC)
+      for src in readable:
+        dst = device if src is client else client
+        try:
+          data = src.recv(_RELAY_CHUNK_SIZE)
+        except OSError:
+          data = b''
+        if not data:
+          closed = src
+        else:
+          try:
+            dst.sendall(data)
+            continue
+          except OSError:
+            closed = dst
+        if closed is device:
+          logging.error('ItsService socket on %s closed', self.device_id)
+          self._device_healthy = False
+        return
+
+  def _drain_device(self):
+    """Discards responses still in flight for a client that has gone away."""
+    device = self._session.sock
+    while True:
+      readable, _, _ = select.select([device], [], [], _DRAIN_QUIET_SEC)
+      if not readable:
+        return
+      try:
+        data = device.recv(_RELAY_CHUNK_SIZE)
+      except OSError:
+        data = b''
+      if not data:
+        self._device_healthy = False
+        return
+      logging.debug('Discarded %d stale bytes from ItsService', len(data))
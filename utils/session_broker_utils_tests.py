@@ -0,0 +1,94 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for session_broker_utils."""
+
+import json
+import os
+import socket
+import threading
+import unittest
+
+import error_util
+import its_session_utils
+import session_broker_utils
+
+_DEVICE_ID = 'FAKE_DUT:5555'
+
+
+class _FakeItsService(object):
+  """Answers checkSensorExistence commands on one end of a socketpair."""
+
+  def __init__(self):
+    self.sock = None
+    self.num_starts = 0
+    self._device_sock = None
+    self.restart_service()
+
+  def restart_service(self):
+    self.sock, self._device_sock = socket.socketpair()
+    self.num_starts += 1
+    threading.Thread(target=self._respond, args=(self._device_sock,),
+                     daemon=True).start()
+
+  def kill(self):
+    self._device_sock.shutdown(socket.SHUT_RDWR)
+
+  def _respond(self, device_sock):
+    with device_sock.makefile('rb') as f:
+      for line in f:
+        if json.loads(line)['cmdName'] == 'checkSensorExistence':
+          response = {'tag': 'sensorExistence', 'objValue': {'gyro': True}}
+          device_sock.sendall(json.dumps(response).encode() + b'\n')
+
+
+class SessionBrokerUtilsTests(unittest.TestCase):
+  """Run a suite of unit tests on this module."""
+
+  def setUp(self):
+    super().setUp()
+    self.service = _FakeItsService()
+    self.broker = session_broker_utils.ItsSessionBroker(
+        _DEVICE_ID, session=self.service)
+    self.broker.start()
+    self.addCleanup(self.broker.stop)
+
+  def test_broker_env_and_port(self):
+    self.assertEqual(
+        os.environ[its_session_utils.SESSION_BROKER_ENV],
+        f'{_DEVICE_ID}:{self.broker.port}')
+    self.assertEqual(its_session_utils.get_session_broker_port(_DEVICE_ID),
+                     self.broker.port)
+    self.assertIsNone(its_session_utils.get_session_broker_port('OTHER'))
+
+  def test_sessions_share_service(self):
+    for _ in range(3):
+      cam = its_session_utils.ItsSession(device_id=_DEVICE_ID)
+      self.assertEqual(cam.get_sensors(), {'gyro': True})
+      cam.sock.close()
+    self.assertEqual(self.service.num_starts, 1)
+
+  def test_service_restarted_after_failure(self):
+    self.service.kill()
+    cam = its_session_utils.ItsSession(device_id=_DEVICE_ID)
+    with self.assertRaises((error_util.CameraItsError, OSError)):
+      cam.get_sensors()
+    cam.sock.close()
+    cam = its_session_utils.ItsSession(device_id=_DEVICE_ID)
+    self.assertEqual(cam.get_sensors(), {'gyro': True})
+    cam.sock.close()
+    self.assertEqual(self.broker.num_recoveries, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -18,18 +18,24 @@
 # only if supported by the camera device.
 
 
+import functools
+import json
 import logging
 import os.path
-import re
 import subprocess
 import error_util
 import image_processing_utils
+import numpy as np
+from PIL import Image
 
 
 COLORSPACE_HDR = 'bt2020'
 HR_TO_SEC = 3600
-INDEX_FIRST_SUBGROUP = 1
 MIN_TO_SEC = 60
+RGB_CHANNELS = 3
+_VIDEO_PROBE_CACHE_SIZE = 16  # (path, mtime, size) versions of videos kept
+_FFPROBE_PACKET_ENTRIES = 'packet=pts_time,dts_time,duration_time,flags'
+_FFPROBE_KEY_FRAME_FLAG = 'K'
 
 ITS_SUPPORTED_QUALITIES = (
     'HIGH',
@@ -281,6 +287,254 @@ def extract_all_frames_from_video(log_path, video_file_name, img_format):
   return file_list
 
 
+def _get_packet_times(packets, key):
+  """Returns a float numpy array of the key times of packets, NaN if unset."""
+  times = np.full(len(packets), np.nan)
+  for i, packet in enumerate(packets):
+    try:
+      times[i] = float(packet[key])
+    except (KeyError, ValueError):  # missing or 'N/A'
+      pass
+  return times
+
+
+class VideoProbe:
+  """Stream and frame timing metadata of the first video stream of a file.
+
+  Made by probe_video() from the stream and packet entries of one ffprobe
+  call. Packets are demuxed but not decoded, and each holds one frame.
+
+  Attributes:
+    path: str; path of the video file.
+    stream: dict; ffprobe entries of the stream, e.g. 'avg_frame_rate'.
+    pts_times: float numpy array; presentation time of each frame in seconds,
+      NaN if unknown. Frames are in decoding order, like all arrays here.
+    dts_times: float numpy array; decoding time of each frame in seconds.
+    durations: float numpy array; duration of each frame in seconds.
+    key_frames: bool numpy array; True for key frames.
+  """
+
+  def __init__(self, path, stream, packets):
+    self.path = path
+    self.stream = stream
+    self.pts_times = _get_packet_times(packets, 'pts_time')
+    self.dts_times = _get_packet_times(packets, 'dts_time')
+    self.durations = _get_packet_times(packets, 'duration_time')
+    self.key_frames = np.array(
+        [_FFPROBE_KEY_FRAME_FLAG in packet.get('flags', '')
+         for packet in packets], dtype=bool)
+
+  def __len__(self):
+    return len(self.pts_times)
+
+  @property
+  def frame_size(self):
+    """(width, height) of decoded frames, after the display rotation."""
+    rotation = int(self.stream.get('tags', {}).get('rotate', 0))
+    for side_data in self.stream.get('side_data_list', []):
+      rotation = int(side_data.get('rotation', rotation))
+    width, height = self.stream['width'], self.stream['height']
+    if rotation % 180:
+      width, height = height, width
+    return width, height
+
+  @property
+  def average_frame_rate(self):
+    """Average frames per second reported for the stream."""
+    num, den = self.stream['avg_frame_rate'].split('/')
+    return int(num) / int(den)
+
+  @property
+  def color_space(self):
+    """Color space of the stream, e.g. 'bt2020nc', or '' if unset."""
+    return self.stream.get('color_space', '')
+
+  def frame_times(self, timestamp_type='pts'):
+    """Returns the known 'pts' or 'dts' times of frames in time order."""
+    if timestamp_type not in ('pts', 'dts'):
+      raise ValueError(f'Unknown timestamp type {timestamp_type}')
+    times = self.pts_times if timestamp_type == 'pts' else self.dts_times
+    return np.sort(times[~np.isnan(times)])
+
+
+@functools.lru_cache(maxsize=_VIDEO_PROBE_CACHE_SIZE)
+def _probe_video(path, mtime_ns, size):
+  """Runs ffprobe on one version of a video file, see probe_video()."""
+  del mtime_ns, size  # only part of the cache key
+  cmd = ['ffprobe',
+         '-v',
+         'quiet',
+         '-select_streams',
+         'v:0',  # first video stream
+         '-show_streams',
+         '-show_entries',
+         _FFPROBE_PACKET_ENTRIES,
+         '-of',
+         'json',
+         path
+        ]
+  logging.debug('Probing video: %s', path)
+  try:
+    raw_output = subprocess.check_output(cmd,
+                                         stdin=subprocess.DEVNULL,
+                                         stderr=subprocess.STDOUT)
+  except subprocess.CalledProcessError as e:
+    raise AssertionError(str(e.output)) from e
+  output = json.loads(raw_output) if raw_output else {}
+  streams = output.get('streams')
+  if not streams:
+    raise AssertionError('ffprobe failed to provide video stream data')
+  probe = VideoProbe(path, streams[0], output.get('packets', []))
+  logging.debug('Probed %d frames of %s', len(probe), path)
+  return probe
+
+
+def probe_video(video_file_name_with_path):
+  """Returns the VideoProbe of a video, running ffprobe once per version.
+
+  Probes are kept per path, modification time and size, so helpers called
+  on the same file share one ffprobe run, and a rewritten file is probed
+  again.
+
+  Args:
+    video_file_name_with_path: path to the video to be analyzed.
+  Returns:
+    VideoProbe of the first video stream.
+  """
+  path = os.path.abspath(video_file_name_with_path)
+  stat = os.stat(path)
+  return _probe_video(path, stat.st_mtime_ns, stat.st_size)
+
+
+def get_video_frame_size(video_file_name_with_path):
+  """Returns (width, height) of the decoded frames of a video.
+
+  ffmpeg rotates decoded frames by the display rotation of the stream, so the
+  stream size is swapped for videos rotated by 90 or 270 degrees.
+
+  Args:
+    video_file_name_with_path: path to the video to be analyzed.
+  Returns:
+    Tuple of ints (width, height) in pixels.
+  """
+  width, height = probe_video(video_file_name_with_path).frame_size
+  logging.debug('Decoded frame size of %s: %dx%d',
+                video_file_name_with_path, width, height)
+  return width, height
+
+
+def get_frame_file_name(video_file_name, frame_number, img_format='png'):
+  """Returns the name extract_all_frames_from_video gives a frame.
+
+  Args:
+    video_file_name: str; name of the video file.
+    frame_number: int; 1-based frame number in the video.
+    img_format: str; type of image file. ex. 'png'
+  Returns:
+    str; frame file name, ex. VID_20220325_050918_preview_frame_0001.png
+  """
+  return (f"{video_file_name.split('.')[0]}_frame_{frame_number:04d}"
+          f'.{img_format}')
+
+
+def write_frame(frame, log_path, video_file_name, frame_number,
+                img_format='png'):
+  """Writes a decoded RGB frame as extract_all_frames_from_video would.
+
+  Args:
+    frame: numpy uint8 array of shape (h, w, 3) in RGB order.
+    log_path: str; path for video file directory.
+    video_file_name: str; name of the video file.
+    frame_number: int; 1-based frame number in the video.
+    img_format: str; type of image to write. ex. 'png'
+  Returns:
+    str; name of the written frame file in log_path.
+  """
+  file_name = get_frame_file_name(video_file_name, frame_number, img_format)
+  Image.fromarray(frame, 'RGB').save(os.path.join(log_path, file_name))
+  return file_name
+
+
+def read_raw_frames(stream, width, height, reuse_buffer=True):
+  """Yields rgb24 frames read from a rawvideo byte stream.
+
+  Args:
+    stream: binary file object with readinto(), ex. an ffmpeg stdout pipe.
+    width: int; frame width in pixels.
+    height: int; frame height in pixels.
+    reuse_buffer: bool; read every frame into the same array. Frames must
+      then be copied by callers that keep them past the next frame.
+  Yields:
+    numpy uint8 arrays of shape (height, width, 3).
+  """
+  frame_size = width * height * RGB_CHANNELS
+  frame = None
+  while True:
+    if frame is None or not reuse_buffer:
+      frame = np.empty((height, width, RGB_CHANNELS), dtype=np.uint8)
+      buf = memoryview(frame).cast('B')
+    num_read = 0
+    while num_read < frame_size:
+      n = stream.readinto(buf[num_read:])
+      if not n:
+        break
+      num_read += n
+    if not num_read:
+      return
+    if num_read < frame_size:
+      raise error_util.CameraItsError(
+          f'Truncated frame: read {num_read} of {frame_size} bytes.')
+    yield frame
+
+
+def iter_video_frames(log_path, video_file_name, reuse_buffer=True,
+                      write_img_format=None):
+  """Decodes all frames of a video through an ffmpeg rawvideo pipe.
+
+  Frames are decoded as extract_all_frames_from_video does, but are streamed
+  into numpy arrays instead of being written to and read back from image
+  files. Iteration can stop early, which stops the decoder.
+
+  Args:
+    log_path: str; path for video file directory.
+    video_file_name: str; name of the video file.
+    reuse_buffer: bool; decode every frame into the same array. Frames must
+      then be copied by callers that keep them past the next frame.
+    write_img_format: (Optional) str; also write every frame to log_path in
+      this format, ex. 'png', named as extract_all_frames_from_video does.
+  Yields:
+    numpy uint8 arrays of shape (h, w, 3) in RGB order.
+  """
+  video_file_name_with_path = os.path.join(log_path, video_file_name)
+  width, height = get_video_frame_size(video_file_name_with_path)
+  cmd = [
+      'ffmpeg', '-i', video_file_name_with_path,
+      '-vsync', 'passthrough',  # prevents frame drops during decoding
+      '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-loglevel', 'quiet', 'pipe:1'
+  ]
+  logging.debug('Decoding frames from: %s', video_file_name)
+  proc = subprocess.Popen(cmd,
+                          stdin=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL)
+  num_frames = 0
+  try:
+    for frame in read_raw_frames(proc.stdout, width, height, reuse_buffer):
+      num_frames += 1
+      if write_img_format:
+        write_frame(frame, log_path, video_file_name, num_frames,
+                    write_img_format)
+      yield frame
+  finally:
+    proc.stdout.close()
+    if proc.poll() is None:
+      proc.kill()
+    proc.wait()
+  logging.debug('Number of decoded frames: %d', num_frames)
+  if not num_frames:
+    raise AssertionError('No frames extracted. Check source video.')
+
+
 def extract_last_key_frame_from_recording(log_path, file_name):
   """Extract last key frame from recordings.
 
@@ -314,36 +568,10 @@ def get_average_frame_rate(video_file_name_with_path):
   Returns:
     Float. average frames per second.
   """
-
-  cmd = ['ffprobe',
-         '-v',
-         'quiet',
-         '-show_streams',
-         '-select_streams',
-         'v:0',  # first video stream
-         video_file_name_with_path
-        ]
-  logging.debug('Getting frame rate')
-  raw_output = ''
-  try:
-    raw_output = subprocess.check_output(cmd,
-                                         stdin=subprocess.DEVNULL,
-                                         stderr=subprocess.STDOUT)
-  except subprocess.CalledProcessError as e:
-    raise AssertionError(str(e.output)) from e
-  if raw_output:
-    output = str(raw_output.decode('utf-8')).strip()
-    logging.debug('ffprobe command %s output: %s', ' '.join(cmd), output)
-    average_frame_rate_data = (
-        re.search(r'avg_frame_rate=*([0-9]+/[0-9]+)', output)
-        .group(INDEX_FIRST_SUBGROUP)
-    )
-    average_frame_rate = (int(average_frame_rate_data.split('/')[0]) /
-                          int(average_frame_rate_data.split('/')[1]))
-    logging.debug('Average FPS: %.4f', average_frame_rate)
-    return average_frame_rate
-  else:
-    raise AssertionError('ffprobe failed to provide frame rate data')
+  average_frame_rate = probe_video(
+      video_file_name_with_path).average_frame_rate
+  logging.debug('Average FPS: %.4f', average_frame_rate)
+  return average_frame_rate
 
 
 def get_frame_deltas(video_file_name_with_path, timestamp_type='pts'):
@@ -355,38 +583,13 @@ def get_frame_deltas(video_file_name_with_path, timestamp_type='pts'):
   Returns:
     List of floats. Time diffs between frames in seconds.
   """
-
-  cmd = ['ffprobe',
-         '-show_entries',
-         f'frame=pkt_{timestamp_type}_time',
-         '-select_streams',
-         'v',
-         video_file_name_with_path
-         ]
-  logging.debug('Getting frame deltas')
-  raw_output = ''
-  try:
-    raw_output = subprocess.check_output(cmd,
-                                         stdin=subprocess.DEVNULL,
-                                         stderr=subprocess.STDOUT)
-  except subprocess.CalledProcessError as e:
-    raise AssertionError(str(e.output)) from e
-  if raw_output:
-    output = str(raw_output.decode('utf-8')).strip().split('\n')
-    deltas = []
-    prev_time = None
-    for line in output:
-      if timestamp_type not in line:
-        continue
-      curr_time = float(re.search(r'time= *([0-9][0-9\.]*)', line)
-                        .group(INDEX_FIRST_SUBGROUP))
-      if prev_time is not None:
-        deltas.append(curr_time - prev_time)
-      prev_time = curr_time
-    logging.debug('Frame deltas: %s', deltas)
-    return deltas
-  else:
+  frame_times = probe_video(video_file_name_with_path).frame_times(
+      timestamp_type)
+  if not frame_times.size:
     raise AssertionError('ffprobe failed to provide frame delta data')
+  deltas = np.diff(frame_times).tolist()
+  logging.debug('Frame deltas: %s', deltas)
+  return deltas
 
 
 def get_video_colorspace(log_path, video_file_name):
@@ -396,38 +599,9 @@ def get_video_colorspace(log_path, video_file_name):
     log_path: path for video file directory
     video_file_name: name of the video file
   Returns:
-    video colorspace, e.g. BT.2020 or BT.709
+    video colorspace, e.g. bt2020nc or bt709
   """
-
-  cmd = ['ffprobe',
-         '-show_streams',
-         '-select_streams',
-         'v:0',
-         '-of',
-         'json',
-         '-i',
-         os.path.join(log_path, video_file_name)
-         ]
-  logging.debug('Get the video colorspace')
-  raw_output = ''
-  try:
-    raw_output = subprocess.check_output(cmd,
-                                         stdin=subprocess.DEVNULL,
-                                         stderr=subprocess.STDOUT)
-  except subprocess.CalledProcessError as e:
-    raise AssertionError(str(e.output)) from e
-
-  logging.debug('raw_output: %s', raw_output)
-  if raw_output:
-    colorspace = ''
-    output = str(raw_output.decode('utf-8')).strip().split('\n')
-    logging.debug('output: %s', output)
-    for line in output:
-      logging.debug('line: %s', line)
-      metadata = re.search(r'"color_space": ("[a-z0-9]*")', line)
-      if metadata:
-        colorspace = metadata.group(INDEX_FIRST_SUBGROUP)
-    logging.debug('Colorspace: %s', colorspace)
-    return colorspace
-  else:
-    raise AssertionError('ffprobe failed to provide color space')
+  colorspace = probe_video(
+      os.path.join(log_path, video_file_name)).color_space
+  logging.debug('Colorspace: %s', colorspace)
+  return colorspace
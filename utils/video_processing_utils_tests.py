@@ -0,0 +1,103 @@
+# Copyright 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for video_processing_utils."""
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import error_util
+import video_processing_utils
+
+
+class VideoProcessingUtilsTest(unittest.TestCase):
+  """Unit tests for this module."""
+
+  def test_read_raw_frames(self):
+    """Unit test for reading rgb24 frames from a rawvideo stream."""
+    width, height, num_frames = 4, 3, 3
+    frames = np.arange(num_frames * height * width * 3, dtype=np.uint8)
+    frames = frames.reshape(num_frames, height, width, 3)
+    read_frames = [
+        frame.copy() for frame in video_processing_utils.read_raw_frames(
+            io.BytesIO(frames.tobytes()), width, height)]
+    np.testing.assert_array_equal(read_frames, frames)
+    read_frames = list(video_processing_utils.read_raw_frames(
+        io.BytesIO(frames.tobytes()), width, height, reuse_buffer=False))
+    np.testing.assert_array_equal(read_frames, frames)
+
+  def test_read_raw_frames_truncated(self):
+    """Unit test for a rawvideo stream ending mid frame."""
+    stream = io.BytesIO(bytes(4 * 3 * 3 + 5))
+    with self.assertRaises(error_util.CameraItsError):
+      list(video_processing_utils.read_raw_frames(stream, 4, 3))
+
+  def test_get_frame_file_name(self):
+    self.assertEqual(
+        video_processing_utils.get_frame_file_name(
+            'VID_20220325_050918_preview.mp4', 1),
+        'VID_20220325_050918_preview_frame_0001.png')
+
+  def test_video_probe(self):
+    """Unit test for frame timing and stream data of a probed video."""
+    stream = {'width': 1920, 'height': 1080, 'avg_frame_rate': '30000/1001',
+              'color_space': 'bt2020nc',
+              'side_data_list': [{'rotation': -90}]}
+    packets = [
+        {'pts_time': '0.000000', 'dts_time': '0.000000', 'flags': 'K__'},
+        {'pts_time': '0.066000', 'dts_time': '0.033000', 'flags': '___'},
+        {'pts_time': '0.033000', 'dts_time': '0.066000', 'flags': '___'},
+        {'pts_time': 'N/A', 'dts_time': '0.099000', 'flags': '___'},
+    ]
+    probe = video_processing_utils.VideoProbe('video.mp4', stream, packets)
+    self.assertEqual(len(probe), 4)
+    self.assertEqual(probe.frame_size, (1080, 1920))
+    self.assertAlmostEqual(probe.average_frame_rate, 29.97, places=2)
+    self.assertEqual(probe.color_space, 'bt2020nc')
+    np.testing.assert_array_equal(probe.key_frames, [True, False, False, False])
+    np.testing.assert_allclose(probe.frame_times('pts'), [0, 0.033, 0.066])
+    np.testing.assert_allclose(np.diff(probe.frame_times('dts')), 0.033)
+
+  def test_probe_video_runs_ffprobe_once_per_version(self):
+    """Unit test for reusing the probe of an unchanged video."""
+    output = json.dumps({
+        'streams': [{'width': 64, 'height': 48, 'avg_frame_rate': '30/1'}],
+        'packets': [{'pts_time': '0.0'}, {'pts_time': '0.5'}],
+    }).encode()
+    with tempfile.TemporaryDirectory() as log_path:
+      video_path = os.path.join(log_path, 'video.mp4')
+      with open(video_path, 'wb') as f:
+        f.write(b'video')
+      with mock.patch.object(video_processing_utils.subprocess,
+                             'check_output', return_value=output) as ffprobe:
+        self.assertEqual(
+            video_processing_utils.get_average_frame_rate(video_path), 30)
+        self.assertEqual(
+            video_processing_utils.get_frame_deltas(video_path), [0.5])
+        self.assertEqual(
+            video_processing_utils.get_video_frame_size(video_path), (64, 48))
+        self.assertEqual(ffprobe.call_count, 1)
+        with open(video_path, 'wb') as f:
+          f.write(b'new video')
+        video_processing_utils.get_video_colorspace(log_path, 'video.mp4')
+        self.assertEqual(ffprobe.call_count, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -15,7 +15,9 @@
 """
 
 from collections.abc import Iterable
+import concurrent.futures
 import dataclasses
+import itertools
 import logging
 import math
 import cv2
@@ -40,6 +42,9 @@ _MIN_FOCUS_DIST_TOL = 0.80  # allow charts a little closer than min
 _OFFSET_ATOL = 10  # number of pixels
 _OFFSET_RTOL_MIN_FD = 0.30
 _RADIUS_RTOL_MIN_FD = 0.15
+_ROI_CENTER_RTOL = 0.5  # circle found in ROI vs predicted center, in radii
+_ROI_RADIUS_SCALE = 1.5  # ROI half size in predicted circle radii
+_ZOOM_ANALYSIS_NUM_WORKERS = 4
 OFFSET_RTOL = 1.0  # TODO: b/342176245 - enable offset check w/ marker identity
 RADIUS_RTOL = 0.10
 ZOOM_MIN_THRESH = 2.0
@@ -116,12 +121,111 @@ def get_test_tols_and_cap_size(cam, props, chart_distance, debug):
   return test_tols, max(common_sizes)
 
 
+def predict_circle(circle, zoom_ratio, new_zoom_ratio, size):
+  """Predicts where circle at zoom_ratio is at new_zoom_ratio.
+
+  Zooming scales the image about its center.
+
+  Args:
+    circle: [center_x, center_y, radius, ...] found at zoom_ratio.
+    zoom_ratio: float; zoom ratio of the capture circle was found in.
+    new_zoom_ratio: float; zoom ratio to predict the circle at.
+    size: [width, height] of the images.
+
+  Returns:
+    [center_x, center_y, radius] at new_zoom_ratio.
+  """
+  scale = new_zoom_ratio / zoom_ratio
+  ctr_x, ctr_y = size[0] // 2, size[1] // 2
+  return [ctr_x + (circle[0] - ctr_x) * scale,
+          ctr_y + (circle[1] - ctr_y) * scale,
+          circle[2] * scale]
+
+
+def _get_circle_roi(predicted_circle, img_shape):
+  """Returns (x0, y0, x1, y1) of the search region around predicted_circle."""
+  x, y, r = predicted_circle[:3]
+  half = math.ceil(r * _ROI_RADIUS_SCALE)
+  return (max(0, int(x) - half), max(0, int(y) - half),
+          min(img_shape[1], int(x) + half + 1),
+          min(img_shape[0], int(y) + half + 1))
+
+
+def _find_circle_candidates(
+    img, roi, min_area, expected_color, circle_ar_rtol, circlish_rtol,
+    min_circle_pts):
+  """Finds circle candidates of expected_color in roi of img.
+
+  Args:
+    img: numpy img array with pixel values in [0,255] or uint8.
+    roi: (x0, y0, x1, y1) region of img to search.
+    min_area: float; minimum contour area in pixels.
+    expected_color: int 0 --> black, 255 --> white
+    circle_ar_rtol: float aspect ratio relative tolerance
+    circlish_rtol: float contour area vs ideal circle area pi*((w+h)/4)**2
+    min_circle_pts: int minimum number of points to define a circle
+
+  Returns:
+    List of [center_x, center_y, radius, circlish, area] in img coordinates,
+    and binarized roi image.
+  """
+  x0, y0, x1, y1 = roi
+  img_roi = img[y0:y1, x0:x1]
+  if img_roi.dtype != numpy.uint8:
+    img_roi = (img_roi * 255).astype(numpy.uint8)
+
+  # gray scale & otsu threshold to binarize the image
+  gray = cv2.cvtColor(img_roi, cv2.COLOR_BGR2GRAY)
+  _, img_bw = cv2.threshold(
+      gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+  # use OpenCV to find contours (connected components)
+  contours = opencv_processing_utils.find_all_contours(255-img_bw)
+
+  circles = []
+  for contour in contours:
+    area = cv2.contourArea(contour)
+    if area > min_area * _CONTOUR_AREA_LOGGING_THRESH:  # skip tiny contours
+      logging.debug('area: %d, min_area: %d, num_pts: %d, min_circle_pts: %d',
+                    area, min_area, len(contour), min_circle_pts)
+    if area > min_area and len(contour) >= min_circle_pts:
+      shape = opencv_processing_utils.component_shape(contour)
+      radius = (shape['width'] + shape['height']) / 4
+      circle_color = img_bw[shape['cty']][shape['ctx']]
+      circlish = round((math.pi * radius**2) / area, 4)
+      logging.debug('color: %s, circlish: %.2f, WxH: %dx%d',
+                    circle_color, circlish, shape['width'], shape['height'])
+      if (circle_color == expected_color and
+          math.isclose(1, circlish, rel_tol=circlish_rtol) and
+          math.isclose(shape['width'], shape['height'],
+                       rel_tol=circle_ar_rtol)):
+        logging.debug('circle found: r: %.2f, area: %.2f\n', radius, area)
+        circles.append([shape['ctx'] + x0, shape['cty'] + y0, radius,
+                        circlish, area])
+      else:
+        logging.debug('circle rejected: bad color, circlish or aspect ratio\n')
+  return circles, img_bw
+
+
+def _is_circle_inside_roi(circle, predicted_circle, roi, img_shape):
+  """Returns True if circle is the predicted circle, fully inside roi."""
+  x0, y0, x1, y1 = roi
+  x, y, r = circle[:3]
+  if (math.hypot(x - predicted_circle[0], y - predicted_circle[1]) >
+      predicted_circle[2] * _ROI_CENTER_RTOL):
+    return False
+  # ROI edges on the image border don't crop circles more than the image
+  return ((x0 == 0 or x - r > x0) and (y0 == 0 or y - r > y0) and
+          (x1 == img_shape[1] or x + r < x1) and
+          (y1 == img_shape[0] or y + r < y1))
+
+
 def find_center_circle(
     img, img_name, size, zoom_ratio, min_zoom_ratio,
     expected_color=_CIRCLE_COLOR, circle_ar_rtol=_CIRCLE_AR_RTOL,
     circlish_rtol=_CIRCLISH_RTOL, min_circle_pts=_MIN_CIRCLE_PTS,
     fov_ratio=_DEFAULT_FOV_RATIO, debug=False, draw_color=_CV2_RED,
-    write_img=True):
+    write_img=True, predicted_circle=None, image_writer=None):
   """Find circle closest to image center for scene with multiple circles.
 
   Finds all contours in the image. Rejects those too small and not enough
@@ -131,11 +235,17 @@ def find_center_circle(
   If circle is not found due to zoom ratio being larger than ZOOM_MAX_THRESH
   or the circle being cropped, None is returned.
 
+  If predicted_circle is given, e.g. from predict_circle with the circle of
+  the previous zoom step, contours are first searched in a region around it.
+  The whole image is searched if the circle found there is not close to the
+  prediction or is cut by the region.
+
   Note: hierarchy is not used as the hierarchy for black circles changes
   as the zoom level changes.
 
   Args:
-    img: numpy img array with pixel values in [0,255]
+    img: numpy img array with pixel values in [0,255]. uint8 images are
+      annotated in place.
     img_name: str file name for saved image
     size: [width, height] of the image
     zoom_ratio: zoom_ratio for the particular capture
@@ -149,6 +259,9 @@ def find_center_circle(
     draw_color: cv2 color in RGB to draw circle and circle center on the image
     write_img: bool: True - save image with circle and center
                      False - don't save image.
+    predicted_circle: (Optional) [center_x, center_y, radius] expected.
+    image_writer: (Optional) image_processing_utils.BackgroundImageWriter
+      to queue the saved image on.
 
   Returns:
     circle: [center_x, center_y, radius]
@@ -157,57 +270,35 @@ def find_center_circle(
   width, height = size
   min_area = (
       _MIN_AREA_RATIO * width * height * zoom_ratio * zoom_ratio * fov_ratio)
+  img_ctr = [img.shape[1] // 2, img.shape[0] // 2]
+  logging.debug('img center x,y: %d, %d', img_ctr[0], img_ctr[1])
+  logging.debug('min area: %d, min circle pts: %d', min_area, min_circle_pts)
+  logging.debug('circlish_rtol: %.3f', circlish_rtol)
+  candidate_args = (min_area, expected_color, circle_ar_rtol, circlish_rtol,
+                    min_circle_pts)
 
-  # create a copy of image to avoid modification on the original image since
-  # image_processing_utils.convert_image_to_uint8 uses mutable np array methods
-  if debug:
-    img = numpy.ndarray.copy(img)
-
-  # convert [0, 1] image to [0, 255] and cast as uint8
-  if img.dtype != numpy.uint8:
-    img = image_processing_utils.convert_image_to_uint8(img)
-
-  # gray scale & otsu threshold to binarize the image
-  gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-  _, img_bw = cv2.threshold(
-      numpy.uint8(gray), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+  def closest_to_center(circles):
+    return min(
+        circles, key=lambda x: math.hypot(x[0] - img_ctr[0], x[1] - img_ctr[1]))
 
-  # use OpenCV to find contours (connected components)
-  contours = opencv_processing_utils.find_all_contours(255-img_bw)
+  circles = []
+  if predicted_circle is not None:
+    roi = _get_circle_roi(predicted_circle, img.shape)
+    logging.debug('Searching circle in ROI %s', roi)
+    circles, img_bw = _find_circle_candidates(img, roi, *candidate_args)
+    if (not circles or not _is_circle_inside_roi(
+        closest_to_center(circles), predicted_circle, roi, img.shape)):
+      logging.debug('Circle not found in ROI, searching the whole image')
+      circles = []
+  if not circles:
+    circles, img_bw = _find_circle_candidates(
+        img, (0, 0, img.shape[1], img.shape[0]), *candidate_args)
 
   # write copy of image for debug purposes
   if debug:
     img_copy_name = img_name.split('.')[0] + '_copy.jpg'
     image_processing_utils.write_image(numpy.expand_dims(
-        (255-img_bw).astype(numpy.float)/255.0, axis=2), img_copy_name)
-
-  # check contours and find the best circle candidates
-  circles = []
-  img_ctr = [gray.shape[1] // 2, gray.shape[0] // 2]
-  logging.debug('img center x,y: %d, %d', img_ctr[0], img_ctr[1])
-  logging.debug('min area: %d, min circle pts: %d', min_area, min_circle_pts)
-  logging.debug('circlish_rtol: %.3f', circlish_rtol)
-
-  for contour in contours:
-    area = cv2.contourArea(contour)
-    if area > min_area * _CONTOUR_AREA_LOGGING_THRESH:  # skip tiny contours
-      logging.debug('area: %d, min_area: %d, num_pts: %d, min_circle_pts: %d',
-                    area, min_area, len(contour), min_circle_pts)
-    if area > min_area and len(contour) >= min_circle_pts:
-      shape = opencv_processing_utils.component_shape(contour)
-      radius = (shape['width'] + shape['height']) / 4
-      circle_color = img_bw[shape['cty']][shape['ctx']]
-      circlish = round((math.pi * radius**2) / area, 4)
-      logging.debug('color: %s, circlish: %.2f, WxH: %dx%d',
-                    circle_color, circlish, shape['width'], shape['height'])
-      if (circle_color == expected_color and
-          math.isclose(1, circlish, rel_tol=circlish_rtol) and
-          math.isclose(shape['width'], shape['height'],
-                       rel_tol=circle_ar_rtol)):
-        logging.debug('circle found: r: %.2f, area: %.2f\n', radius, area)
-        circles.append([shape['ctx'], shape['cty'], radius, circlish, area])
-      else:
-        logging.debug('circle rejected: bad color, circlish or aspect ratio\n')
+        (255-img_bw).astype(float)/255.0, axis=2), img_copy_name)
 
   if not circles:
     zoom_ratio_value = zoom_ratio / min_zoom_ratio
@@ -227,31 +318,88 @@ def find_center_circle(
     logging.debug('circles [x, y, r, pi*r**2/area, area]: %s', str(circles))
 
   # find circle closest to center
-  circle = min(
-      circles, key=lambda x: math.hypot(x[0] - img_ctr[0], x[1] - img_ctr[1]))
+  circle = closest_to_center(circles)
 
   # check if circle is cropped because of zoom factor
   if opencv_processing_utils.is_circle_cropped(circle, size):
     logging.debug('zoom %.2f is too large! Skip further captures', zoom_ratio)
     return None
 
+  # Float images are only converted to annotate and save them
+  if img.dtype != numpy.uint8:
+    if not write_img:
+      return circle
+    img = (img * 255).astype(numpy.uint8)
+
   # mark image center
-  size = gray.shape
-  m_x, m_y = size[1] // 2, size[0] // 2
   marker_size = _CV2_LINE_THICKNESS * 10
-  cv2.drawMarker(img, (m_x, m_y), draw_color, markerType=cv2.MARKER_CROSS,
-                 markerSize=marker_size, thickness=_CV2_LINE_THICKNESS)
+  cv2.drawMarker(img, tuple(img_ctr), draw_color,
+                 markerType=cv2.MARKER_CROSS, markerSize=marker_size,
+                 thickness=_CV2_LINE_THICKNESS)
 
   # add circle to saved image
   center_i = (int(round(circle[0], 0)), int(round(circle[1], 0)))
   radius_i = int(round(circle[2], 0))
   cv2.circle(img, center_i, radius_i, draw_color, _CV2_LINE_THICKNESS)
   if write_img:
-    image_processing_utils.write_image(img / 255.0, img_name)
+    if image_writer is None:
+      image_processing_utils.write_rgb_uint8_image(img, img_name)
+    else:
+      image_writer.write_rgb_uint8_image(img.copy(), img_name)
 
   return circle
 
 
+def iter_center_circles(
+    frames, size, min_zoom_ratio, num_workers=_ZOOM_ANALYSIS_NUM_WORKERS,
+    **kwargs):
+  """Finds the center circles of a zoom sweep on a thread pool.
+
+  Frames are read and analyzed in waves of num_workers frames, with
+  find_center_circle searching each frame around the circle of the last frame
+  analyzed in earlier waves, scaled to its zoom ratio. cv2 releases the GIL
+  while it works. As in a sequential sweep, no frames are analyzed after the
+  first one whose circle is None.
+
+  Args:
+    frames: iterable of (img, img_name, zoom_ratio, circlish_rtol) tuples.
+      Each img must be its own array; uint8 images are annotated in place.
+    size: [width, height] of the images.
+    min_zoom_ratio: min_zoom_ratio supported by the camera device.
+    num_workers: int; number of frames analyzed at once.
+    **kwargs: other find_center_circle arguments, used for all frames.
+
+  Yields:
+    (frame, circle) per frame, in order, up to and including the first frame
+    whose circle is None.
+  """
+  frames = iter(frames)
+  last_circle = None
+  with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+    while True:
+      wave = list(itertools.islice(frames, num_workers))
+      if not wave:
+        return
+      futures = []
+      for img, img_name, zoom_ratio, circlish_rtol in wave:
+        predicted_circle = None
+        if last_circle is not None:
+          predicted_circle = predict_circle(
+              last_circle[0], last_circle[1], zoom_ratio, size)
+        futures.append(executor.submit(
+            find_center_circle, img, img_name, size, zoom_ratio,
+            min_zoom_ratio, circlish_rtol=circlish_rtol,
+            predicted_circle=predicted_circle, **kwargs))
+      for frame, future in zip(wave, futures):
+        circle = future.result()
+        yield frame, circle
+        if circle is None:
+          for f in futures:
+            f.cancel()
+          return
+        last_circle = (circle, frame[2])
+
+
 def preview_zoom_data_to_string(test_data):
   """Returns formatted string from test_data.
 
@@ -16,9 +16,13 @@
 
 import unittest
 
+import cv2
+import numpy
+
 import zoom_capture_utils
 
 
+_CIRCLE_R = 80  # radius at zoom 1; smaller circles fail _CIRCLISH_RTOL
 _CIRCLE_X = 320
 _CIRCLE_Y = 240
 _FOCAL_LENGTH = 1
@@ -98,5 +102,34 @@ class ZoomCaptureUtilsTest(unittest.TestCase):
     )
 
 
+class FindCenterCircleTest(unittest.TestCase):
+  """Unit tests for center circle search over a zoom sweep."""
+
+  def _zoom_img(self, z):
+    img = numpy.full((_IMG_SIZE[1], _IMG_SIZE[0], 3), 255, numpy.uint8)
+    for dx in (-200, 0, 200):
+      cv2.circle(img, (int(_CIRCLE_X + 10*z + dx*z), int(_CIRCLE_Y + 5*z)),
+                 int(_CIRCLE_R*z), (0, 0, 0), -1)
+    return img
+
+  def test_predict_circle(self):
+    circle = zoom_capture_utils.predict_circle(
+        [_CIRCLE_X + 10, _CIRCLE_Y - 20, 30], 1, 2, _IMG_SIZE)
+    self.assertEqual(circle, [_CIRCLE_X + 20, _CIRCLE_Y - 40, 60])
+
+  def test_iter_center_circles_matches_full_search(self):
+    zoom_ratios = [1, 1.25, 1.5, 2, 2.5]
+    frames = [(self._zoom_img(z), f'zoom_{z}.png', z, 0.05)
+              for z in zoom_ratios]
+    circles = [circle for _, circle in zoom_capture_utils.iter_center_circles(
+        frames, _IMG_SIZE, 1, num_workers=2, write_img=False)]
+    self.assertEqual(len(circles), len(zoom_ratios))
+    for z, circle in zip(zoom_ratios, circles):
+      expected = zoom_capture_utils.find_center_circle(
+          self._zoom_img(z), 'zoom.png', _IMG_SIZE, z, 1, write_img=False)
+      self.assertEqual(circle, expected)
+      self.assertAlmostEqual(circle[2], _CIRCLE_R*z, delta=1)
+
+
 if __name__ == '__main__':
   unittest.main()